@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+# Compares parse time and peak memory of the minidom CIB walk against the
+# streaming iterparse reader used by pcrcluster on a generated cib.xml.
+#
+# Usage: bench_cib.py [nodes] [resources] [operations per resource]
+#        bench_cib.py cib.xml
+
+import io
+import os
+import sys
+import time
+import tracemalloc
+import xml.dom.minidom
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+import pcrcluster
+
+def generate_cib(nodes, resources, operations):
+    out = io.StringIO()
+    out.write('<cib crm_feature_set="3.16.2" validate-with="pacemaker-3.7" epoch="12" num_updates="0" admin_epoch="0" have-quorum="1" dc-uuid="1">\n')
+    out.write('  <configuration>\n    <crm_config>\n      <cluster_property_set id="cib-bootstrap-options">\n')
+    out.write('        <nvpair id="cib-bootstrap-options-stonith-enabled" name="stonith-enabled" value="true"/>\n')
+    out.write('      </cluster_property_set>\n    </crm_config>\n    <nodes>\n')
+    for n in range(1, nodes + 1):
+        out.write('      <node id="{0}" uname="node{0}"><instance_attributes id="nodes-{0}"><nvpair id="nodes-{0}-standby" name="standby" value="off"/></instance_attributes></node>\n'.format(n))
+    out.write('    </nodes>\n    <resources>\n')
+    for r in range(resources):
+        out.write('      <group id="g-{0}"><meta_attributes id="g-{0}-meta"><nvpair id="g-{0}-meta-t" name="target-role" value="Started"/></meta_attributes>\n'.format(r))
+        out.write('        <primitive id="rsc-{0}" class="ocf" provider="heartbeat" type="IPaddr2"><instance_attributes id="rsc-{0}-ia"><nvpair id="rsc-{0}-ia-ip" name="ip" value="10.0.{1}.{2}"/></instance_attributes>\n'.format(r, r // 250, r % 250))
+        out.write('          <operations><op id="rsc-{0}-monitor" name="monitor" interval="10s" timeout="20s"/><op id="rsc-{0}-start" name="start" interval="0" timeout="20s"/></operations></primitive>\n'.format(r))
+        out.write('      </group>\n')
+    out.write('    </resources>\n    <constraints>\n')
+    for r in range(1, resources):
+        out.write('      <rsc_colocation id="col-{0}" score="inf" rsc="g-{0}" with-rsc="g-{1}"/>\n'.format(r, r - 1))
+    out.write('    </constraints>\n  </configuration>\n  <status>\n')
+    for n in range(1, nodes + 1):
+        out.write('    <node_state id="{0}" uname="node{0}" in_ccm="true" crmd="online" join="member" expected="member">\n'.format(n))
+        out.write('      <transient_attributes id="{0}"><instance_attributes id="status-{0}"><nvpair id="status-{0}-fail" name="fail-count" value="0"/></instance_attributes></transient_attributes>\n'.format(n))
+        out.write('      <lrm id="{0}"><lrm_resources>\n'.format(n))
+        for r in range(resources):
+            out.write('        <lrm_resource id="rsc-{0}" type="IPaddr2" class="ocf" provider="heartbeat">\n'.format(r))
+            for o in range(operations):
+                out.write('          <lrm_rsc_op id="rsc-{0}_op_{1}" operation_key="rsc-{0}_monitor_{1}" operation="monitor_{1}" on_node="node{2}" call-id="{1}" rc-code="0" op-status="0" interval="10000" exec-time="12" queue-time="0" op-digest="f2317cad3d54cec5d7d7aa7d0bf35cf8"/>\n'.format(r, o, n))
+            out.write('        </lrm_resource>\n')
+        out.write('      </lrm_resources></lrm>\n    </node_state>\n')
+    out.write('  </status>\n</cib>\n')
+    return out.getvalue().encode()
+
+def parse_minidom(content):
+    xdom = xml.dom.minidom.parse(io.BytesIO(content))
+    count = 0
+    for node in xdom.getElementsByTagName('node_state'):
+        for lrm in node.getElementsByTagName('lrm_resource'):
+            count += len(lrm.getElementsByTagName('lrm_rsc_op'))
+    return count
+
+def parse_stream(content):
+    cib_data, node_states = pcrcluster._read_cib_xml(io.BytesIO(content))
+    return sum(len(rsc['operations']) for state in node_states for rsc in state['resources'].values())
+
+def run(label, parse, content):
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = parse(content)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print("{:10} {:8} ops {:10.3f}s {:10.1f} MB peak".format(label, count, elapsed, peak / 1048576))
+    return elapsed, peak
+
+def main():
+    args = sys.argv[1:]
+    if args and os.path.isfile(args[0]):
+        with open(args[0], 'rb') as f:
+            content = f.read()
+    else:
+        sizes = [int(arg) for arg in args] + [4, 500, 20][len(args):]
+        content = generate_cib(*sizes[:3])
+    print("cib.xml    {:.1f} MB".format(len(content) / 1048576))
+    before = run('minidom', parse_minidom, content)
+    after = run('iterparse', parse_stream, content)
+    print("speedup    {:.1f}x time, {:.1f}x peak memory".format(before[0] / after[0], before[1] / after[1]))
+
+if __name__ == "__main__":
+    main()
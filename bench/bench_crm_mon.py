@@ -0,0 +1,117 @@
+#!/usr/bin/python3
+# Compares the crm_mon.txt text scrape against the streaming crm_mon.xml reader
+# on generated crm_mon output with a large resource list, and checks that both
+# produce the same cluster data.
+#
+# Usage: bench_crm_mon.py [resources] [iterations]
+
+import os
+import sys
+import time
+import json
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+import pcrcore
+import pcrcluster
+
+NODES = [
+    ('node1', {'online': 'true', 'is_dc': 'true'}),
+    ('node2', {'online': 'true'}),
+    ('node3', {'online': 'true', 'standby': 'true'}),
+    ('node4', {'online': 'true', 'maintenance': 'true'}),
+    ('node5', {'online': 'false'}),
+    ('node6', {'online': 'false', 'unclean': 'true'}),
+]
+
+def generate_txt(resources):
+    lines = [
+        "Cluster Summary:",
+        "  * Stack: corosync",
+        "  * Current DC: node1 (version 2.1.5+20221208.a3f44794f-150500.6.5.8-2.1.5+20221208.a3f44794f) - partition with quorum",
+        "  * Last updated: Thu Mar 14 15:00:00 2024",
+        "  * {} nodes configured".format(len(NODES)),
+        "  * {} resource instances configured".format(resources + 1),
+        "",
+        "Node List:",
+        "  * Node node3: standby",
+        "  * Node node4: maintenance",
+        "  * Node node6: UNCLEAN (offline)",
+        "  * Online: [ node1 node2 ]",
+        "  * OFFLINE: [ node5 ]",
+        "",
+        "Full List of Resources:",
+        "  * stonith-sbd\t(stonith:external/sbd):\t Started node1",
+    ]
+    for r in range(resources):
+        lines.append("  * rsc-{}\t(ocf::heartbeat:IPaddr2):\t Started node{}".format(r, r % 2 + 1))
+    return "\n".join(lines) + "\n"
+
+def generate_xml(resources):
+    lines = [
+        '<pacemaker-result api-version="2.29" request="crm_mon --output-as=xml">',
+        '  <summary>',
+        '    <stack type="corosync"/>',
+        '    <current_dc present="true" version="2.1.5" name="node1" id="1" with_quorum="true" mixed_version="false"/>',
+        '    <last_update time="Thu Mar 14 15:00:00 2024"/>',
+        '    <nodes_configured number="{}"/>'.format(len(NODES)),
+        '    <resources_configured number="{}" disabled="0" blocked="0"/>'.format(resources + 1),
+        '    <cluster_options stonith-enabled="true" symmetric-cluster="true" no-quorum-policy="stop" maintenance-mode="false" stop-all-resources="false"/>',
+        '  </summary>',
+        '  <nodes>',
+    ]
+    for n, (name, state) in enumerate(NODES):
+        attrs = {'online': 'false', 'standby': 'false', 'maintenance': 'false', 'pending': 'false', 'unclean': 'false', 'is_dc': 'false'}
+        attrs.update(state)
+        lines.append('    <node name="{}" id="{}" {} type="member"/>'.format(name, n + 1, " ".join('{}="{}"'.format(k, v) for k, v in attrs.items())))
+    lines += [
+        '  </nodes>',
+        '  <resources>',
+        '    <resource id="stonith-sbd" resource_agent="stonith:external/sbd" role="Started" active="true" orphaned="false" blocked="false" managed="true" failed="false" failure_ignored="false" nodes_running_on="1">',
+        '      <node name="node1" id="1" cached="true"/>',
+        '    </resource>',
+    ]
+    for r in range(resources):
+        lines.append('    <resource id="rsc-{0}" resource_agent="ocf:heartbeat:IPaddr2" role="Started" active="true" orphaned="false" blocked="false" managed="true" failed="false" failure_ignored="false" nodes_running_on="1">'.format(r))
+        lines.append('      <node name="node{0}" id="{0}" cached="true"/>'.format(r % 2 + 1))
+        lines.append('    </resource>')
+    lines += ['  </resources>', '  <status code="0" message="OK"/>', '</pacemaker-result>']
+    return "\n".join(lines) + "\n"
+
+def new_cluster_data():
+    return {
+        'nodes': {}, 'stonith': {'sbd': {'found': False, 'config': {}}, 'enabled': False},
+        'cnt_nodes_configured': -1, 'cnt_resources_configured': -1, 'has_quorum': False, 'cluster_maintenance': False,
+        'nodes_online': [], 'nodes_offline': [], 'nodes_unclean': [], 'nodes_pending': [], 'nodes_standby': [], 'nodes_maintenance': [],
+    }
+
+def run(label, parse, dirpath, iterations, msg):
+    start = time.perf_counter()
+    for i in range(iterations):
+        cluster_data, found = parse(msg, dirpath, 'node1', new_cluster_data(), False)
+    elapsed = (time.perf_counter() - start) / iterations
+    print("{:10} {:10.2f}ms per file".format(label, elapsed * 1000))
+    return elapsed, cluster_data
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    resources, iterations = (args + [5000, 20][len(args):])[:2]
+    msg = pcrcore.DisplayMessages()
+    msg.set_level(msg.LOG_QUIET)
+    with tempfile.TemporaryDirectory() as dirpath:
+        with open(dirpath + "/crm_mon.txt", "w") as f:
+            f.write(generate_txt(resources))
+        with open(dirpath + "/crm_mon.xml", "w") as f:
+            f.write(generate_xml(resources))
+        print("resources  {} (txt {:.1f} KB, xml {:.1f} KB)".format(resources, os.path.getsize(dirpath + "/crm_mon.txt") / 1024, os.path.getsize(dirpath + "/crm_mon.xml") / 1024))
+        txt = run('text', pcrcluster._parse_crm_mon_txt, dirpath, iterations, msg)
+        xml = run('xml', pcrcluster._parse_crm_mon_xml, dirpath, iterations, msg)
+    same = json.dumps(txt[1], sort_keys=True) == json.dumps(xml[1], sort_keys=True)
+    print("results    {}".format("identical" if same else "DIFFERENT"))
+    if not same:
+        print(json.dumps(txt[1], sort_keys=True))
+        print(json.dumps(xml[1], sort_keys=True))
+    print("ratio      {:.2f}x".format(txt[0] / xml[0]))
+
+if __name__ == "__main__":
+    main()
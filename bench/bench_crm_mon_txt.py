@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+# Compares the previous line by line crm_mon.txt scrape with the table driven
+# tokenizer on generated crm_mon.txt files in the current and the older
+# pacemaker layouts, and checks that both produce the same cluster data.
+#
+# Usage: bench_crm_mon_txt.py [resources] [iterations]
+
+import os
+import re
+import sys
+import time
+import json
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+import pcrcore
+import pcrcluster
+from bench_crm_mon import generate_txt, new_cluster_data
+
+def generate_txt_legacy(resources):
+    lines = [
+        "Stack: corosync",
+        "Current DC: node1 (version 1.1.18+20180430.b12c320f5-3.24.1-b12c320f5) - partition with quorum",
+        "Last updated: Thu Mar 14 15:00:00 2024",
+        "Last change: Thu Mar 14 14:00:00 2024 by root via cibadmin on node1",
+        "",
+        "6 nodes configured",
+        "{} resources configured".format(resources + 1),
+        "",
+        "Node node3: standby",
+        "Node node4: maintenance",
+        "Node node6: UNCLEAN (offline)",
+        "Online: [ node1 node2 ]",
+        "OFFLINE: [ node5 ]",
+        "",
+        "Full list of resources:",
+        "",
+        " stonith-sbd\t(stonith:external/sbd):\tStarted node1",
+    ]
+    for r in range(resources):
+        lines.append(" rsc-{}\t(ocf::heartbeat:IPaddr2):\tStarted node{}".format(r, r % 2 + 1))
+    return "\n".join(lines) + "\n"
+
+def legacy_parse(msg, dirpath, node_name, cluster_data, found_crm_mon):
+    # The per line substring and re.findall cascade used before the tokenizer
+    with open(dirpath + "/crm_mon.txt") as f:
+        filedata = f.read().splitlines()
+    stop_early = False
+    for line in filedata:
+        line = line.strip()
+        if line.startswith('* '):
+            line = line[2:]
+        if line.startswith('##'):
+            if stop_early:
+                break
+            stop_early = True
+            continue
+        if "Resource management is DISABLED" in line:
+            cluster_data['cluster_maintenance'] = True
+        if "partition with quorum" in line:
+            cluster_data['has_quorum'] = True
+        if "Current DC" in line:
+            dc_node_name = line.split()[2]
+            if dc_node_name not in cluster_data['nodes']:
+                cluster_data['nodes'][dc_node_name] = {'is_included': False}
+            cluster_data['nodes'][dc_node_name]['is_dc_crm'] = True
+        if " nodes configured" in line:
+            value = line.split()[0]
+            if value.isdigit():
+                cluster_data['cnt_nodes_configured'] = int(value)
+        if " resource instances configured" in line or " resources configured" in line:
+            value = line.split()[0]
+            if value.isdigit():
+                cluster_data['cnt_resources_configured'] = int(value)
+        if "Online: [" in line:
+            cluster_data['nodes_online'] = re.findall(r"\[(.*?)\]", line)[0].strip().split()
+        if "OFFLINE: [" in line:
+            cluster_data['nodes_offline'] = re.findall(r"\[(.*?)\]", line)[0].strip().split()
+        for state, check_nodes in [('maintenance', 'nodes_maintenance'), ('UNCLEAN', 'nodes_unclean'), ('standby', 'nodes_standby'), ('pending', 'nodes_pending')]:
+            if state in line:
+                entry = re.findall(r"Node (.*?): " + state, line)
+                if entry and entry[0] not in cluster_data[check_nodes]:
+                    cluster_data[check_nodes].append(entry[0])
+        if "stonith:" in line:
+            cluster_data['stonith']['enabled'] = True
+            if "stonith:external/sbd" in line:
+                cluster_data['stonith']['sbd']['found'] = True
+            else:
+                entry = re.findall(r"\(stonith:(.*)\):", line)
+                if entry and entry[0] not in cluster_data['stonith']:
+                    cluster_data['stonith'][entry[0]] = {'found': True}
+    return [cluster_data, True]
+
+def run(label, parse, dirpath, iterations, msg):
+    start = time.perf_counter()
+    for i in range(iterations):
+        cluster_data, found = parse(msg, dirpath, 'node1', new_cluster_data(), False)
+    elapsed = (time.perf_counter() - start) / iterations
+    print("  {:10} {:10.2f}ms per file".format(label, elapsed * 1000))
+    return elapsed, cluster_data
+
+def main():
+    args = [int(arg) for arg in sys.argv[1:]]
+    resources, iterations = (args + [5000, 20][len(args):])[:2]
+    msg = pcrcore.DisplayMessages()
+    msg.set_level(msg.LOG_QUIET)
+    for layout, generate in [('current', generate_txt), ('legacy', generate_txt_legacy)]:
+        with tempfile.TemporaryDirectory() as dirpath:
+            with open(dirpath + "/crm_mon.txt", "w") as f:
+                f.write(generate(resources))
+            print("{} layout, {} resource lines".format(layout, resources + 1))
+            before = run('cascade', legacy_parse, dirpath, iterations, msg)
+            after = run('tokenizer', pcrcluster._parse_crm_mon_txt, dirpath, iterations, msg)
+        same = json.dumps(before[1], sort_keys=True) == json.dumps(after[1], sort_keys=True)
+        print("  results    {}".format("identical" if same else "DIFFERENT"))
+        if not same:
+            print(json.dumps(before[1], sort_keys=True))
+            print(json.dumps(after[1], sort_keys=True))
+        print("  speedup    {:.1f}x".format(before[0] / after[0]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+#!/usr/bin/python3
+# Compares the per path cost of detecting the archive type with
+# file --brief --mime-type against the in-process magic byte sniffer.
+#
+# Usage: bench_sniff.py [iterations] archive [archive ...]
+
+import os
+import sys
+import time
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'modules'))
+import pcrcore
+
+def file_mime_type(path):
+    process = subprocess.Popen(["file", "--brief", "--mime-type", path], stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    stdout, stderr = process.communicate()
+    return stdout.strip()
+
+def run(label, detect, paths, iterations):
+    start = time.perf_counter()
+    for i in range(iterations):
+        for path in paths:
+            detect(path)
+    elapsed = time.perf_counter() - start
+    calls = iterations * len(paths)
+    print("{:10} {:8} calls {:10.3f}s {:12.1f}us per path".format(label, calls, elapsed, elapsed / calls * 1000000))
+    return elapsed
+
+def main():
+    args = sys.argv[1:]
+    iterations = 100
+    if args and args[0].isdigit():
+        iterations = int(args.pop(0))
+    if not args:
+        print("Usage: {} [iterations] archive [archive ...]".format(sys.argv[0]))
+        sys.exit(1)
+    for path in args:
+        print("{:40} file: {:24} sniff: {}".format(os.path.basename(path), file_mime_type(path), pcrcore.sniff_mime_type(path)))
+    print()
+    before = run('file', file_mime_type, args, iterations)
+    after = run('sniff', pcrcore.sniff_mime_type, args, iterations)
+    print("speedup    {:.0f}x".format(before / after))
+
+if __name__ == "__main__":
+    main()
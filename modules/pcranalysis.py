@@ -28,11 +28,124 @@ __date_modified__ = '2025 Nov 11'
 __version__       = '0.0.2'
 
 # IMPORTS
+import re
 import sys
 import json
+from collections import Counter
 from datetime import datetime as dt
 
 import suse_kb
+import pcrcore
+import pcrcluster
+
+VERSION_SEGMENT = re.compile(r'(\d+|[A-Za-z]+)')
+HA_PACKAGES = ['kernel', 'corosync', 'pacemaker', 'resource-agents', 'sbd']
+
+def version_key(version):
+    '''Returns a sort key for a package version-release, numeric segments sort after alphabetic ones as in rpm'''
+    return [(1, int(segment)) if segment.isdigit() else (0, segment) for segment in VERSION_SEGMENT.findall(version)]
+
+def diff_package_inventories(inventories):
+    '''
+    Compares per node package inventories, {node: {package: version}}, against
+    the cluster majority. A package belongs to the majority when more than half
+    of the nodes have it, and its majority version is the one more than half of
+    those nodes have. Returns the nodes that differ with their added, missing
+    and skewed packages. Packages without a strict majority, installed on
+    exactly half of the nodes or without a majority version, are divergent and
+    listed with the nodes per version instead.
+    '''
+    node_count = len(inventories)
+    # Nodes usually share a few identical inventories, count each distinct one once
+    distinct = []
+    for inventory in inventories.values():
+        for group in distinct:
+            if group[0] == inventory:
+                group[1] += 1
+                break
+        else:
+            distinct.append([inventory, 1])
+    presence = Counter()
+    versions = Counter()
+    for inventory, weight in distinct:
+        for package, version in inventory.items():
+            presence[package] += weight
+            versions[(package, version)] += weight
+
+    installed = set()
+    divergent = set()
+    for package, count in presence.items():
+        if count * 2 > node_count:
+            installed.add(package)
+        elif count * 2 == node_count:
+            divergent.add(package)
+    majority = {}
+    for (package, version), count in versions.items():
+        if package in installed and count * 2 > presence[package]:
+            majority[package] = version
+    divergent.update(installed - majority.keys())
+    majority_items = majority.items()
+
+    nodes = {}
+    for node, inventory in inventories.items():
+        if inventory == majority:
+            continue
+        differing = inventory.items() - majority_items
+        missing = installed - inventory.keys()
+        if not differing and not missing:
+            continue
+        added = []
+        skewed = {}
+        for package, version in differing:
+            if package in majority:
+                skewed[package] = {'version': version, 'majority': majority[package]}
+            elif package not in divergent:
+                added.append(package)
+        if added or missing or skewed:
+            nodes[node] = {
+                'added': sorted(added),
+                'missing': sorted(missing),
+                'skewed': dict(sorted(skewed.items())),
+            }
+
+    packages_divergent = {}
+    for package in sorted(divergent):
+        by_version = {}
+        without = []
+        for node, inventory in inventories.items():
+            if package in inventory:
+                by_version.setdefault(inventory[package], []).append(node)
+            else:
+                without.append(node)
+        packages_divergent[package] = {
+            'versions': {version: by_version[version] for version in sorted(by_version, key=version_key, reverse=True)},
+            'without': without,
+        }
+
+    return {
+        'nodes_compared': node_count,
+        'packages_compared': len(presence),
+        'nodes': nodes,
+        'divergent': packages_divergent,
+    }
+
+def describe_package_diff(diff):
+    '''Returns the added, missing and skewed packages of a diff_package_inventories node entry as text'''
+    details = []
+    if diff['skewed']:
+        details.append("skewed " + ", ".join("{} {} (majority {})".format(pkg, skew['version'], skew['majority']) for pkg, skew in diff['skewed'].items()))
+    if diff['missing']:
+        details.append("missing " + ", ".join(diff['missing']))
+    if diff['added']:
+        details.append("added " + ", ".join(diff['added']))
+    return "; ".join(details)
+
+def describe_package_divergence(divergence):
+    '''Returns the nodes per version of a diff_package_inventories divergent entry as text'''
+    details = ["{} on {}".format(version, ' '.join(nodes)) for version, nodes in divergence['versions'].items()]
+    if divergence['without']:
+        details.append("not installed on {}".format(' '.join(divergence['without'])))
+    return "; ".join(details)
 
 class PacemakerClusterAnalysis():
     '''
@@ -59,6 +172,8 @@ class PacemakerClusterAnalysis():
             self.__cpat5: True,
             self.__cpat6: True,
             self.__cpat7: True,
+            self.__cpat8: True,
+            self.__cpat9: True,
         }
         self.count = {
             'total': len(self.pattern_manifest),
@@ -130,6 +245,93 @@ class PacemakerClusterAnalysis():
 # self.report_data['cluster']['cnt_nodes_configured']
 # self.report_data['cluster']['cnt_nodes_included']
 
+    def __cpat9(self):
+        key = 'cpat9'
+        result = {
+            'title': "Consistent Installed Packages Across Nodes",
+            'description': 'Nodes with differing installed packages: None',
+            'product': 'SUSE Linux Enterprise High Availability Extension',
+            'component': 'Maintenance',
+            'subcomponent': 'Packages',
+            'applicable': False,
+            'kb_search_terms': "cluster nodes different package versions",
+            'suggestions': {}
+        }
+        self.msg.verbose(" Searching [{}/{}]".format(self.count['current'], self.count['total']), result['title'])
+        preferred = {}
+
+        # The cluster packages themselves are covered by cpat7
+        inventories = {}
+        for node in self.report_data['cluster']['nodes']:
+            node_data = self.report_data['cluster']['nodes'][node]
+            if( node_data.get('is_included') is True and 'packages' in node_data.get('sysinfo', {}) ):
+                inventories[node] = {pkg: version for pkg, version in node_data['sysinfo']['packages'].items() if pkg not in HA_PACKAGES}
+        package_diffs = diff_package_inventories(inventories)
+        if( package_diffs['nodes'] or package_diffs['divergent'] ):
+            result['description'] = "Nodes with differing installed packages: {}, packages without a majority version: {}".format(' '.join(package_diffs['nodes']) or 'None', len(package_diffs['divergent']))
+            for node, diff in package_diffs['nodes'].items():
+                result['suggestions'][node] = "Align packages with the other cluster nodes: {}".format(describe_package_diff(diff))
+            for package, divergence in package_diffs['divergent'].items():
+                result['suggestions'][package] = "No majority version, align all nodes: {}".format(describe_package_divergence(divergence))
+            result['package_diffs'] = package_diffs
+            result = self.__set_applicable(result, preferred, key)
+        self.analysis_data['results'][key] = result
+
+    def __cpat8(self):
+        key = 'cpat8'
+        result = {
+            'title': "Resource Constraint Integrity",
+            'description': 'Constraints with undefined resources or dependency loops: None',
+            'product': 'SUSE Linux Enterprise High Availability Extension',
+            'component': 'Resources',
+            'subcomponent': 'Constraints',
+            'applicable': False,
+            'kb_search_terms': "resource constraints order colocation",
+            'suggestions': {}
+        }
+        self.msg.verbose(" Searching [{}/{}]".format(self.count['current'], self.count['total']), result['title'])
+        preferred = {
+            "doc1": {
+                "id": "Documentation",
+                "title": "Resource constraints",
+                "url": "https://documentation.suse.com/sle-ha/15-SP7/html/SLE-HA-all/cha-ha-resource-constraints.html",
+            },
+        }
+
+        cluster = self.report_data['cluster']
+        orphaned = {}
+        cycles = []
+        blocked = {}
+        for digest in dict.fromkeys([cluster.get('cib_digest', '')] + list(cluster.get('cibs', {}).keys())):
+            graph = pcrcore.get_cib_graph(self.report_data['source_data']['dirpath_data_source'], digest)
+            if( graph is None ):
+                continue
+            orphaned.update(pcrcluster.cib_orphaned_constraints(graph))
+            for kind, kind_cycles in pcrcluster.cib_dependency_cycles(graph).items():
+                for cycle in kind_cycles:
+                    if( [kind, cycle] not in cycles ):
+                        cycles.append([kind, cycle])
+            for resource_id in pcrcluster.cib_blocked_resources(graph):
+                blocked[resource_id] = [ref for ref in pcrcluster.cib_dependency_chain(graph, resource_id) if pcrcluster.cib_undefined(graph, ref)]
+        if( orphaned or cycles ):
+            details = []
+            if( orphaned ):
+                details.append("undefined resources in {}".format(' '.join(sorted(orphaned))))
+            if( cycles ):
+                details.append("{} dependency loops".format(len(cycles)))
+            result['description'] = "Constraints with {}".format(', '.join(details))
+            for constraint_id, refs in sorted(orphaned.items()):
+                result['suggestions'][constraint_id] = "Remove the constraint or define the missing resources: {}".format(' '.join(refs))
+            for resource_id, refs in sorted(blocked.items()):
+                result['suggestions'][resource_id] = "Depends on undefined resources: {}".format(' '.join(refs))
+            for kind, cycle in cycles:
+                suggestion = "Break the {} loop between: {}".format(kind, ' '.join(cycle))
+                if( cycle[0] in result['suggestions'] ):
+                    suggestion = result['suggestions'][cycle[0]] + "; " + suggestion
+                result['suggestions'][cycle[0]] = suggestion
+            result = self.__set_applicable(result, preferred, key)
+        self.analysis_data['results'][key] = result
+
     def __cpat7(self):
         key = 'cpat7'
         result = {
@@ -151,30 +353,22 @@ class PacemakerClusterAnalysis():
             },
         }
 
-        pkg_version_found = False
-        pkg_versions = {
-            'kernel': '', 
-            'corosync': '', 
-            'pacemaker': '', 
-            'resource-agents': '', 
-            'sbd': '', 
-        }
-        dirty_nodes = {}
-        # Enhancement request: select nodes that have old package versions compared to other nodes
+        inventories = {}
         for node in self.report_data['cluster']['nodes']:
-            if( self.report_data['cluster']['nodes'][node]['is_included'] is True ):
-                for pkg in pkg_versions.keys():
-                    if( pkg_version_found is True ):
-                        if( pkg in self.report_data['cluster']['nodes'][node]['sysinfo'] ):
-                            if( pkg_versions[pkg] != self.report_data['cluster']['nodes'][node]['sysinfo'][pkg] ):
-                                dirty_nodes[node] = True
-                    else:
-                        if( pkg in self.report_data['cluster']['nodes'][node]['sysinfo'] ):
-                            pkg_versions[pkg] = self.report_data['cluster']['nodes'][node]['sysinfo'][pkg]
-                pkg_version_found = True
-        if( dirty_nodes ):
-            node_list = list(dirty_nodes.keys())
+            node_data = self.report_data['cluster']['nodes'][node]
+            if( node_data.get('is_included') is True and 'sysinfo' in node_data ):
+                inventories[node] = {pkg: node_data['sysinfo'][pkg] for pkg in HA_PACKAGES if pkg in node_data['sysinfo']}
+        package_diffs = diff_package_inventories(inventories)
+        if( package_diffs['nodes'] or package_diffs['divergent'] ):
+            node_list = list(package_diffs['nodes'].keys())
+            for divergence in package_diffs['divergent'].values():
+                node_list.extend(node for nodes in divergence['versions'].values() for node in nodes if node not in node_list)
             result['description'] = "Inconsistent package versions: {}".format(' '.join(node_list))
+            for node, diff in package_diffs['nodes'].items():
+                result['suggestions'][node] = "Align packages with the other cluster nodes: {}".format(describe_package_diff(diff))
+            for package, divergence in package_diffs['divergent'].items():
+                result['suggestions'][package] = "No majority version, align all nodes: {}".format(describe_package_divergence(divergence))
+            result['package_diffs'] = package_diffs
             result = self.__set_applicable(result, preferred, key)
         self.analysis_data['results'][key] = result
 
@@ -0,0 +1,1026 @@
+# vim: tabstop=4 expandtab shiftwidth=4 softtabstop=4
+#-*- coding: utf-8 -*-
+'''
+Pacemaker Cluster Report Batch Module
+Copyright (c) 2025 SUSE LLC
+
+Module of functions that process one or more cluster report archives
+'''
+##############################################################################
+#  Copyright (C) 2025 SUSE LLC
+##############################################################################
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; version 2 of the License.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+__author__        = 'Jason Record <jason.record@suse.com>, Raine Curtis <raine.curtis@suse.com>'
+__date_modified__ = '2025 Nov 11'
+__version__       = '0.0.1'
+
+# IMPORTS
+import io
+import os
+import sys
+import stat
+import errno
+import json
+import time
+import shutil
+import signal
+import socket
+import queue
+import threading
+import resource
+import tempfile
+import socketserver
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, BrokenExecutor, as_completed
+
+import pcranalysis as pca
+import pcrcore
+import pcrcluster
+
+NODE_STATES = ['is_included', 'is_running', 'is_dc_crm', 'is_dc_local', 'is_unclean', 'is_pending', 'is_standby', 'is_maintenance']
+NDJSON_KEYS = ['given_source', 'path', 'status', 'message', 'failure', 'patterns_total', 'patterns_applied', 'applicable', 'nodes', 'timings', 'time_elapsed', 'dirpath_reports', 'output_files']
+SANDBOX_JOIN_TIMEOUT = 10
+VALID_MIME_TYPES = [ 'application/x-xz', 'application/x-bzip', 'application/x-bzip2','application/x-gzip', 'application/x-tar', 'application/zstd' ]
+
+def _new_result(given_source):
+    result = {
+        'given_source': given_source,
+        'path': '',
+        'status': 'missing',
+        'message': '',
+        'dirpath_reports': '',
+        'patterns_total': 0,
+        'patterns_applied': 0,
+        'patterns_applied_keys': [],
+        'time_elapsed': 0.0,
+        'timings': {},
+        'failure': {},
+        'applicable': {},
+        'nodes': {},
+        'output_files': {},
+        'output': '',
+    }
+    return result
+
+def _buffered_msg(log_level, description_width):
+    msg = pcrcore.DisplayMessages()
+    msg.set_level(log_level)
+    msg.set_width(description_width)
+    msg.set_output(io.StringIO())
+    return msg
+
+def _set_timing(result, stage, time_start):
+    result['timings'][stage] = round(time.monotonic() - time_start, 3)
+    result['time_elapsed'] = round(sum(result['timings'].values()), 3)
+
+def _skip_entry(msg, options, result, message):
+    result['status'] = 'skipped'
+    result['message'] = message
+    pcrcore.separate_entry(msg, options['width'], options['total'])
+    return [result, None]
+
+def _fail_entry(msg, options, result, exc):
+    result['status'] = 'failed'
+    if isinstance(exc, SystemExit):
+        result['message'] = "Exit code {}".format(exc.code)
+        result['failure'] = {'reason': 'exit', 'exit_code': exc.code}
+    elif isinstance(exc, MemoryError):
+        result['message'] = "Memory limit exceeded"
+        result['failure'] = {'reason': 'memory', 'limit': options.get('memory_limit', 0)}
+    else:
+        result['message'] = "{}: {}".format(type(exc).__name__, str(exc))
+        result['failure'] = {'reason': 'exception', 'exception': type(exc).__name__}
+    msg.min(" ERROR:", "Processing failed - {}".format(result['message']))
+    pcrcore.separate_entry(msg, options['width'], options['total'])
+    return result
+
+def _release_entry(msg, report_data):
+    '''Releases what an archive holds when it will not be cleaned up by analyze_archive'''
+    pcrcore.release_source(report_data)
+    pcrcore.remove_extracted(msg, report_data['source_data'])
+
+def _extract_entry_dir(msg, this_file_data, options):
+    '''
+    Returns a directory of its own for the archive inside its extraction
+    directory when archives are processed concurrently, so archives with the
+    same embedded directory name do not extract into or mount over each
+    other. Returns an empty string when the archive is processed alone.
+    '''
+    if options.get('dirpath_extract_entry', ''):
+        return options['dirpath_extract_entry']
+    if not options.get('isolate_extract', False):
+        return ''
+    try:
+        return tempfile.mkdtemp(prefix=this_file_data['tail'] + '.', dir=this_file_data['dirpath_extract_here'])
+    except OSError as e:
+        msg.min(" ERROR:", "Cannot create extraction directory in {} - {}".format(this_file_data['dirpath_extract_here'], str(e)))
+        sys.exit(13)
+
+def prepare_archive(msg, given_source, count, options):
+    '''
+    Evaluates given_source and extracts it when it is an archive file.
+    Returns the result record and the report_data to gather, or None when
+    there is nothing more to do for given_source.
+    '''
+    time_start = time.monotonic()
+    result = _new_result(given_source)
+    report_data = { 'tool_name': options['tool_name'], 'tool_version': options['tool_version'] }
+    total_args_given = options['total']
+    preconfigured_extraction_path = options['preconfigured_extraction_path']
+    preconfigured_report_path = options['preconfigured_report_path']
+
+    msg.normal("Checking", given_source)
+    this_file_data = pcrcore.evaluate_given_path(msg, given_source)
+    this_file_data['extract_here_for_reports'] = False
+    this_file_data['remove_tarball'] = False
+    this_file_data['remove_directory'] = False
+    this_file_data['triage'] = options.get('triage', False)
+    if this_file_data['triage']:
+        # Headline data only, no log combining or KB searches
+        this_file_data['combine_logs'] = False
+        this_file_data['search_tids'] = False
+    else:
+        this_file_data['combine_logs'] = options['combine_logs']
+        this_file_data['search_tids'] = options['search_tids']
+    this_file_data['resources'] = options.get('resources', {})
+    this_file_data['extract_all'] = options.get('extract_all', False)
+    this_file_data['cleanup'] = options.get('cleanup', 'background')
+    this_file_data['scratch'] = options.get('scratch', {})
+
+    if not this_file_data['exists']:
+        msg.min('Error: File or directory not found - {}'.format(given_source))
+        result['message'] = 'File or directory not found'
+        return [result, None]
+
+    result['path'] = this_file_data['path']
+    if total_args_given > 1:
+        msg.min("Processing [{}/{}]".format(count, total_args_given), this_file_data['path'])
+    else:
+        msg.min("Processing", this_file_data['path'])
+
+    if this_file_data['type'] == 'file':
+        if not this_file_data['tail_mime_type'] in VALID_MIME_TYPES:
+            msg.min(" Missing file", "Not an CRM report compressed file - {0}".format(this_file_data['path']))
+            return _skip_entry(msg, options, result, 'Not an CRM report compressed file')
+        this_file_data['remove_tarball'] = options['remove_archive']
+        this_file_data['remove_directory'] = options['remove_extracted_directory']
+
+        if preconfigured_extraction_path:
+            this_file_data['dirpath_extract_here'] = preconfigured_extraction_path['dirpath_extract_here']
+            this_file_data['extract_here_for_reports'] = preconfigured_extraction_path['extract_here_for_reports']
+        else:
+            if this_file_data['head_write']:
+                this_file_data['dirpath_extract_here'] = this_file_data['head']
+            else:
+                msg.min(" ERROR:", "Write permisson denied, cannot extract file to {0}".format(this_file_data['head']))
+                msg.min(" * Suggestion", "Use -x, --dirpath_extract_here to specify an alternate extraction directory")
+                return _skip_entry(msg, options, result, 'Write permisson denied, cannot extract file')
+        this_file_data['dirpath_extract_entry'] = _extract_entry_dir(msg, this_file_data, options)
+        if this_file_data['dirpath_extract_entry']:
+            this_file_data['dirpath_extract_here'] = this_file_data['dirpath_extract_entry']
+        # Read the report straight from the archive unless the extracted files are kept
+        this_file_data['mounted'] = this_file_data['triage'] or (this_file_data['remove_directory'] and not this_file_data['extract_all'])
+        try:
+            if this_file_data['triage']:
+                archive_dir = pcrcore.mount_archive(msg, this_file_data, pcrcluster.TRIAGE_FILES, pcrcluster.triage_stop_check())
+            elif this_file_data['mounted']:
+                archive_dir = pcrcore.mount_archive(msg, this_file_data, pcrcluster.CONSUMED_FILES)
+            elif this_file_data['extract_all']:
+                archive_dir = pcrcore.extract_archive(msg, this_file_data)
+            else:
+                archive_dir = pcrcore.extract_archive(msg, this_file_data, pcrcluster.CONSUMED_FILES)
+        except BaseException:
+            if this_file_data['dirpath_extract_entry']:
+                shutil.rmtree(this_file_data['dirpath_extract_entry'], ignore_errors=True)
+            raise
+        msg.debug("archive_dir", archive_dir)
+        if pcrcore.valid_archive_dir(msg, archive_dir):
+            this_file_data['valid'] = True
+            this_file_data['dirpath_embedded'] = archive_dir
+            this_file_data['dirpath_data_source'] = this_file_data['dirpath_embedded']
+
+            if preconfigured_report_path:
+                this_file_data['dirpath_reports'] = preconfigured_report_path['path']
+            else:
+                if this_file_data['extract_here_for_reports']:
+                    this_file_data['dirpath_reports'] = preconfigured_extraction_path['dirpath_extract_here']
+                else:
+                    if this_file_data['head_write']:
+                        this_file_data['dirpath_reports'] = this_file_data['path'] + "_reports"
+                    else:
+                        msg.min(" ERROR:", "Write permisson denied, cannot create report file in {0}".format(this_file_data['head']))
+                        msg.min(" * Suggestion", "Use -o, --output to specify an alternate report file directory")
+                        this_file_data['dirpath_embedded'] = archive_dir
+                        _release_entry(msg, {'source_data': this_file_data})
+                        return _skip_entry(msg, options, result, 'Write permisson denied, cannot create report file')
+            report_data['source_data'] = this_file_data
+        else:
+            this_file_data['valid'] = False
+            this_file_data['dirpath_embedded'] = archive_dir
+            report_data['source_data'] = this_file_data
+            _release_entry(msg, report_data)
+
+    elif this_file_data['type'] == 'dir':
+        this_file_data['remove_directory'] = options['remove_archive']
+        if pcrcore.valid_archive_dir(msg, this_file_data['path']):
+            this_file_data['valid'] = True
+            this_file_data['dirpath_data_source'] = this_file_data['path']
+            if preconfigured_report_path:
+                this_file_data['dirpath_reports'] = preconfigured_report_path['path']
+            else:
+                if this_file_data['head_write']:
+                    this_file_data['dirpath_reports'] = this_file_data['path'] + "_reports"
+                else:
+                    msg.min(" ", "Write permisson denied, cannot create report file in {0}".format(this_file_data['head']))
+                    msg.min(" * Suggestion", "Use -o, --output to specify an alternate report file directory")
+                    return _skip_entry(msg, options, result, 'Write permisson denied, cannot create report file')
+            this_file_data['dirpath_data_source'] = this_file_data['path']
+            report_data['source_data'] = this_file_data
+        else:
+            this_file_data['valid'] = False
+            report_data['source_data'] = this_file_data
+
+    elif not this_file_data['tail_read']:
+        msg.min(" ERROR:", "Read permisson denied - {0}".format(this_file_data['path']))
+        msg.min(" * Suggestion", "Use chmod or sudo to elevate read permissions")
+        return _skip_entry(msg, options, result, 'Read permisson denied')
+    else:
+        msg.min(" ERROR:", "Unknown file type - {0}".format(this_file_data['path']))
+        return _skip_entry(msg, options, result, 'Unknown file type')
+
+    _set_timing(result, 'extract', time_start)
+    if not report_data['source_data']['valid']:
+        result['status'] = 'invalid'
+        result['message'] = 'Invalid cluster report directory'
+        pcrcore.separate_entry(msg, options['width'], total_args_given)
+        return [result, None]
+
+    return [result, report_data]
+
+def gather_archive(msg, report_data, result):
+    '''Gathers the cluster data from the prepared report_data source'''
+    time_start = time.monotonic()
+    pcrcore.create_reports_path(msg, report_data['source_data'])
+    this_cluster_data = pcrcluster.get_cluster_data(msg, report_data['source_data'])
+    report_data['cluster'] = this_cluster_data
+    pcrcore.save_report_data(msg, report_data)
+    _set_timing(result, 'gather', time_start)
+
+    return result
+
+def analyze_archive(msg, report_data, result, options):
+    '''Combines the log files, applies the patterns and cleans up the source'''
+    time_start = time.monotonic()
+    if report_data['source_data']['combine_logs'] is True:
+        pcrcluster.synchronize_log_files(msg, report_data)
+    else:
+        msg.min("Log Files", "Combining and Sorting, Disabled")
+    cluster = pca.PacemakerClusterAnalysis(msg, report_data)
+    cluster.analyze()
+    cluster.save_results()
+    pcrcore.clean_up(msg, report_data)
+    result['trash'] = pcrcore.trash.take_pending()
+    analysis_data = cluster.get_results()
+    result['status'] = 'analyzed'
+    result['dirpath_reports'] = report_data['source_data']['dirpath_reports']
+    result['patterns_total'] = analysis_data['patterns_total']
+    result['patterns_applied'] = analysis_data['patterns_applied']
+    result['patterns_applied_keys'] = analysis_data['patterns_applied_keys']
+    for key in analysis_data['patterns_applied_keys']:
+        result['applicable'][key] = analysis_data['results'][key]['description']
+    for node_name, node_data in report_data['cluster']['nodes'].items():
+        result['nodes'][node_name] = {}
+        for state in NODE_STATES:
+            result['nodes'][node_name][state[3:]] = node_data.get(state, False)
+    result['output_files']['report_data'] = result['dirpath_reports'] + "/report_data.json"
+    result['output_files']['analysis_data'] = result['dirpath_reports'] + "/analysis_data.json"
+    for diff_key, diff_data in report_data['cluster']['diffs'].items():
+        result['output_files'][diff_key] = diff_data['filepath_diff']
+    if options.get('return_data'):
+        result['report_data'] = report_data
+        result['analysis_data'] = analysis_data
+    pcrcore.separate_entry(msg, options['width'], options['total'])
+    _set_timing(result, 'analyze', time_start)
+
+    return result
+
+def process_archive(msg, given_source, count, options):
+    '''
+    Extracts, gathers and analyzes a single cluster report archive or directory.
+    Returns a result record summarizing what happened to given_source.
+    '''
+    result, report_data = prepare_archive(msg, given_source, count, options)
+    if report_data:
+        try:
+            gather_archive(msg, report_data, result)
+            analyze_archive(msg, report_data, result, options)
+        finally:
+            # Resident workers outlive a failed archive, release what it holds
+            _release_entry(msg, report_data)
+
+    return result
+
+def _worker_init():
+    # The parent handles interrupts and cancels the outstanding work
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def sandboxed(options):
+    return options.get('timeout', 0) > 0 or options.get('memory_limit', 0) > 0
+
+def _worker_pool(jobs, options):
+    if sandboxed(options):
+        # Each archive runs in its own child process, the threads only wait on them
+        return ThreadPoolExecutor(max_workers=jobs)
+    # The trash purge, lease heartbeat and server handler threads may already be
+    # running, and forking a threaded process can leave the workers holding locks
+    return ProcessPoolExecutor(max_workers=jobs, initializer=_worker_init, mp_context=multiprocessing.get_context('forkserver'))
+
+def _submit(executor, msg, given_source, count, options):
+    if sandboxed(options):
+        worker = run_sandboxed
+    else:
+        worker = _batch_worker
+    return executor.submit(worker, msg.get_level(), msg.desc_width, given_source, count, options)
+
+def _submit_recovering(executor, msg, given_source, count, options, jobs):
+    '''
+    Submits given_source like _submit. A pool broken by a worker that died
+    refuses new work, so it is replaced with a new one first. Returns the
+    executor in use and the future.
+    '''
+    try:
+        return executor, _submit(executor, msg, given_source, count, options)
+    except BrokenExecutor:
+        msg.min(" ERROR:", "A worker process died, restarting the worker pool")
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = _worker_pool(jobs, options)
+        return executor, _submit(executor, msg, given_source, count, options)
+
+def _pool_failure(given_source, exc):
+    result = _new_result(given_source)
+    result['status'] = 'failed'
+    result['message'] = "{}: {}".format(type(exc).__name__, str(exc))
+    if isinstance(exc, BrokenExecutor):
+        result['failure'] = {'reason': 'crashed', 'exception': type(exc).__name__}
+    else:
+        result['failure'] = {'reason': 'exception', 'exception': type(exc).__name__}
+    return result
+
+def _batch_worker(log_level, description_width, given_source, count, options):
+    '''
+    Runs process_archive in a pool worker, buffering its messages so the
+    parent can display each archive's output in the order given.
+    '''
+    msg = _buffered_msg(log_level, description_width)
+    try:
+        result = process_archive(msg, given_source, count, options)
+    except (SystemExit, Exception) as e:
+        result = _fail_entry(msg, options, _new_result(given_source), e)
+        result['trash'] = pcrcore.trash.take_pending()
+    result['output'] = msg.get_output().getvalue()
+
+    return result
+
+def _sandbox_child(conn, log_level, description_width, given_source, count, options):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # A process group of its own lets the parent kill tar and any other helpers on timeout
+    os.setpgid(0, 0)
+    if options.get('memory_limit', 0) > 0:
+        memory_limit = options['memory_limit'] * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    if options.get('dirpath_extract_entry', ''):
+        # Spool files go where the parent removes them if the child is killed
+        tempfile.tempdir = options['dirpath_extract_entry']
+    conn.send(_batch_worker(log_level, description_width, given_source, count, options))
+    conn.close()
+
+def _sandbox_dirs(given_source, options):
+    '''
+    Creates the extraction and scratch directories for a sandboxed archive in
+    the parent and points options at them, so the parent knows what to remove
+    when it kills the child. Returns the directories created.
+    '''
+    dirpaths = {}
+    path = os.path.abspath(given_source)
+    if not os.path.isfile(path):
+        return dirpaths
+    if options['preconfigured_extraction_path']:
+        dirpath_extract_here = options['preconfigured_extraction_path']['dirpath_extract_here']
+    else:
+        dirpath_extract_here = os.path.dirname(path)
+    try:
+        dirpaths['extract'] = tempfile.mkdtemp(prefix=os.path.basename(path) + '.', dir=dirpath_extract_here)
+        options['dirpath_extract_entry'] = dirpaths['extract']
+    except OSError:
+        # prepare_archive in the child reports the extraction directory
+        True
+    scratch = options.get('scratch', {})
+    if scratch.get('path') and scratch.get('size', 0) > 0:
+        try:
+            dirpaths['scratch'] = tempfile.mkdtemp(prefix='pcratool-sandbox-', dir=scratch['path'])
+            options['scratch'] = dict(scratch)
+            options['scratch']['path'] = dirpaths['scratch']
+        except OSError:
+            True
+    return dirpaths
+
+def run_sandboxed(log_level, description_width, given_source, count, options):
+    '''
+    Runs _batch_worker for given_source in a child process limited to
+    options memory_limit megabytes of address space and options timeout
+    seconds of wall clock time. A child that runs out of time or dies
+    returns a failure record instead of taking the batch down with it.
+    '''
+    # Callers run this from pool threads, and forking a threaded process can
+    # leave the child holding locks that are never released
+    context = multiprocessing.get_context('forkserver')
+    sandbox_options = dict(options)
+    dirpaths = _sandbox_dirs(given_source, sandbox_options)
+    parent_conn, child_conn = context.Pipe(duplex=False)
+    child = context.Process(target=_sandbox_child, args=(child_conn, log_level, description_width, given_source, count, sandbox_options))
+    time_start = time.monotonic()
+    child.start()
+    child_conn.close()
+    timeout = options.get('timeout', 0)
+    result = None
+    try:
+        if parent_conn.poll(timeout if timeout > 0 else None):
+            result = parent_conn.recv()
+    except EOFError:
+        result = None
+    if result is None:
+        try:
+            os.killpg(child.pid, signal.SIGKILL)
+        except OSError:
+            # The child has not made its own process group yet
+            child.kill()
+    child.join(SANDBOX_JOIN_TIMEOUT)
+    if child.is_alive():
+        child.kill()
+        child.join(SANDBOX_JOIN_TIMEOUT)
+    parent_conn.close()
+
+    if 'scratch' in dirpaths:
+        shutil.rmtree(dirpaths['scratch'], ignore_errors=True)
+    if 'extract' in dirpaths:
+        if result is None:
+            # Whatever the killed child extracted or spooled is of no use
+            shutil.rmtree(dirpaths['extract'], ignore_errors=True)
+        else:
+            try:
+                # Left empty by an archive that was mounted or skipped
+                os.rmdir(dirpaths['extract'])
+            except OSError:
+                True
+
+    if result is None:
+        msg = _buffered_msg(log_level, description_width)
+        result = _new_result(given_source)
+        result['status'] = 'failed'
+        if child.exitcode == -signal.SIGKILL and time.monotonic() - time_start >= timeout > 0:
+            result['message'] = "Timed out after {} seconds".format(timeout)
+            result['failure'] = {'reason': 'timeout', 'limit': timeout}
+        else:
+            result['message'] = "Worker process ended with exit code {}".format(child.exitcode)
+            result['failure'] = {'reason': 'crashed', 'exit_code': child.exitcode}
+        result['time_elapsed'] = round(time.monotonic() - time_start, 3)
+        msg.min("Processing [{}/{}]".format(count, options['total']) if options['total'] > 1 else "Processing", given_source)
+        msg.min(" ERROR:", "Processing failed - {}".format(result['message']))
+        pcrcore.separate_entry(msg, options['width'], options['total'])
+        result['output'] = msg.get_output().getvalue()
+
+    return result
+
+def process_sandboxed(msg, given_source, count, options):
+    result = run_sandboxed(msg.get_level(), msg.desc_width, given_source, count, options)
+    _finish_result(msg, result, options)
+    return result
+
+def emit_ndjson(result, stream = None):
+    '''Writes the result record as one compact JSON line'''
+    record = {}
+    for key in NDJSON_KEYS:
+        record[key] = result.get(key)
+    print(json.dumps(record, separators=(',', ':')), file=stream or sys.stdout, flush=True)
+
+def _finish_result(msg, result, options):
+    pcrcore.trash.collect(result.pop('trash', []))
+    print(result['output'], end='', file=msg.get_output(), flush=True)
+    if options.get('ndjson'):
+        emit_ndjson(result)
+
+def run_batch(msg, given_sources, options, jobs):
+    '''
+    Processes given_sources with a pool of jobs worker processes. Each archive
+    gets its own report_data, and results are returned in the order given.
+    In NDJSON mode each result is emitted as soon as its archive finishes.
+    '''
+    msg.normal("Batch Mode", "Processing {} archives with {} worker processes".format(len(given_sources), jobs))
+    batch_options = dict(options)
+    batch_options['isolate_extract'] = True
+    executor = _worker_pool(jobs, options)
+    try:
+        futures = []
+        for count, given_source in enumerate(given_sources, start=1):
+            futures.append(_submit(executor, msg, given_source, count, batch_options))
+        if options.get('ndjson'):
+            finished = as_completed(futures)
+        else:
+            finished = futures
+        for future in finished:
+            _finish_result(msg, future.result(), options)
+        results = [ future.result() for future in futures ]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    return results
+
+def run_pipeline(msg, given_sources, options, depth = 1):
+    '''
+    Overlaps the extract, gather and analyze stages across given_sources, so
+    one archive is extracted while the previous one is gathered and the one
+    before that is analyzed. The bounded queues between the stages limit
+    how many extracted archives are waiting on disk at once.
+    '''
+    results = []
+    pipeline_options = dict(options)
+    pipeline_options['isolate_extract'] = True
+    gather_queue = queue.Queue(maxsize=depth)
+    analyze_queue = queue.Queue(maxsize=depth)
+    done_queue = queue.Queue()
+    msg.normal("Pipeline Mode", "Processing {} archives in overlapping stages".format(len(given_sources)))
+
+    def _extract_stage():
+        for count, given_source in enumerate(given_sources, start=1):
+            entry_msg = _buffered_msg(msg.get_level(), msg.desc_width)
+            try:
+                result, report_data = prepare_archive(entry_msg, given_source, count, pipeline_options)
+            except (SystemExit, Exception) as e:
+                result = _fail_entry(entry_msg, options, _new_result(given_source), e)
+                report_data = None
+            gather_queue.put([entry_msg, result, report_data])
+        gather_queue.put(None)
+
+    def _gather_stage():
+        while True:
+            entry = gather_queue.get()
+            if entry is None:
+                break
+            entry_msg, result, report_data = entry
+            if report_data:
+                try:
+                    gather_archive(entry_msg, report_data, result)
+                except (SystemExit, Exception) as e:
+                    _fail_entry(entry_msg, options, result, e)
+                    _release_entry(entry_msg, report_data)
+                    entry[2] = None
+            analyze_queue.put(entry)
+        analyze_queue.put(None)
+
+    def _analyze_stage():
+        while True:
+            entry = analyze_queue.get()
+            if entry is None:
+                break
+            entry_msg, result, report_data = entry
+            if report_data:
+                try:
+                    analyze_archive(entry_msg, report_data, result, options)
+                except (SystemExit, Exception) as e:
+                    _fail_entry(entry_msg, options, result, e)
+                    _release_entry(entry_msg, report_data)
+            done_queue.put(entry)
+        done_queue.put(None)
+
+    for stage in [_extract_stage, _gather_stage, _analyze_stage]:
+        threading.Thread(target=stage, daemon=True).start()
+
+    while True:
+        entry = done_queue.get()
+        if entry is None:
+            break
+        entry_msg, result, report_data = entry
+        result['output'] = entry_msg.get_output().getvalue()
+        _finish_result(msg, result, options)
+        results.append(result)
+
+    return results
+
+def _move_into(msg, path, dirpath):
+    if not os.path.exists(path):
+        return ''
+    destination = os.path.join(dirpath, os.path.basename(path))
+    if os.path.exists(destination):
+        destination = destination + "." + time.strftime("%Y%m%d%H%M%S")
+    try:
+        shutil.move(path, destination)
+    except OSError as e:
+        msg.min(" ERROR:", "Cannot move {} to {} - {}".format(path, dirpath, str(e)))
+        destination = ''
+    return destination
+
+def _spool_candidates(dirpath_spool):
+    candidates = {}
+    with os.scandir(dirpath_spool) as entries:
+        for entry in entries:
+            if entry.name.startswith('.') or not entry.is_file(follow_symlinks=False):
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            candidates[entry.path] = (stat.st_size, stat.st_mtime)
+    return candidates
+
+def watch_spool(msg, dirpath_spool, options, jobs, poll_interval = 5):
+    '''
+    Polls dirpath_spool for new archive files and analyzes them with a fixed
+    pool of worker processes that keep the modules loaded between archives.
+    A file is only dispatched once its size and modification time are stable
+    across two polls. Finished archives are moved into the done or failed
+    subdirectory along with their _reports directory when it is next to them.
+    '''
+    dirpath_done = os.path.join(dirpath_spool, 'done')
+    dirpath_failed = os.path.join(dirpath_spool, 'failed')
+    try:
+        os.makedirs(dirpath_done, exist_ok=True)
+        os.makedirs(dirpath_failed, exist_ok=True)
+    except OSError as e:
+        msg.min(" ERROR:", "{}".format(str(e)))
+        sys.exit(13)
+
+    watch_options = dict(options)
+    watch_options['total'] = 1
+    watch_options['isolate_extract'] = True
+    last_seen = {}
+    pending = {}
+    retried = set()
+    count = 0
+    msg.min("Watching Spool Directory", "{} with {} worker processes".format(dirpath_spool, jobs))
+    executor = _worker_pool(jobs, options)
+    try:
+        while True:
+            current = _spool_candidates(dirpath_spool)
+            for path, signature in current.items():
+                if path in pending:
+                    continue
+                if last_seen.get(path) == signature and signature[0] > 0:
+                    count += 1
+                    msg.verbose("Dispatching Archive [{}]".format(count), path)
+                    executor, pending[path] = _submit_recovering(executor, msg, path, count, watch_options, jobs)
+            last_seen = current
+
+            for path in [ path for path, future in pending.items() if future.done() ]:
+                future = pending.pop(path)
+                try:
+                    result = future.result()
+                except BrokenExecutor as e:
+                    if path not in retried:
+                        # A dying worker fails every archive in its pool, give each one more try
+                        retried.add(path)
+                        msg.verbose("Resubmitting Archive", path)
+                        executor, pending[path] = _submit_recovering(executor, msg, path, count, watch_options, jobs)
+                        continue
+                    result = _pool_failure(path, e)
+                except Exception as e:
+                    result = _pool_failure(path, e)
+                retried.discard(path)
+                _finish_result(msg, result, options)
+                if result['status'] == 'analyzed':
+                    dirpath_finished = dirpath_done
+                else:
+                    dirpath_finished = dirpath_failed
+                destination = _move_into(msg, path, dirpath_finished)
+                _move_into(msg, path + "_reports", dirpath_finished)
+                msg.min("Archive {}".format(result['status'].capitalize()), destination or path)
+                last_seen.pop(path, None)
+
+            time.sleep(poll_interval)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def _server_time(dirpath_leases, owner):
+    # Lease ages are measured with the shared file system's clock, not the
+    # local one, so clock skew between hosts does not expire live leases.
+    clock_file = os.path.join(dirpath_leases, ".clock." + owner)
+    with open(clock_file, 'a'):
+        os.utime(clock_file, None)
+    return os.stat(clock_file).st_mtime
+
+def _claim_lease(dirpath_leases, name, owner):
+    '''
+    Atomically claims the lease for the archive name. The lease is created by
+    hard linking a private file, which is atomic on NFS as well as local
+    file systems. Returns the lease path or an empty string.
+    '''
+    lease_file = os.path.join(dirpath_leases, name + ".lease")
+    private_file = os.path.join(dirpath_leases, ".{}.{}.tmp".format(name, owner))
+    with open(private_file, 'w') as f:
+        f.write("{}\n".format(owner))
+    try:
+        os.link(private_file, lease_file)
+        claimed = True
+    except OSError:
+        # The link may have been created even if the reply was lost
+        claimed = os.stat(private_file).st_nlink == 2
+    finally:
+        os.remove(private_file)
+    if claimed:
+        return lease_file
+    return ''
+
+def _reclaim_stale_lease(msg, dirpath_leases, name, owner, now, lease_timeout):
+    lease_file = os.path.join(dirpath_leases, name + ".lease")
+    try:
+        lease_age = now - os.stat(lease_file).st_mtime
+    except FileNotFoundError:
+        return True
+    if lease_age < lease_timeout:
+        return False
+    # Only one host wins the rename, so the stale lease is removed once
+    stale_file = "{}.stale.{}".format(lease_file, owner)
+    try:
+        os.rename(lease_file, stale_file)
+    except OSError:
+        return False
+    # The lease may have been refreshed, or reclaimed and claimed again by
+    # another host, between the stat and the rename. Put a fresh one back
+    # unless a new lease has been claimed in the meantime.
+    try:
+        lease_age = now - os.stat(stale_file).st_mtime
+        if lease_age < lease_timeout:
+            try:
+                os.link(stale_file, lease_file)
+            except FileExistsError:
+                True
+            return False
+    finally:
+        try:
+            os.remove(stale_file)
+        except OSError:
+            True
+    msg.min("Reclaimed Lease", "{}, abandoned for {}s".format(name, int(lease_age)))
+    return True
+
+def _heartbeat_leases(leases, leases_lock, stop_event, interval):
+    while not stop_event.wait(interval):
+        with leases_lock:
+            lease_files = list(leases.values())
+        for lease_file in lease_files:
+            try:
+                os.utime(lease_file, None)
+            except OSError:
+                True
+
+def run_queue(msg, dirpath_queue, options, jobs, lease_timeout = 300, poll_interval = 5):
+    '''
+    Shares the archives in dirpath_queue between several pcratool instances,
+    possibly on different hosts mounting the same directory. Each instance
+    claims an archive with a lease file in the .leases subdirectory, keeps
+    it alive with a heartbeat while analyzing, and reclaims leases that have
+    not been refreshed within lease_timeout seconds. Finished archives are
+    moved into the done or failed subdirectory. Returns the result records
+    of the archives this instance analyzed once the queue is empty.
+    '''
+    dirpath_leases = os.path.join(dirpath_queue, '.leases')
+    dirpath_done = os.path.join(dirpath_queue, 'done')
+    dirpath_failed = os.path.join(dirpath_queue, 'failed')
+    try:
+        for dirpath in [dirpath_leases, dirpath_done, dirpath_failed]:
+            os.makedirs(dirpath, exist_ok=True)
+    except OSError as e:
+        msg.min(" ERROR:", "{}".format(str(e)))
+        sys.exit(13)
+
+    owner = "{}.{}".format(socket.gethostname(), os.getpid())
+    queue_options = dict(options)
+    queue_options['total'] = 1
+    queue_options['isolate_extract'] = True
+    results = []
+    last_seen = {}
+    pending = {}
+    retried = set()
+    leases = {}
+    leases_lock = threading.Lock()
+    stop_event = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat_leases, args=(leases, leases_lock, stop_event, max(1, lease_timeout // 3)), daemon=True)
+    heartbeat.start()
+    count = 0
+    msg.min("Shared Queue Directory", "{} with {} worker processes as {}".format(dirpath_queue, jobs, owner))
+    executor = _worker_pool(jobs, options)
+    try:
+        while True:
+            current = _spool_candidates(dirpath_queue)
+            if not current and not pending:
+                break
+            now = _server_time(dirpath_leases, owner)
+            for path, signature in current.items():
+                if len(pending) >= jobs:
+                    break
+                if path in pending or last_seen.get(path) != signature:
+                    continue
+                name = os.path.basename(path)
+                if not _reclaim_stale_lease(msg, dirpath_leases, name, owner, now, lease_timeout):
+                    continue
+                lease_file = _claim_lease(dirpath_leases, name, owner)
+                if not lease_file:
+                    continue
+                if not os.path.exists(path):
+                    # Another host finished it between the scan and the claim
+                    os.remove(lease_file)
+                    continue
+                with leases_lock:
+                    leases[path] = lease_file
+                count += 1
+                msg.verbose("Claimed Archive [{}]".format(count), path)
+                executor, pending[path] = _submit_recovering(executor, msg, path, count, queue_options, jobs)
+            last_seen = current
+
+            for path in [ path for path, future in pending.items() if future.done() ]:
+                future = pending.pop(path)
+                try:
+                    result = future.result()
+                except BrokenExecutor as e:
+                    if path not in retried:
+                        # A dying worker fails every archive in its pool, give each one more
+                        # try while still holding its lease
+                        retried.add(path)
+                        msg.verbose("Resubmitting Archive", path)
+                        executor, pending[path] = _submit_recovering(executor, msg, path, count, queue_options, jobs)
+                        continue
+                    result = _pool_failure(path, e)
+                except Exception as e:
+                    result = _pool_failure(path, e)
+                retried.discard(path)
+                _finish_result(msg, result, options)
+                if result['status'] == 'analyzed':
+                    dirpath_finished = dirpath_done
+                else:
+                    dirpath_finished = dirpath_failed
+                destination = _move_into(msg, path, dirpath_finished)
+                _move_into(msg, path + "_reports", dirpath_finished)
+                msg.min("Archive {}".format(result['status'].capitalize()), destination or path)
+                with leases_lock:
+                    lease_file = leases.pop(path)
+                try:
+                    os.remove(lease_file)
+                except OSError:
+                    True
+                results.append(result)
+
+            if pending or current:
+                time.sleep(poll_interval)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        stop_event.set()
+        try:
+            os.remove(os.path.join(dirpath_leases, ".clock." + owner))
+        except OSError:
+            True
+
+    return results
+
+class _AnalysisRequestHandler(socketserver.StreamRequestHandler):
+    '''Reads one JSON request per line and writes one JSON response per line'''
+
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {'status': 'error', 'message': "Invalid JSON request - {}".format(str(e))}
+            else:
+                response = self.server.analyze(request)
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+
+def _remove_stale_socket(socket_path):
+    '''
+    Removes socket_path when it is a socket nothing listens on any more, left
+    by a server that did not shut down. Raises OSError for anything else at
+    that path, including a socket another server is still listening on.
+    '''
+    try:
+        mode = os.lstat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise OSError(errno.EEXIST, "File exists and is not a socket", socket_path)
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except ConnectionRefusedError:
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise OSError(errno.EADDRINUSE, "Another server is listening", socket_path)
+
+class AnalysisServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''
+    Resident analysis server listening on a Unix socket. The worker pool is
+    created once, so each request only pays for its own analysis. Requests
+    are JSON objects with a path and optional combine_logs and search_tids
+    booleans. Responses carry the result record with its report_data and
+    analysis_data. At most jobs requests are analyzed at the same time.
+    '''
+    daemon_threads = True
+    REQUEST_OPTIONS = ['combine_logs', 'search_tids', 'extract_all', 'triage']
+
+    def __init__(self, msg, socket_path, options, jobs):
+        self.msg = msg
+        self.socket_path = socket_path
+        self.options = dict(options)
+        self.options['total'] = 1
+        self.options['return_data'] = True
+        self.options['isolate_extract'] = True
+        self.jobs = jobs
+        self.count = 0
+        self.count_lock = threading.Lock()
+        _remove_stale_socket(self.socket_path)
+        socketserver.UnixStreamServer.__init__(self, self.socket_path, _AnalysisRequestHandler)
+        os.chmod(self.socket_path, 0o660)
+        self.executor = _worker_pool(jobs, options)
+        self.executor_lock = threading.Lock()
+
+    def submit(self, given_source, count, request_options):
+        # Handler threads share the pool, only one of them replaces it when it is broken
+        with self.executor_lock:
+            self.executor, future = _submit_recovering(self.executor, self.msg, given_source, count, request_options, self.jobs)
+        return future
+
+    def analyze(self, request):
+        if not isinstance(request, dict) or not isinstance(request.get('path'), str):
+            return {'status': 'error', 'message': "Request requires a path string"}
+        request_options = dict(self.options)
+        for key in self.REQUEST_OPTIONS:
+            if isinstance(request.get(key), bool):
+                request_options[key] = request[key]
+        with self.count_lock:
+            self.count += 1
+            count = self.count
+        self.msg.normal("Request [{}]".format(count), request['path'])
+        future = self.submit(request['path'], count, request_options)
+        try:
+            try:
+                result = future.result()
+            except BrokenExecutor:
+                # A dying worker fails every request in the pool, give each one more try
+                self.msg.verbose("Resubmitting Request [{}]".format(count), request['path'])
+                result = self.submit(request['path'], count, request_options).result()
+        except Exception as e:
+            result = _pool_failure(request['path'], e)
+        pcrcore.trash.collect(result.pop('trash', []))
+        self.msg.min("Request [{}] {}".format(count, result['status'].capitalize()), "{}, {}s".format(result['path'] or request['path'], result['time_elapsed']))
+
+        return result
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        with self.executor_lock:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            True
+
+def run_server(msg, socket_path, options, jobs):
+    try:
+        server = AnalysisServer(msg, socket_path, options, jobs)
+    except OSError as e:
+        msg.min(" ERROR:", "Cannot listen on {} - {}".format(socket_path, str(e)))
+        sys.exit(13)
+    msg.min("Analysis Server", "Listening on {} with {} worker processes".format(socket_path, jobs))
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+def display_summary(msg, results):
+    total = len(results)
+    status_count = {}
+    for result in results:
+        status_count[result['status']] = status_count.get(result['status'], 0) + 1
+    msg.min("Batch Summary", "Total: {}, Analyzed: {}, Skipped: {}, Invalid: {}, Missing: {}, Failed: {}".format(total,
+        status_count.get('analyzed', 0), status_count.get('skipped', 0), status_count.get('invalid', 0),
+        status_count.get('missing', 0), status_count.get('failed', 0)))
+    for count, result in enumerate(results, start=1):
+        tag = " [{}/{}] {}".format(count, total, result['status'].capitalize())
+        if result['status'] == 'analyzed':
+            msg.min(tag, "{}, Applicable Patterns: {}/{}, {}s".format(result['path'], result['patterns_applied'], result['patterns_total'], result['time_elapsed']))
+            msg.normal("  Report Files Directory", result['dirpath_reports'])
+        else:
+            msg.min(tag, "{} - {}".format(result['path'] or result['given_source'], result['message']))
@@ -28,11 +28,156 @@ __date_modified__ = '2025 Oct 09'
 __version__       = '0.0.1'
 
 # IMPORTS
+import io
 import os
 import re
 import sys
-import xml.dom.minidom
+import time
+import heapq
+import hashlib
+import contextlib
+import tempfile
+import multiprocessing
+import xml.parsers.expat
+import xml.etree.ElementTree as ET
+from shutil import rmtree
 from datetime import datetime as dt
+from concurrent.futures import ProcessPoolExecutor
+
+import pcrcore
+
+LOG_MERGE_BUFFER_LINES = 1000000
+LOG_MERGE_FAN_IN = 64
+PARALLEL_PARSE_MIN_BYTES = 1048576
+PARALLEL_PARSE_TIMEOUT = 600
+SYSSTATS_COMMAND = re.compile(r'^#+\s*Run\s+"(.*)"')
+# sysinfo.txt "Key: value" lines and the sysinfo keys they fill
+SYSINFO_FIELDS = {
+    'CRM Version': 'crm',
+    'Platform': 'platform',
+    'Kernel release': 'kernel',
+    'Architecture': 'arch',
+    'Distribution': 'distribution',
+}
+SYSINFO_CLUSTER_PACKAGES = ['corosync', 'pacemaker', 'resource-agents', 'sbd']
+SYSINFO_PACKAGE = re.compile(r'^([\w.+-]+) (\d[^\s]*)(?: |$)')
+CIB_CONTAINER_TAGS = ('group', 'clone', 'master')
+# crm_mon.txt section headers of the current and older pacemaker layouts
+CRM_MON_SECTIONS = {
+    'Cluster Summary:': 'summary',
+    'Node List:': 'nodes',
+    'Full List of Resources:': 'resources',
+    'Full list of resources:': 'resources',
+    'Active Resources:': 'resources',
+    'Inactive Resources:': 'resources',
+    'Node Attributes:': 'attributes',
+    'Migration Summary:': 'migration',
+    'Failed Resource Actions:': 'failures',
+    'Failed Actions:': 'failures',
+    'Fencing History:': 'fencing',
+    'Failed Fencing Actions:': 'fencing',
+    'Pending Fencing Actions:': 'fencing',
+    'Operations:': 'operations',
+    'Negative Location Constraints:': 'constraints',
+    'Tickets:': 'tickets',
+}
+CRM_MON_STATE_SECTIONS = frozenset(['summary', 'nodes'])
+CRM_MON_RESOURCE_SECTIONS = frozenset(['summary', 'resources'])
+# First word of a crm_mon.txt line: (token, pattern)
+CRM_MON_TOKENS = {
+    'Current': ('dc', re.compile(r'^Current DC: (\S+)(?:.*(partition with quorum))?')),
+    'Online:': ('online', re.compile(r'\[(.*?)\]')),
+    'OFFLINE:': ('offline', re.compile(r'\[(.*?)\]')),
+    'Node': ('node_state', re.compile(r'^Node (.*?): (maintenance|UNCLEAN|standby|pending)')),
+    '***': ('maintenance', re.compile(r'Resource management is DISABLED')),
+}
+CRM_MON_CONFIGURED = re.compile(r'^(\d+) (nodes|resources|resource instances) configured')
+CRM_MON_STONITH = re.compile(r'\(stonith:([^)]*)\)')
+CRM_MON_NODE_STATES = {
+    'maintenance': 'nodes_maintenance',
+    'UNCLEAN': 'nodes_unclean',
+    'standby': 'nodes_standby',
+    'pending': 'nodes_pending',
+}
+CIB_RESOURCE_TAGS = ('primitive', 'group', 'clone', 'master', 'bundle', 'template')
+# Constraint tags and the attributes naming the resources they refer to
+CIB_CONSTRAINT_REFS = {
+    'rsc_colocation': ('rsc', 'with-rsc'),
+    'rsc_order': ('first', 'then'),
+    'rsc_location': ('rsc',),
+    'rsc_ticket': ('rsc',),
+}
+CIB_SCORE_INFINITY = 1000000
+LOG_RUN_KEY_FORMAT = '%Y%m%d%H%M%S%f'
+LOG_RUN_KEY_WIDTH = 20
+LOG_FILES = {
+#   The date format to use for each log file and the preferred order to test which is used
+#   'log file': [list of indeces to possible date_formats],
+    'pacemaker.log': [2, 3, 1],
+    'corosync.log': [3, 2, 1],
+    'journal_corosync.log': [1, 2, 3],
+    'journal_pacemaker.log': [1, 2, 3],
+    'journal_sbd.log': [1, 2, 3],
+    'ha-log.txt': [1, 2, 3],
+}
+# Files read from the report and node directories, anything else is not extracted unless requested
+CONSUMED_FILES = frozenset([
+    'description.txt', 'analysis.txt', 'permissions.txt', 'sysinfo.txt', 'sysstats.txt',
+    'crm_mon.txt', 'crm_mon.xml', 'members.txt', 'cib.xml', 'sbd.txt', 'sbd', 'DC', 'RUNNING',
+] + list(LOG_FILES.keys()))
+# Files needed to evaluate the analysis patterns in triage mode, the empty DC and RUNNING
+# markers are kept when they come before reading stops
+TRIAGE_REPORT_FILES = frozenset(['description.txt', 'analysis.txt'])
+TRIAGE_NODE_FILES = frozenset(['crm_mon.txt', 'crm_mon.xml', 'sysinfo.txt', 'members.txt', 'DC', 'RUNNING'])
+TRIAGE_FILES = TRIAGE_REPORT_FILES | TRIAGE_NODE_FILES
+# Files the per node parsers in _parse_node_dir open
+NODE_PARSED_FILES = frozenset(['sysinfo.txt', 'sysstats.txt', 'permissions.txt', 'DC', 'RUNNING',
+    'crm_mon.xml', 'crm_mon.txt', 'members.txt', 'sbd.txt', 'sbd'])
+
+def triage_stop_check():
+    '''
+    Returns a mount_archive stop_check that ends reading once the report files
+    are found and the archive has moved past the node directory of every node
+    in members.txt. A node directory is only complete once it has been passed,
+    the DC and RUNNING markers can come after its other triage files.
+    '''
+    state = {'members': [], 'current_node': '', 'done_nodes': set()}
+
+    def _stop_check(source, member_path):
+        parts = member_path.split('/')
+        node_name = parts[0] if len(parts) > 1 else ''
+        if node_name != state['current_node']:
+            if state['current_node']:
+                state['done_nodes'].add(state['current_node'])
+            state['current_node'] = node_name
+        if node_name and parts[-1] == 'members.txt' and not state['members']:
+            with source.open(source.root + '/' + member_path) as f:
+                state['members'] = f.read().split()
+        if not state['members']:
+            return False
+        for filename in TRIAGE_REPORT_FILES:
+            if not source.exists(source.root + '/' + filename):
+                return False
+        for member in state['members']:
+            if member not in state['done_nodes']:
+                return False
+        return True
+
+    return _stop_check
+
+def _source_manifest(msg, file_data):
+    '''Returns the manifest of the report directory, listing it when no manifest is registered yet'''
+    manifest = pcrcore.get_manifest(file_data['dirpath_data_source'])
+    if manifest is None:
+        manifest = pcrcore.build_manifest(msg, file_data['dirpath_data_source'])
+    return manifest
+
+def _node_dirs(file_data):
+    '''Returns the node directory paths from the report manifest'''
+    manifest = pcrcore.get_manifest(file_data['dirpath_data_source'])
+    if manifest is not None:
+        return [ file_data['dirpath_data_source'] + "/" + node_name for node_name in manifest['nodes'] ]
+    return pcrcore.list_source_dirs(file_data['dirpath_data_source'])
 
 def _write_diff_file(msg, filename, filepath, diff_content):
     msg.normal(" Differences Data File", filepath)
@@ -50,7 +195,7 @@ def _get_cluster_basics(msg, file_data, cluster_data):
     msg.debug("_get_cluster_basics: File", filename)
     filepath = file_data['dirpath_data_source'] + "/" + filename
     try:
-        with open(filepath) as f:
+        with pcrcore.open_source_file(filepath) as f:
             filedata = f.read().splitlines()
             f.close()
     except Exception as e:
@@ -72,7 +217,7 @@ def _get_cluster_basics(msg, file_data, cluster_data):
     msg.debug("_get_cluster_basics: File", filename)
     filepath = file_data['dirpath_data_source'] + "/" + filename
     try:
-        with open(filepath) as f:
+        with pcrcore.open_source_file(filepath) as f:
             filedata = f.read().splitlines()
             f.close()
     except Exception as e:
@@ -172,7 +317,7 @@ def _parse_permissions_txt(msg, dirpath, node_name, cluster_data, found_permissi
 
     msg.debug("> evaluate", "permissions_valid")
     try:
-        with open(filepath) as f:
+        with pcrcore.open_source_file(filepath) as f:
             filedata = f.read().splitlines()
             f.close()
     except Exception as e:
@@ -190,13 +335,29 @@ def _parse_permissions_txt(msg, dirpath, node_name, cluster_data, found_permissi
 
     return [cluster_data, found_permissions]
 
+def _sysinfo_package(line):
+    '''
+    Returns (name, version) for a sysinfo.txt package line, either
+    "name version-release - distribution arch" or the rpm -q form
+    "name-version-release.arch", otherwise None.
+    '''
+    if ' ' in line:
+        match = SYSINFO_PACKAGE.match(line)
+        if match:
+            return match.group(1), match.group(2)
+    else:
+        parts = line.rsplit('.', 1)[0].rsplit('-', 2)
+        if len(parts) == 3 and parts[0] and parts[1][:1].isdigit() and parts[2]:
+            return parts[0], parts[1] + '-' + parts[2]
+    return None
+
 def _parse_sysinfo_txt(msg, dirpath, node_name, cluster_data, found_sysinfo):
     ##### sysinfo.txt
     filename = "sysinfo.txt"
     filepath = dirpath + "/" + filename
     msg.verbose(" Parsing file", filepath)
     try:
-        with open(filepath) as f:
+        with pcrcore.open_source_file(filepath) as f:
             filedata = f.read().splitlines()
             f.close()
     except Exception as e:
@@ -209,104 +370,96 @@ def _parse_sysinfo_txt(msg, dirpath, node_name, cluster_data, found_sysinfo):
         msg.debug(">", "pkg versions and summary info")
         if 'sysinfo' not in cluster_data['nodes'][node_name]:
             cluster_data['nodes'][node_name]['sysinfo'] = {}
+        sysinfo = cluster_data['nodes'][node_name]['sysinfo']
+        packages = {}
+        dist = None
         for line in filedata:
             line = line.lstrip()
-            if line.startswith("CRM Version: "):
-                cluster_data['nodes'][node_name]['sysinfo']['crm'] = line.split()[2]
-
-            if line.startswith("corosync "):
-                cluster_data['nodes'][node_name]['sysinfo']['corosync'] = line.split()[1]
-                tmp_dist_list = line.split()
-                del tmp_dist_list[-1]
-                del tmp_dist_list[0:3]
-            elif re.search(r"^corosync-[0-9]", line):
-                tmp_ver1 = line.split('-', 1)[1]
-                tmp_ver2 = tmp_ver1.split('.')
-                del tmp_ver2[-1]
-                tmp_ver1 = '.'.join(tmp_ver2)
-                cluster_data['nodes'][node_name]['sysinfo']['corosync'] = tmp_ver1
-
-            if line.startswith("pacemaker "):
-                cluster_data['nodes'][node_name]['sysinfo']['pacemaker'] = line.split()[1]
-            elif re.search(r"^pacemaker-[0-9]", line):
-                tmp_ver1 = line.split('-', 1)[1]
-                tmp_ver2 = tmp_ver1.split('.')
-                del tmp_ver2[-1]
-                tmp_ver1 = '.'.join(tmp_ver2)
-                cluster_data['nodes'][node_name]['sysinfo']['pacemaker'] = tmp_ver1
-
-            if line.startswith("resource-agents "):
-                cluster_data['nodes'][node_name]['sysinfo']['resource-agents'] = line.split()[1]
-            elif re.search(r"^resource-agents-[0-9]", line):
-                tmp_ver1 = line.split('-', 2)[2]
-                tmp_ver2 = tmp_ver1.split('.')
-                del tmp_ver2[-1]
-                tmp_ver1 = '.'.join(tmp_ver2)
-                cluster_data['nodes'][node_name]['sysinfo']['resource-agents'] = tmp_ver1
-
-            if line.startswith("sbd "):
-                cluster_data['nodes'][node_name]['sysinfo']['sbd'] = line.split()[1]
-            elif re.search(r"^sbd-[0-9]", line):
-                tmp_ver1 = line.split('-', 1)[1]
-                tmp_ver2 = tmp_ver1.split('.')
-                del tmp_ver2[-1]
-                tmp_ver1 = '.'.join(tmp_ver2)
-                cluster_data['nodes'][node_name]['sysinfo']['sbd'] = tmp_ver1
-
-            if line.startswith("Platform: "):
-                cluster_data['nodes'][node_name]['sysinfo']['platform'] = line.split()[-1]
-            if line.startswith("Kernel release: "):
-                cluster_data['nodes'][node_name]['sysinfo']['kernel'] = line.split()[-1]
-            if line.startswith("Architecture: "):
-                cluster_data['nodes'][node_name]['sysinfo']['arch'] = line.split()[-1]
-            if line.startswith("Distribution: "):
-                dist = line.split(' ', 1)[1]
-                if "SUSE Linux Enterprise" in dist:
-                    last_word = dist.split()[-1]
-                    if "SP" in last_word:
-                        cluster_data['nodes'][node_name]['sysinfo']['os_version_major'] = dist.split()[-2]
-                        cluster_data['nodes'][node_name]['sysinfo']['os_version_minor'] = last_word.replace("SP", '')
-                        cluster_data['nodes'][node_name]['sysinfo']['distribution'] = dist
-                    else:
-                        cluster_data['nodes'][node_name]['sysinfo']['os_version_major'] = dist.split()[-1]
-                        cluster_data['nodes'][node_name]['sysinfo']['os_version_minor'] = "0"
-                        cluster_data['nodes'][node_name]['sysinfo']['distribution'] = dist
+            if not line or line[0] == '=':
+                continue
+            key, sep, value = line.partition(': ')
+            field = SYSINFO_FIELDS.get(key) if sep else None
+            if field == 'crm':
+                sysinfo['crm'] = value.split()[0]
+            elif field == 'distribution':
+                dist = value
+            elif field:
+                sysinfo[field] = line.split()[-1]
+            else:
+                package = _sysinfo_package(line)
+                if package:
+                    packages[package[0]] = package[1]
+                    if package[0] == 'corosync' and line.startswith("corosync "):
+                        tmp_dist_list = line.split()[3:-1]
+
+        for package in SYSINFO_CLUSTER_PACKAGES:
+            if package in packages:
+                sysinfo[package] = packages[package]
+        sysinfo['packages'] = packages
+        msg.debug("> packages", "{} installed".format(len(packages)))
+
+        if dist is not None:
+            if "SUSE Linux Enterprise" in dist:
+                last_word = dist.split()[-1]
+                if "SP" in last_word:
+                    sysinfo['os_version_major'] = dist.split()[-2]
+                    sysinfo['os_version_minor'] = last_word.replace("SP", '')
+                    sysinfo['distribution'] = dist
                 else:
-                    if tmp_dist_list:
-                        cluster_data['nodes'][node_name]['sysinfo']['distribution'] = " ".join(tmp_dist_list)
-                        cluster_data['nodes'][node_name]['sysinfo']['os_version_major'] = tmp_dist_list[-1]
-                        cluster_data['nodes'][node_name]['sysinfo']['os_version_minor'] = ''
-                    else:
-                        cluster_data['nodes'][node_name]['sysinfo']['distribution'] = ''
-                        cluster_data['nodes'][node_name]['sysinfo']['os_version_major'] = ''
-                        cluster_data['nodes'][node_name]['sysinfo']['os_version_minor'] = ''
-                msg.verbose(" Distribution found", cluster_data['nodes'][node_name]['sysinfo']['distribution'])
+                    sysinfo['os_version_major'] = dist.split()[-1]
+                    sysinfo['os_version_minor'] = "0"
+                    sysinfo['distribution'] = dist
+            else:
+                if tmp_dist_list:
+                    sysinfo['distribution'] = " ".join(tmp_dist_list)
+                    sysinfo['os_version_major'] = tmp_dist_list[-1]
+                    sysinfo['os_version_minor'] = ''
+                else:
+                    sysinfo['distribution'] = ''
+                    sysinfo['os_version_major'] = ''
+                    sysinfo['os_version_minor'] = ''
+            msg.verbose(" Distribution found", sysinfo['distribution'])
 
     return [cluster_data, found_sysinfo]
 
-def _get_sysstats_section(msg, filedata, section):
-    content = []
-    found = False
-    in_section = False
-    next_line = ''
-
+def _index_sysstats_sections(filedata):
+    '''
+    Indexes the ##### sections of sysstats.txt in one pass. Returns the
+    section line ranges by the quoted command name of the section header, or
+    the whole header when it has no quoted command. The blank line before the
+    next header is not part of a section.
+    '''
+    sections = {}
+    header_key = None
+    start = 0
     for i, line in enumerate(filedata):
-        if i < len(filedata) - 1:  # Check if a next element exists
-            next_line = filedata[i + 1]
-        else:
-            next_line = ''
-
-        if in_section:
-            if next_line.startswith('#####'):
-                in_section = False
+        if line.startswith('#####'):
+            if header_key is not None:
+                sections[header_key].append([start, i - 1])
+            command = SYSSTATS_COMMAND.search(line)
+            if command:
+                header_key = command.group(1)
             else:
-                content.append(line)
-                found = True
-        else:
-            if line.startswith('#####') and section in line:
-                in_section = True
+                header_key = line.strip('# ')
+            sections.setdefault(header_key, [])
+            start = i + 1
+    if header_key is not None:
+        sections[header_key].append([start, len(filedata)])
+
+    return sections
+
+def _get_sysstats_section(msg, filedata, sections, section):
+    '''Returns the lines of the section with the command name, or the first one starting with it'''
+    if section not in sections:
+        matches = [ key for key in sections if key.startswith(section) ]
+        if not matches:
+            return [[], False]
+        section = matches[0]
+    content = []
+    for start, end in sections[section]:
+        content.extend(filedata[start:end])
 
-    return [content, found]
+    return [content, len(content) > 0]
 
 def _parse_sysstats_txt(msg, dirpath, node_name, cluster_data, found_sysstats):
     ##### sysstats.txt
@@ -314,7 +467,7 @@ def _parse_sysstats_txt(msg, dirpath, node_name, cluster_data, found_sysstats):
     filepath = dirpath + "/" + filename
     msg.verbose(" Parsing file", filepath)
     try:
-        with open(filepath) as f:
+        with pcrcore.open_source_file(filepath) as f:
             filedata = f.read().splitlines()
             f.close()
     except Exception as e:
@@ -325,9 +478,10 @@ def _parse_sysstats_txt(msg, dirpath, node_name, cluster_data, found_sysstats):
         found_sysstats = True
         if "sysstats" not in cluster_data['nodes'][node_name]:
             cluster_data['nodes'][node_name]['sysstats'] = {}
+        sections = _index_sysstats_sections(filedata)
 
         # uptime
-        uptime_info, found = _get_sysstats_section(msg, filedata, '"uptime"')
+        uptime_info, found = _get_sysstats_section(msg, filedata, sections, 'uptime')
         cluster_data['nodes'][node_name]['sysstats']['uptime'] = -1 # in minutes
         cluster_data['nodes'][node_name]['sysstats']['tasks'] = {'load_average': []} # the average number of jobs in the run queue over the last 1, 5 and 15 minutes.
         if found is True:
@@ -356,7 +510,7 @@ def _parse_sysstats_txt(msg, dirpath, node_name, cluster_data, found_sysstats):
                     cluster_data['nodes'][node_name]['sysstats']['uptime'] = upall
 
         # cpuinfo
-        cpu_info, found = _get_sysstats_section(msg, filedata, "cat /proc/cpuinfo")
+        cpu_info, found = _get_sysstats_section(msg, filedata, sections, "cat /proc/cpuinfo")
         cluster_data['nodes'][node_name]['sysstats']['cpu'] = { 'count': 0 }
         if found is True:
             for entry in cpu_info:
@@ -364,7 +518,7 @@ def _parse_sysstats_txt(msg, dirpath, node_name, cluster_data, found_sysstats):
                     cluster_data['nodes'][node_name]['sysstats']['cpu']['count'] += 1
 
         # memory from top output
-        top_info, found = _get_sysstats_section(msg, filedata, "top -b -n")
+        top_info, found = _get_sysstats_section(msg, filedata, sections, "top -b -n")
         cluster_data['nodes'][node_name]['sysstats']['tasks'].update({'total': -1, 'running': -1, 'sleeping': -1, 'stopped': -1, 'zombie': -1})
         cluster_data['nodes'][node_name]['sysstats']['cpu'].update({'user': -1.0, 'system': -1.0, 'nice': -1.0, 'idle': -1.0, 'wait': -1.0, 'hard_int': -1.0, 'soft_int': -1.0, 'steal_time': -1.0})
         cluster_data['nodes'][node_name]['sysstats']['mem'] = { 'total': -1, 'used': -1, 'avail': -1, 'avail_percent': -1 }
@@ -434,14 +588,54 @@ def _parse_sysstats_txt(msg, dirpath, node_name, cluster_data, found_sysstats):
 
     return [cluster_data, found_sysstats]
 
+def _tokenize_crm_mon_txt(filedata):
+    '''
+    Yields (token, match) for the crm_mon.txt lines used by the cluster data.
+    Lines are dispatched on their first word through CRM_MON_TOKENS and only
+    within the sections that can hold them. Files without section headers
+    (older pacemaker) are read as one summary section.
+    '''
+    section = 'summary'
+    stop_early = False
+    for line in filedata:
+        line = line.strip()
+        if line.startswith('* '):
+            line = line[2:]
+        if not line:
+            continue
+        if line.startswith('##'):
+            if stop_early:
+                break
+            stop_early = True
+            continue
+        if line in CRM_MON_SECTIONS:
+            section = CRM_MON_SECTIONS[line]
+            continue
+        if section in CRM_MON_STATE_SECTIONS:
+            first = line.split(None, 1)[0]
+            if first in CRM_MON_TOKENS:
+                token, pattern = CRM_MON_TOKENS[first]
+                match = pattern.search(line)
+                if match:
+                    yield token, match
+                continue
+            if first.isdigit():
+                match = CRM_MON_CONFIGURED.match(line)
+                if match:
+                    yield 'configured', match
+                continue
+        if section in CRM_MON_RESOURCE_SECTIONS and '(stonith:' in line:
+            match = CRM_MON_STONITH.search(line)
+            if match:
+                yield 'stonith', match
+
 def _parse_crm_mon_txt(msg, dirpath, node_name, cluster_data, found_crm_mon):
     ##### crm_mon.txt
     filename = "crm_mon.txt"
     filepath = dirpath + "/" + filename
     msg.debug("_parse_crm_mon_txt: File", filename)
-    stop_early = False
     try:
-        with open(filepath) as f:
+        with pcrcore.open_source_file(filepath) as f:
             filedata = f.read().splitlines()
             f.close()
     except Exception as e:
@@ -450,102 +644,185 @@ def _parse_crm_mon_txt(msg, dirpath, node_name, cluster_data, found_crm_mon):
 
     if filedata:
         found_crm_mon = True
-        for line in filedata:
-            line = line.strip()
-            if line.startswith('* '):
-                line = line[2:]
-
-            if line.startswith('##'):
-                if stop_early:
-                    break
+        for token, match in _tokenize_crm_mon_txt(filedata):
+            if token == 'stonith':
+                _type = match.group(1)
+                cluster_data['stonith']['enabled'] = True
+                if _type == 'external/sbd':
+                    cluster_data['stonith']['sbd']['found'] = True
+                elif _type not in cluster_data['stonith']:
+                    cluster_data['stonith'][_type] = {}
+                    cluster_data['stonith'][_type]['found'] = True
+                msg.debug(">", "stonith:{} found".format(_type))
+            elif token == 'node_state':
+                check_nodes = CRM_MON_NODE_STATES[match.group(2)]
+                if match.group(1) not in cluster_data[check_nodes]:
+                    msg.debug(">", "{} list, appended {}".format(check_nodes, match.group(1)))
+                    cluster_data[check_nodes].append(match.group(1))
+            elif token in ('online', 'offline'):
+                check_nodes = 'nodes_' + token
+                cluster_data[check_nodes] = match.group(1).strip().split()
+                msg.debug("> {}".format(check_nodes), "added {}".format(cluster_data[check_nodes]))
+            elif token == 'configured':
+                if match.group(2) == 'nodes':
+                    msg.debug(">", "cnt_nodes_configured")
+                    cluster_data['cnt_nodes_configured'] = int(match.group(1))
                 else:
-                    stop_early = True
+                    msg.debug(">", "cnt_resources_configured")
+                    cluster_data['cnt_resources_configured'] = int(match.group(1))
+            elif token == 'dc':
+                if match.group(2):
+                    msg.debug(">", "found quorum status")
+                    cluster_data['has_quorum'] = True
+                dc_node_name = match.group(1)
+                if dc_node_name == 'NONE':
                     continue
-            if "Resource management is DISABLED" in line:
-                msg.debug(">", "found cluster maintenance status")
-                cluster_data['cluster_maintenance'] = True
-            if "partition with quorum" in line:
-                msg.debug(">", "found quorum status")
-                cluster_data['has_quorum'] = True
-            if "Current DC" in line:
-                dc_node_name = line.split()[2]
                 if dc_node_name not in cluster_data['nodes']:
                     msg.debug(">", "Added {} from {}".format(dc_node_name, filename))
                     cluster_data['nodes'][dc_node_name] = {}
                     cluster_data['nodes'][dc_node_name]['is_included'] = False
                 msg.debug(">", "Added DC node {} from {}".format(node_name, filename))
                 cluster_data['nodes'][dc_node_name]['is_dc_crm'] = True
-            if " nodes configured" in line:
-                msg.debug(">", "cnt_nodes_configured")
-                value = line.split()[0]
-                if value.isdigit():
-                    cluster_data['cnt_nodes_configured'] = int(value)
-            if " resource instances configured" in line:
-                msg.debug(">", "cnt_resources_configured")
-                value = line.split()[0]
-                if value.isdigit():
-                    cluster_data['cnt_resources_configured'] = int(value)
-            if " resources configured" in line:
-                msg.debug(">", "cnt_resources_configured")
-                value = line.split()[0]
-                if value.isdigit():
-                    cluster_data['cnt_resources_configured'] = int(value)
-            if "Online: [" in line:
-                entry = re.findall(r"\[(.*?)\]", line)
-                cluster_data['nodes_online'] = entry[0].strip().split()
-                msg.debug("> nodes_online", "added {}".format(cluster_data['nodes_online']))
-            if "OFFLINE: [" in line:
-                entry = re.findall(r"\[(.*?)\]", line)
-                cluster_data['nodes_offline'] = entry[0].strip().split()
-                msg.debug("> nodes_offline", "added {}".format(cluster_data['nodes_offline']))
-            if "maintenance" in line:
-                entry = re.findall(r"Node (.*?): maintenance", line)
-                if entry:
-                    if entry[0] not in cluster_data['nodes_maintenance']:
-                        msg.debug(">", "nodes_maintenance list, appended {}".format(entry[0]))
-                        cluster_data['nodes_maintenance'].append(entry[0])
-            if "UNCLEAN" in line:
-                entry = re.findall(r"Node (.*?): UNCLEAN", line)
-                if entry:
-                    if entry[0] not in cluster_data['nodes_unclean']:
-                        msg.debug(">", "nodes_unclean list, appended {}".format(entry[0]))
-                        cluster_data['nodes_unclean'].append(entry[0])
-            if "standby" in line:
-                entry = re.findall(r"Node (.*?): standby", line)
-                if entry:
-                    if entry[0] not in cluster_data['nodes_standby']:
-                        msg.debug(">", "nodes_standby list, appended {}".format(entry[0]))
-                        cluster_data['nodes_standby'].append(entry[0])
-            if "pending" in line:
-                entry = re.findall(r"Node (.*?): pending", line)
-                if entry:
-                    if entry[0] not in cluster_data['nodes_pending']:
-                        msg.debug(">", "nodes_pending list, appended {}".format(entry[0]))
-                        cluster_data['nodes_pending'].append(entry[0])
-            if "stonith:" in line:
-                cluster_data['stonith']['enabled'] = True
-                if "stonith:external/sbd" in line:
-                    cluster_data['stonith']['sbd']['found'] = True
-                    msg.debug(">", "stonith:external/sbd found")
-                else:
-                    entry = re.findall(r"\(stonith:(.*)\):", line)
-                    if entry:
-                        _type = entry[0]
-                        if _type not in cluster_data['stonith']:
-                            cluster_data['stonith'][_type] = {}
-                            cluster_data['stonith'][_type]['found'] = True
-                    msg.debug(">", "stonith:{} found".format(_type))
+            elif token == 'maintenance':
+                msg.debug(">", "found cluster maintenance status")
+                cluster_data['cluster_maintenance'] = True
+
+    return [cluster_data, found_crm_mon]
 
+def _read_crm_mon_xml(f):
+    '''
+    Reads crm_mon XML output, either the pacemaker-result layout of
+    crm_mon --output-as=xml or the older crm_mon -X layout, with a streaming
+    expat parser that builds no tree. Returns a summary dictionary of the
+    cluster state.
+    '''
+    summary = {
+        'dc': None,
+        'has_quorum': False,
+        'maintenance': False,
+        'cnt_nodes_configured': -1,
+        'cnt_resources_configured': -1,
+        'nodes': [],
+        'stonith': [],
+    }
+    path = []
+
+    def start_element(tag, attrib):
+        parent = path[-1] if path else None
+        path.append(tag)
+        if tag == 'resource':
+            agent = attrib.get('resource_agent', '')
+            if agent.startswith('stonith:'):
+                summary['stonith'].append(agent[8:])
+        elif tag == 'node' and parent == 'nodes':
+            summary['nodes'].append(attrib)
+        elif parent != 'summary':
+            return
+        elif tag == 'current_dc':
+            if attrib.get('present') == 'true':
+                summary['dc'] = attrib.get('name')
+            summary['has_quorum'] = attrib.get('with_quorum') == 'true'
+        elif tag == 'nodes_configured':
+            summary['cnt_nodes_configured'] = int(attrib.get('number', '-1'))
+        elif tag == 'resources_configured':
+            summary['cnt_resources_configured'] = int(attrib.get('number', '-1'))
+        elif tag == 'cluster_options':
+            summary['maintenance'] = attrib.get('maintenance-mode') == 'true'
+
+    def end_element(tag):
+        path.pop()
+
+    parser = xml.parsers.expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.ParseFile(f)
+    if summary['cnt_nodes_configured'] < 0 and not summary['nodes']:
+        raise ValueError("No crm_mon summary or nodes found")
+    return summary
+
+def _crm_mon_node_state(node):
+    '''Returns the crm_mon.txt node list a crm_mon XML node entry belongs to'''
+    if node.get('unclean') == 'true':
+        return 'unclean'
+    if node.get('pending') == 'true':
+        return 'pending'
+    if node.get('online') != 'true':
+        return 'offline'
+    if node.get('standby') == 'true':
+        return 'standby'
+    if node.get('maintenance') == 'true':
+        return 'maintenance'
+    return 'online'
+
+def _parse_crm_mon_xml(msg, dirpath, node_name, cluster_data, found_crm_mon):
+    ##### crm_mon.xml
+    filename = "crm_mon.xml"
+    filepath = dirpath + "/" + filename
+    msg.debug("_parse_crm_mon_xml: File", filename)
+    with pcrcore.open_source_file(filepath, 'rb') as f:
+        summary = _read_crm_mon_xml(f)
+
+    found_crm_mon = True
+    if summary['maintenance']:
+        msg.debug(">", "found cluster maintenance status")
+        cluster_data['cluster_maintenance'] = True
+    if summary['has_quorum']:
+        msg.debug(">", "found quorum status")
+        cluster_data['has_quorum'] = True
+    dc_node_name = summary['dc']
+    if dc_node_name:
+        if dc_node_name not in cluster_data['nodes']:
+            msg.debug(">", "Added {} from {}".format(dc_node_name, filename))
+            cluster_data['nodes'][dc_node_name] = {}
+            cluster_data['nodes'][dc_node_name]['is_included'] = False
+        msg.debug(">", "Added DC node {} from {}".format(node_name, filename))
+        cluster_data['nodes'][dc_node_name]['is_dc_crm'] = True
+    if summary['cnt_nodes_configured'] >= 0:
+        cluster_data['cnt_nodes_configured'] = summary['cnt_nodes_configured']
+    if summary['cnt_resources_configured'] >= 0:
+        cluster_data['cnt_resources_configured'] = summary['cnt_resources_configured']
+
+    node_lists = {'online': [], 'offline': []}
+    for node in summary['nodes']:
+        state = _crm_mon_node_state(node)
+        if state in node_lists:
+            node_lists[state].append(node.get('name'))
+        elif node.get('name') not in cluster_data['nodes_' + state]:
+            msg.debug(">", "nodes_{} list, appended {}".format(state, node.get('name')))
+            cluster_data['nodes_' + state].append(node.get('name'))
+    for state in node_lists:
+        if node_lists[state]:
+            cluster_data['nodes_' + state] = node_lists[state]
+            msg.debug("> nodes_{}".format(state), "added {}".format(node_lists[state]))
+
+    for _type in summary['stonith']:
+        cluster_data['stonith']['enabled'] = True
+        if _type == 'external/sbd':
+            cluster_data['stonith']['sbd']['found'] = True
+        elif _type not in cluster_data['stonith']:
+            cluster_data['stonith'][_type] = {}
+            cluster_data['stonith'][_type]['found'] = True
+        msg.debug(">", "stonith:{} found".format(_type))
 
     return [cluster_data, found_crm_mon]
 
+def _parse_crm_mon(msg, dirpath, node_name, cluster_data, found_crm_mon):
+    '''Parses crm_mon.xml when the report has it and falls back to crm_mon.txt'''
+    if pcrcore.source_exists(dirpath + "/crm_mon.xml"):
+        try:
+            return _parse_crm_mon_xml(msg, dirpath, node_name, cluster_data, found_crm_mon)
+        except Exception as e:
+            msg.verbose(" Invalid crm_mon.xml", "{}, using crm_mon.txt".format(str(e)))
+    return _parse_crm_mon_txt(msg, dirpath, node_name, cluster_data, found_crm_mon)
+
 def _parse_members_txt(msg, dirpath, cluster_data, found_members):
     ##### members.txt
     filename = "members.txt"
     filepath = dirpath + "/" + filename
     msg.verbose(" Parse File", filepath)
     try:
-        with open(filepath) as f:
+        with pcrcore.open_source_file(filepath) as f:
             filedata = f.read().splitlines()
             f.close()
     except Exception as e:
@@ -565,22 +842,31 @@ def _parse_members_txt(msg, dirpath, cluster_data, found_members):
 
     return [cluster_data, found_members]
 
-def _get_nodes_system_details(msg, file_data, cluster_data):
+def _node_system_details(msg, node_data_source, node_name, fragment):
+    msg.verbose("Processing system details", "from {} node directory".format(node_name))
+    fragment, found_sysinfo = _parse_sysinfo_txt(msg, node_data_source, node_name, fragment, False)
+    fragment, found_sysstats = _parse_sysstats_txt(msg, node_data_source, node_name, fragment, False)
+    fragment, found_permissions = _parse_permissions_txt(msg, node_data_source, node_name, fragment, False)
+    return [fragment, {'sysinfo': found_sysinfo, 'sysstats': found_sysstats, 'permissions': found_permissions}]
+
+def _get_nodes_system_details(msg, file_data, cluster_data, node_fragments):
     msg.min("System Details", "Gathering per Node")
     found_permissions = False
     found_sysinfo = False
     found_sysstats = False
-    subfolders = [ f.path for f in os.scandir(file_data['dirpath_data_source']) if f.is_dir() ]
+    subfolders = _node_dirs(file_data)
     for node_data_source in subfolders:
         node_name = os.path.basename(node_data_source)
-        msg.verbose("Processing system details", "from {} node directory".format(node_name))
         if node_name not in cluster_data['nodes']:
             cluster_data['nodes'][node_name] = {}
             msg.debug("_get_nodes_system_details:", "Added {} from {}".format(node_name, "directory"))
 
-        cluster_data, found_sysinfo = _parse_sysinfo_txt(msg, node_data_source, node_name, cluster_data, found_sysinfo)
-        cluster_data, found_sysstats = _parse_sysstats_txt(msg, node_data_source, node_name, cluster_data, found_sysstats)
-        cluster_data, found_permissions = _parse_permissions_txt(msg, node_data_source, node_name, cluster_data, found_permissions)
+        output, fragment, found = node_fragments[node_name]['system']
+        print(output, end='', file=msg.get_output())
+        cluster_data = _merge_node_fragment(cluster_data, fragment, node_name)
+        found_sysinfo = found_sysinfo or found['sysinfo']
+        found_sysstats = found_sysstats or found['sysstats']
+        found_permissions = found_permissions or found['permissions']
 
     if not found_permissions:
         msg.verbose("Warning:", "No permissions.txt file found")
@@ -589,420 +875,501 @@ def _get_nodes_system_details(msg, file_data, cluster_data):
 
     return cluster_data
 
-def _parse_cib_xml_cfg(msg, dirpath, node_name, cluster_data):
+def _read_cib_xml(f):
+    """
+    Reads a cib.xml file object in a single iterparse pass and returns
+    (cib_data, node_states). cib_data holds the cib attributes, the
+    configuration section and the resource and constraint graph, node_states
+    the status section node_state entries in document order. Values are taken from start events and each element is cleared
+    when it ends, so memory stays flat as the status section grows.
+    """
+    cib_data = {}
+    node_states = []
+    graph = {'resources': {}, 'tags': {}, 'constraints': {}}
+    graph_parents = []
+    constraint = None
+    tag_refs = None
+    path = []
+    elements = []
+    collectors = []   # (depth, [dict, ...]) receiving the nvpairs of an open element
+    resources = None
+    containers = []   # [dict, has_meta] for each open group, clone or master
+    primitive = None  # [dict, [container copies], has_params] for the open primitive
+    node = None
+    node_state = None
+    lrm_resource = None
+    defaults = None
+    for event, elem in ET.iterparse(f, events=('start', 'end')):
+        if event == 'end':
+            path.pop()
+            elements.pop()
+            elem.clear()
+            if elements:
+                del elements[-1][:]
+            depth = len(path)
+            if collectors and collectors[-1][0] == depth:
+                collectors.pop()
+            if elem.tag in CIB_RESOURCE_TAGS and graph_parents and graph_parents[-1][1] == depth:
+                graph_parents.pop()
+            if elem.tag == 'primitive':
+                primitive = None
+            elif elem.tag in CIB_CONSTRAINT_REFS:
+                constraint = None
+            elif elem.tag == 'tag':
+                tag_refs = None
+            elif elem.tag in CIB_CONTAINER_TAGS and resources is not None:
+                containers.pop()
+            elif elem.tag == 'resources':
+                resources = None
+            elif elem.tag == 'node':
+                node = None
+            elif elem.tag == 'node_state':
+                node_state = None
+            elif elem.tag in ('rsc_defaults', 'op_defaults'):
+                defaults = None
+            continue
+
+        tag = elem.tag
+        attrib = elem.attrib
+        depth = len(path)
+        parent = path[-1] if path else None
+        path.append(tag)
+        elements.append(elem)
+
+        if tag == 'nvpair':
+            for collector in collectors:
+                for target in collector[1]:
+                    target[attrib.get('name', '')] = attrib.get('value', '')
+        elif depth == 0:
+            cib_data.update(attrib)
+            cib_data['cluster_property_sets'] = {}
+        elif node_state is not None:
+            # cib > status > node_state > transient_attributes > instance_attributes > nvpair
+            # cib > status > node_state > lrm > lrm_resources > lrm_resource > lrm_rsc_op
+            if tag == 'lrm_rsc_op':
+                if lrm_resource is not None:
+                    lrm_resource['operations'][attrib.get('operation', '')] = {
+                        'on_node': attrib.get('on_node', ''),
+                        'rc_code': attrib.get('rc-code', '')
+                    }
+            elif tag == 'lrm_resource':
+                lrm_resource = node_state['resources'].setdefault(attrib.get('id', ''), {})
+                lrm_resource['type'] = attrib.get('type', '')
+                lrm_resource['class'] = attrib.get('class', '')
+                lrm_resource.setdefault('operations', {})
+            elif tag == 'transient_attributes':
+                node_state['attrs'] = {}
+                for value in attrib.values():
+                    node_state['attrs'][str(value)] = {}
+            elif tag == 'instance_attributes' and node_state['attrs'] is not None:
+                i_attr_id = attrib.get('id', '').split('-')
+                i_attr_id = i_attr_id[1] if len(i_attr_id) > 1 else i_attr_id[0]
+                collectors.append((depth, [node_state['attrs'].setdefault(i_attr_id, {})]))
+        elif tag == 'node_state':
+            lrm_resource = None
+            node_state = {'uname': attrib.get('uname', ''), 'state': dict(attrib), 'attrs': None, 'resources': {}}
+            node_states.append(node_state)
+        elif resources is not None:
+            # cib > configuration > resources > [clone|master] > [group] > primitive > instance_attributes|operations
+            if tag in CIB_RESOURCE_TAGS:
+                resource_id = attrib.get('id', '')
+                graph['resources'][resource_id] = {'kind': tag, 'parent': None, 'children': []}
+                if graph_parents:
+                    graph['resources'][resource_id]['parent'] = graph_parents[-1][0]
+                    graph['resources'][graph_parents[-1][0]]['children'].append(resource_id)
+                graph_parents.append((resource_id, depth))
+            if tag == 'primitive':
+                primitive_id = attrib.get('id', '')
+                entry = {key: value for key, value in attrib.items() if key != 'id'}
+                resources.setdefault('primitives', {})[primitive_id] = entry
+                copies = []
+                for container in containers:
+                    copies.append(dict(entry))
+                    container[0].setdefault('primitives', {})[primitive_id] = copies[-1]
+                primitive = [entry, copies, False]
+            elif tag in CIB_CONTAINER_TAGS:
+                if tag == 'group':
+                    entry = {key: value for key, value in attrib.items() if key != 'id'}
+                else:
+                    entry = {}
+                resources.setdefault(tag + 's', {})[attrib.get('id', '')] = entry
+                containers.append([entry, False])
+            elif tag == 'meta_attributes':
+                targets = []
+                for container in containers:
+                    if not container[1]:
+                        container[1] = True
+                        container[0]['meta'] = {}
+                        targets.append(container[0]['meta'])
+                if targets:
+                    collectors.append((depth, targets))
+            elif primitive is not None:
+                if tag == 'instance_attributes' and not primitive[2]:
+                    primitive[2] = True
+                    targets = []
+                    for entry in [primitive[0]] + primitive[1]:
+                        entry['params'] = {}
+                        targets.append(entry['params'])
+                    collectors.append((depth, targets))
+                elif tag == 'op' and parent == 'operations':
+                    for entry in primitive[1]:
+                        entry.setdefault('operations', {})[attrib.get('name', '')] = dict(attrib)
+        elif tag == 'resources':
+            cib_data['resources'] = resources = {}
+        elif tag == 'cluster_property_set':
+            targets = []
+            for value in attrib.values():
+                cib_data['cluster_property_sets'][value] = {}
+                targets.append(cib_data['cluster_property_sets'][value])
+            collectors.append((depth, targets))
+        elif tag == 'node' and parent == 'nodes':
+            node = cib_data.setdefault('nodes', {})[attrib.get('uname', '')] = {}
+        elif tag == 'instance_attributes' and node is not None:
+            collectors.append((depth, [node]))
+            node = None
+        elif tag == 'constraints':
+            cib_data['constraints'] = {}
+        elif tag in CIB_CONSTRAINT_REFS and 'constraints' in cib_data:
+            if tag == 'rsc_colocation':
+                cib_data['constraints'].setdefault('colocations', {})[attrib.get('id', '')] = dict(attrib)
+            constraint = {'type': tag, 'refs': [attrib[key] for key in CIB_CONSTRAINT_REFS[tag] if key in attrib], 'sets': [], 'score': attrib.get('score', '')}
+            graph['constraints'][attrib.get('id', '')] = constraint
+        elif tag == 'resource_set' and constraint is not None:
+            constraint['sets'].append({'refs': [], 'sequential': attrib.get('sequential', 'true') != 'false'})
+        elif tag == 'resource_ref' and constraint is not None and constraint['sets']:
+            constraint['sets'][-1]['refs'].append(attrib.get('id', ''))
+        elif tag == 'tag' and parent == 'tags':
+            tag_refs = graph['tags'][attrib.get('id', '')] = []
+        elif tag == 'obj_ref' and tag_refs is not None:
+            tag_refs.append(attrib.get('id', ''))
+        elif tag in ('rsc_defaults', 'op_defaults'):
+            cib_data[tag] = defaults = {}
+        elif tag == 'meta_attributes' and defaults is not None:
+            defaults[attrib.get('id', '')] = {}
+            collectors.append((depth, [defaults[attrib.get('id', '')]]))
+            defaults = None
+
+    if cib_data:
+        cib_data['graph'] = _index_cib_graph(graph)
+    return cib_data, node_states
+
+def _constraint_score(score):
+    '''Returns a constraint score as an integer, INFINITY as CIB_SCORE_INFINITY and 0 when missing or invalid'''
+    score = score.strip().lower()
+    if score.lstrip('+-') in ('inf', 'infinity'):
+        return -CIB_SCORE_INFINITY if score.startswith('-') else CIB_SCORE_INFINITY
+    try:
+        return int(score)
+    except ValueError:
+        return 0
+
+def _index_cib_graph(graph):
+    '''
+    Adds the adjacency lists to the resource and constraint graph collected by
+    _read_cib_xml. order and colocation each hold depends_on, mapping a resource
+    to the resources it is ordered after or colocated with, and required_by, the
+    reverse. Colocations scored zero or below do not make a resource depend on
+    another and are left out. The top level depends_on and required_by hold
+    both kinds for following dependency chains, and constraints_by_resource
+    maps a resource or tag to the constraints naming it.
+    '''
+    for adjacency in [graph, graph.setdefault('order', {}), graph.setdefault('colocation', {})]:
+        adjacency['depends_on'] = {}
+        adjacency['required_by'] = {}
+    constraints_by_resource = {}
+    edges = set()
+
+    def add_edge(kind, dependent, required):
+        for adjacency, edge in [[graph[kind], (kind, dependent, required)], [graph, (dependent, required)]]:
+            if edge not in edges:
+                edges.add(edge)
+                adjacency['depends_on'].setdefault(dependent, []).append(required)
+                adjacency['required_by'].setdefault(required, []).append(dependent)
+
+    for constraint_id, constraint in graph['constraints'].items():
+        refs = list(constraint['refs'])
+        for rsc_set in constraint['sets']:
+            refs.extend(rsc_set['refs'])
+        for ref in dict.fromkeys(refs):
+            constraints_by_resource.setdefault(ref, []).append(constraint_id)
+        if constraint['type'] == 'rsc_order':
+            kind = 'order'
+        elif constraint['type'] == 'rsc_colocation' and _constraint_score(constraint['score']) > 0:
+            kind = 'colocation'
+        else:
+            continue
+        if len(constraint['refs']) == 2:
+            if kind == 'order':
+                add_edge(kind, constraint['refs'][1], constraint['refs'][0])
+            else:
+                add_edge(kind, constraint['refs'][0], constraint['refs'][1])
+        # Members of a sequential set depend on the member before them. Between sets,
+        # an order set depends on the set before it and a colocation set on the set after it.
+        sets = constraint['sets']
+        for rsc_set in sets:
+            if rsc_set['sequential']:
+                for required, dependent in zip(rsc_set['refs'], rsc_set['refs'][1:]):
+                    add_edge(kind, dependent, required)
+        for before, after in zip(sets, sets[1:]):
+            for required in before['refs']:
+                for dependent in after['refs']:
+                    if kind == 'order':
+                        add_edge(kind, dependent, required)
+                    else:
+                        add_edge(kind, required, dependent)
+
+    graph['constraints_by_resource'] = constraints_by_resource
+    return graph
+
+def cib_dependency_chain(graph, resource_id):
+    '''Returns the resources resource_id depends on directly or indirectly, nearest first'''
+    chain = []
+    seen = set([resource_id])
+    pending = [resource_id]
+    for current in pending:
+        for required in graph['depends_on'].get(current, []):
+            if required not in seen:
+                seen.add(required)
+                chain.append(required)
+                pending.append(required)
+    return chain
+
+def cib_undefined(graph, ref):
+    '''Returns True when ref names neither a resource nor a tag of the CIB'''
+    return ref not in graph['resources'] and ref not in graph['tags']
+
+def cib_orphaned_constraints(graph):
+    '''Returns a dictionary of constraint ids and the undefined resources or tags they refer to'''
+    orphaned = {}
+    for ref, constraint_ids in graph['constraints_by_resource'].items():
+        if cib_undefined(graph, ref):
+            for constraint_id in constraint_ids:
+                orphaned.setdefault(constraint_id, []).append(ref)
+    return orphaned
+
+def cib_blocked_resources(graph):
+    '''
+    Returns the resources that depend directly or indirectly on an undefined
+    resource or tag, in one traversal of required_by from the undefined ones.
+    '''
+    pending = [ ref for ref in graph['required_by'] if cib_undefined(graph, ref) ]
+    seen = set(pending)
+    blocked = []
+    for current in pending:
+        for dependent in graph['required_by'].get(current, []):
+            if dependent not in seen:
+                seen.add(dependent)
+                pending.append(dependent)
+                if dependent in graph['resources']:
+                    blocked.append(dependent)
+    return blocked
+
+def cib_dependency_cycles(graph):
+    '''
+    Returns the order and the colocation dependency cycles, each as lists of
+    resource ids. An order and a colocation between the same resources is a
+    valid configuration, so the two kinds are searched separately.
+    '''
+    return {
+        'order': _dependency_cycles(graph['order']['depends_on']),
+        'colocation': _dependency_cycles(graph['colocation']['depends_on']),
+    }
+
+def _dependency_cycles(depends_on):
+    '''
+    Returns the dependency cycles as lists of resource ids, one per strongly
+    connected component of depends_on (iterative Tarjan).
+    '''
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    cycles = []
+    for root in depends_on:
+        if root in index:
+            continue
+        work = [(root, iter(depends_on.get(root, [])))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(depends_on.get(child, []))))
+                    break
+                elif child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    if len(component) > 1 or node in depends_on.get(node, []):
+                        cycles.append(component[::-1])
+    return cycles
+
+def _load_cib_xml(msg, filepath, cib_cache=None):
+    """
+    Returns (digest, cib_data, node_states) for filepath. The sha256 digest of
+    the file content keys cib_cache, so node directories holding the same
+    cib.xml are read with _read_cib_xml only once.
+    """
+    digest = hashlib.sha256()
+    with pcrcore.open_source_file(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1048576), b''):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+    if cib_cache is not None and digest in cib_cache:
+        msg.debug("> cib digest", "Reusing parsed CIB {}".format(digest[:12]))
+        return (digest,) + cib_cache[digest]
+    with pcrcore.open_source_file(filepath, 'rb') as f:
+        parsed = _read_cib_xml(f)
+    if cib_cache is not None:
+        cib_cache[digest] = parsed
+    return (digest,) + parsed
+
+def _parse_cib_xml_cfg(msg, dirpath, node_name, cluster_data, cib_cache=None):
     msg.verbose("Parsing cluster CIB ", "from {} node directory".format(node_name))
-    ##### crm_mon.txt
+    ##### cib.xml
     filename = "cib.xml"
     filepath = dirpath + "/" + filename
-    msg.debug("_parse_crm_mon_txt: File", filename)
-    stop_early = False
+    msg.debug("_parse_cib_xml_cfg: File", filename)
+    cib_data = {}
+    digest = ''
     try:
-        with open(filepath) as f:
-            #xtree = ET.parse(f)
-            xdom = xml.dom.minidom.parse(f)
-            f.close()
+        digest, cib_data, node_states = _load_cib_xml(msg, filepath, cib_cache)
+        cluster_data.setdefault('cib_digests', {}).setdefault(digest, []).append(node_name)
     except Exception as e:
         msg.verbose(" Missing {}".format(filename), "{}".format(str(e)))
-        filedata = ""
 
-    cib_data = {}
-
-    if xdom:
-        cib_element = xdom.getElementsByTagName("cib")[0]
-        for attr in cib_element.attributes.keys():
-            msg.debug("> cib attribute", "{} = {}".format(attr, cib_element.getAttribute(attr)))  
-            #if attr in ["crm_feature_set", "cib-last-written", "update-origin", "have-quorum"]:
-            cib_data[attr] = cib_element.getAttribute(attr)
-
-        # Walking through cib.xml to get configuration values
-        cfg = xdom.getElementsByTagName("configuration")
-
-        cib_data["cluster_property_sets"] = {}
-        # Get cluster properties
-        crm_configs = cfg[0].getElementsByTagName("crm_config")
-        if len(crm_configs) > 0:
-            cluster_property_sets  = crm_configs[0].getElementsByTagName("cluster_property_set")
-            if len(cluster_property_sets) > 0:
-                for cps in cluster_property_sets:
-                    for attr in cps.attributes.keys():
-                        cib_data["cluster_property_sets"][cps.getAttribute(attr)] = {}
-                        nvpairs = cps.getElementsByTagName("nvpair")
-                        for nv in nvpairs:
-                            nv_name = nv.getAttribute("name")
-                            nv_value = nv.getAttribute("value")
-                            cib_data["cluster_property_sets"][cps.getAttribute(attr)][nv_name] = nv_value
-
-        # Get node attributes
-        nodes_parent = xdom.getElementsByTagName("nodes")
-        nodes = nodes_parent[0].getElementsByTagName("node")
-        if len(nodes) > 0:
-            if "nodes" not in cib_data.keys():
-                cib_data["nodes"] = {}
-            for node in nodes:
-                node_uname= node.getAttribute("uname")
-                msg.debug("> cib node", "Found node {}".format(node_uname))
-                if node_uname not in cib_data:
-                    cib_data["nodes"][node_uname] = {}
-                instance_attributes = node.getElementsByTagName("instance_attributes")
-                nvpairs = instance_attributes[0].getElementsByTagName("nvpair") 
-                for nvp in nvpairs:
-                    nv_name = nvp.getAttribute("name")
-                    nv_value = nvp.getAttribute("value")
-                    cib_data["nodes"][node_uname][nv_name] = nv_value
-
-        # Get resources 
-        resources_parent = xdom.getElementsByTagName("resources")
-        if len(resources_parent) > 0:
-            cib_data["resources"] = {}
-            # Get primitives
-            primitives = resources_parent[0].getElementsByTagName("primitive")
-            if len(primitives) > 0:
-                if "primitives" not in cib_data["resources"]:
-                    cib_data["resources"]["primitives"] = {}
-                for primitive in primitives:
-                    primitive_id = primitive.getAttribute("id")
-                    cib_data["resources"]["primitives"][primitive_id] = {}
-                    for attr in primitive.attributes.keys():
-                        if attr not in ["id"]:
-                            cib_data["resources"]["primitives"][primitive_id][attr] = primitive.getAttribute(attr)
-                        instance_attributes = primitive.getElementsByTagName("instance_attributes")
-                        if len(instance_attributes) > 0:
-                            cib_data["resources"]["primitives"][primitive_id]["params"] = {}
-                            nvpairs = instance_attributes[0].getElementsByTagName("nvpair")
-                            for nv in nvpairs:
-                                nv_name = nv.getAttribute("name")
-                                nv_value = nv.getAttribute("value")
-                                cib_data["resources"]["primitives"][primitive_id]["params"][nv_name] = nv_value
-
-            # Get groups
-            # Get tags: group > meta_attributes > primitives > instance-attributes > operations > op
-            groups = resources_parent[0].getElementsByTagName("group")
-            if len(groups) > 0: 
-                if "groups" not in cib_data["resources"]:
-                    cib_data["resources"]["groups"] = {}
-                for group in groups:
-                    group_id = group.getAttribute("id")
-                    cib_data["resources"]["groups"][group_id] = {}
-                    # Get group attributes
-                    for attr in group.attributes.keys():
-                        if attr not in ["id"]:
-                            cib_data["resources"]["groups"][group_id][attr] = group.getAttribute(attr)
-                    meta_attributes = group.getElementsByTagName("meta_attributes")
-                    if len(meta_attributes) > 0:
-                        cib_data["resources"]["groups"][group_id]["meta"] = {}
-                        nvpairs = meta_attributes[0].getElementsByTagName("nvpair")
-                        for nv in nvpairs:
-                            nv_name = nv.getAttribute("name")
-                            nv_value = nv.getAttribute("value")
-                            cib_data["resources"]["groups"][group_id]["meta"][nv_name] = nv_value
-                    # Get primivites under groups
-                    group_primitives = group.getElementsByTagName("primitive")
-                    if len(group_primitives) > 0:
-                        if "primitives" not in cib_data["resources"]["groups"][group_id]:
-                            cib_data["resources"]["groups"][group_id]["primitives"] = {}
-                        for primitive in group_primitives:
-                            primitive_id = primitive.getAttribute("id")
-                            cib_data["resources"]["groups"][group_id]["primitives"][primitive_id] = {}
-                            # Get primitive attributes
-                            for attr in primitive.attributes.keys():
-                                if attr not in ["id"]:
-                                    cib_data["resources"]["groups"][group_id]["primitives"][primitive_id][attr] = primitive.getAttribute(attr)
-                            instance_attributes = primitive.getElementsByTagName("instance_attributes")
-                            if len(instance_attributes) > 0:
-                                cib_data["resources"]["groups"][group_id]["primitives"][primitive_id]["params"] = {}
-                                nvpairs = instance_attributes[0].getElementsByTagName("nvpair")
-                                # Get nvpairs under attrs
-                                for nv in nvpairs:
-                                    nv_name = nv.getAttribute("name")
-                                    nv_value = nv.getAttribute("value")
-                                    cib_data["resources"]["groups"][group_id]["primitives"][primitive_id]["params"][nv_name] = nv_value
-                            # Get operations
-                            operations = primitive.getElementsByTagName("operations")
-                            ops = operations[0].getElementsByTagName("op")
-                            if len(ops) > 0:
-                                cib_data["resources"]["groups"][group_id]["primitives"][primitive_id]["operations"] = {}
-                                for op in ops:
-                                    op_name = op.getAttribute("name")
-                                    cib_data["resources"]["groups"][group_id]["primitives"][primitive_id]["operations"][op_name] = {}
-                                    for attr in op.attributes.keys():
-                                        cib_data["resources"]["groups"][group_id]["primitives"][primitive_id]["operations"][op_name][attr] = op.getAttribute(attr)
-
-            # Get master/slave (multi-state resources)
-            masters = resources_parent[0].getElementsByTagName("master")
-            if len(masters) > 0:
-                cib_data["resources"]["masters"] = {}
-            for master in masters:
-                master_id = master.getAttribute("id")
-                cib_data["resources"]["masters"][master_id] = {}
-                meta_attributes = master.getElementsByTagName("meta_attributes")
-                if len(meta_attributes) > 0:
-                    cib_data["resources"]["masters"][master_id]["meta"] = {}
-                    nvpairs = meta_attributes[0].getElementsByTagName("nvpair")
-                    for nv in nvpairs:
-                        nv_name = nv.getAttribute("name")
-                        nv_value = nv.getAttribute("value")
-                        cib_data["resources"]["masters"][master_id]["meta"][nv_name] = nv_value
-                primitives = master.getElementsByTagName("primitive")
-                if len(primitives) > 0:
-                    cib_data["resources"]["masters"][master_id]["primitives"] = {}
-                    for primitive in primitives:
-                        primitive_id = primitive.getAttribute("id")
-                        cib_data["resources"]["masters"][master_id]["primitives"][primitive_id] = {}
-                        # Get primitive attributes
-                        for attr in primitive.attributes.keys():
-                            if attr not in ["id"]:
-                                cib_data["resources"]["masters"][master_id]["primitives"][primitive_id][attr] = primitive.getAttribute(attr)
-                        instance_attributes = primitive.getElementsByTagName("instance_attributes")
-                        if len(instance_attributes) > 0:
-                            cib_data["resources"]["masters"][master_id]["primitives"][primitive_id]["params"] = {}
-                            nvpairs = instance_attributes[0].getElementsByTagName("nvpair")
-                            # Get nvpairs under attrs
-                            for nv in nvpairs:
-                                nv_name = nv.getAttribute("name")
-                                nv_value = nv.getAttribute("value")
-                                cib_data["resources"]["masters"][master_id]["primitives"][primitive_id]["params"][nv_name] = nv_value
-                        # Get operations
-                        operations = primitive.getElementsByTagName("operations")
-                        ops = operations[0].getElementsByTagName("op")
-                        if len(ops) > 0:
-                            cib_data["resources"]["masters"][master_id]["primitives"][primitive_id]["operations"] = {}
-                            for op in ops:
-                                op_name = op.getAttribute("name")
-                                cib_data["resources"]["masters"][master_id]["primitives"][primitive_id]["operations"][op_name] = {}
-                                for attr in op.attributes.keys():
-                                    cib_data["resources"]["masters"][master_id]["primitives"][primitive_id]["operations"][op_name][attr] = op.getAttribute(attr)
-
-            # Get clones
-            clones = resources_parent[0].getElementsByTagName("clone")  
-            if len(clones) > 0:
-                cib_data["resources"]["clones"] = {}
-                for clone in clones:
-                    clone_id = clone.getAttribute("id")
-                    cib_data["resources"]["clones"][clone_id] = {}
-                    meta_attributes = clone.getElementsByTagName("meta_attributes")
-                    if len(meta_attributes) > 0:
-                        cib_data["resources"]["clones"][clone_id]["meta"] = {}
-                        nvpairs = meta_attributes[0].getElementsByTagName("nvpair")
-                        for nv in nvpairs:
-                            nv_name = nv.getAttribute("name")
-                            nv_value = nv.getAttribute("value")
-                            cib_data["resources"]["clones"][clone_id]["meta"][nv_name] = nv_value
-                    primitives = clone.getElementsByTagName("primitive")
-                    if len(primitives) > 0:
-                        cib_data["resources"]["clones"][clone_id]["primitives"] = {}
-                        for primitive in primitives:
-                            primitive_id = primitive.getAttribute("id")
-                            cib_data["resources"]["clones"][clone_id]["primitives"][primitive_id] = {}
-                            # Get primitive attributes
-                            for attr in primitive.attributes.keys():
-                                if attr not in ["id"]:
-                                    cib_data["resources"]["clones"][clone_id]["primitives"][primitive_id][attr] = primitive.getAttribute(attr)
-                            instance_attributes = primitive.getElementsByTagName("instance_attributes")
-                            if len(instance_attributes) > 0:
-                                cib_data["resources"]["clones"][clone_id]["primitives"][primitive_id]["params"] = {}
-                                nvpairs = instance_attributes[0].getElementsByTagName("nvpair")
-                                # Get nvpairs under attrs
-                                for nv in nvpairs:
-                                    nv_name = nv.getAttribute("name")
-                                    nv_value = nv.getAttribute("value")
-                                    cib_data["resources"]["clones"][clone_id]["primitives"][primitive_id]["params"][nv_name] = nv_value
-                            # Get operations
-                            operations = primitive.getElementsByTagName("operations")
-                            ops = operations[0].getElementsByTagName("op")
-                            if len(ops) > 0:
-                                cib_data["resources"]["clones"][clone_id]["primitives"][primitive_id]["operations"] = {}
-                                for op in ops:
-                                    op_name = op.getAttribute("name")
-                                    cib_data["resources"]["clones"][clone_id]["primitives"][primitive_id]["operations"][op_name] = {}
-                                    for attr in op.attributes.keys():
-                                        cib_data["resources"]["clones"][clone_id]["primitives"][primitive_id]["operations"][op_name][attr] = op.getAttribute(attr)
-
-        # Get constraints
-        constraints = cfg[0].getElementsByTagName("constraints")
-        if len(constraints) > 0:
-            cib_data["constraints"] = {}
-            rsc_colocation = constraints[0].getElementsByTagName("rsc_colocation")
-            if len(rsc_colocation) > 0:
-                cib_data["constraints"]["colocations"] = {}
-                for colocation in rsc_colocation:
-                    colocation_id = colocation.getAttribute("id")
-                    cib_data["constraints"]["colocations"][colocation_id] = {}
-                    for attr in colocation.attributes.keys():
-                        cib_data["constraints"]["colocations"][colocation_id][attr] = colocation.getAttribute(attr)
-
-         # Get resource defaults
-        rsc_defaults = xdom.getElementsByTagName("rsc_defaults")
-        if len(rsc_defaults) > 0:
-            cib_data["rsc_defaults"] = {}
-            meta_attributes = rsc_defaults[0].getElementsByTagName("meta_attributes")
-            if len(meta_attributes) > 0:
-                rsc_defaults_id =  meta_attributes[0].getAttribute("id")
-                print(f"Resource Defaults ID: {rsc_defaults_id}")
-                cib_data["rsc_defaults"][rsc_defaults_id] =   {}
-                nvpairs = meta_attributes[0].getElementsByTagName("nvpair")
-                if len(nvpairs) > 0:
-                    for nv in nvpairs:
-                        nv_name = nv.getAttribute("name")
-                        nv_value = nv.getAttribute("value")
-                        cib_data["rsc_defaults"][rsc_defaults_id][nv_name] = nv_value
-
-        # Get operation defaults
-        op_defaults = xdom.getElementsByTagName("op_defaults")
-        if len(op_defaults) > 0:
-            cib_data["op_defaults"] = {}
-            meta_attributes = op_defaults[0].getElementsByTagName("meta_attributes")
-            if len(meta_attributes) > 0:
-                op_defaults_id =  meta_attributes[0].getAttribute("id")
-                print(f"Operation Defaults ID: {op_defaults_id}")
-                cib_data["op_defaults"][op_defaults_id] =   {}
-                nvpairs = meta_attributes[0].getElementsByTagName("nvpair")
-                if len(nvpairs) > 0:
-                    for nv in nvpairs:
-                        nv_name = nv.getAttribute("name")
-                        nv_value = nv.getAttribute("value")
-                        cib_data["op_defaults"][op_defaults_id][nv_name] = nv_value
+    for node_uname in cib_data.get("nodes", {}):
+        msg.debug("> cib node", "Found node {}".format(node_uname))
 
     if cluster_data.get("cib") is None:
         cluster_data["cib"] = cib_data
+        cluster_data['cib_digest'] = digest
     if cluster_data.get('insync_cib_xml') is False:
         if cluster_data['nodes'].get(node_name) is None:
-            print(f"Node {node_name} not found in cluster_data['nodes'], creating entry.")
+            msg.debug("> cib node", "Node {} not found in cluster nodes, creating entry".format(node_name))
             cluster_data['nodes'][node_name] = {}
-        cluster_data['nodes'][node_name]['cib'] = cib_data
-    #pprint.pprint(cib_data, indent=4)
-    #print('-' * 80)
-    #pprint.pprint(cluster_data)
-    #print("Node: ", node_name)
+        # Nodes refer to their CIB by digest, a CIB that differs from the cluster CIB is stored once in cibs
+        cluster_data['nodes'][node_name]['cib_digest'] = digest
+        if digest and digest != cluster_data['cib_digest']:
+            cluster_data.setdefault('cibs', {})[digest] = cib_data
     return cluster_data
 
-def _parse_cib_xml_node_state(msg, dirpath, node_name, cluster_data):
+def _parse_cib_xml_node_state(msg, dirpath, node_name, cluster_data, cib_cache=None):
     msg.verbose("Parsing cluster CIB ", "from {} node directory".format(node_name))
-    ##### crm_mon.txt
+    ##### cib.xml
     filename = "cib.xml"
     filepath = dirpath + "/" + filename
-    msg.debug("_parse_crm_mon_txt: File", filename)
-    stop_early = False
+    msg.debug("_parse_cib_xml_node_state: File", filename)
+    cib_data = {}
+    node_states = []
     try:
-        with open(filepath) as f:
-            #xtree = ET.parse(f)
-            xdom = xml.dom.minidom.parse(f)
-            f.close()
+        digest, cib_data, node_states = _load_cib_xml(msg, filepath, cib_cache)
     except Exception as e:
         msg.verbose(" Missing {}".format(filename), "{}".format(str(e)))
-        filedata = ''
 
     if cluster_data.get('cib') is None:
         cluster_data['cib'] = {}
 
-    if xdom:
-        cib_element = xdom.getElementsByTagName('cib')[0]
-        for attr in cib_element.attributes.keys():
-            msg.debug("> cib attribute", "{} = {}".format(attr, cib_element.getAttribute(attr)))  
-            #if attr in ['crm_feature_set', 'cib-last-written', 'update-origin', 'have-quorum']:
-            cluster_data['cib'][attr] = cib_element.getAttribute(attr)
-
-        # walking through cib.xml to get values
-        # cib > node_state > transient_attributes > instance_attributes > nvpair
-        node_element = xdom.getElementsByTagName('node_state')
-        for node in node_element:
-            uname =  node.getAttribute("uname")
-            if uname not in cluster_data['nodes']:
-                cluster_data['nodes'][uname] = {}
-            if 'cib_state' not in cluster_data['nodes'][uname]:
-                cluster_data['nodes'][uname]['cib_state'] = {}
-            for attr in node.attributes.keys():
-                    cluster_data['nodes'][uname]['cib_state'][attr] = node.getAttribute(attr)
-
-            trans_attrs = node.getElementsByTagName('transient_attributes')
-            for t_attr in trans_attrs:
-                cluster_data['nodes'][uname]['cib_node_attrs'] = {}
-                for attr in t_attr.attributes.keys():
-                    cluster_data['nodes'][uname]['cib_node_attrs'][str(t_attr.getAttribute(attr))] = {}
-                    i_attrs = t_attr.getElementsByTagName('instance_attributes')
-                    for i_attr in i_attrs:
-                       i_attr_id = i_attr.getAttribute('id').split('-')[1]
-                       nv_pairs = i_attr.getElementsByTagName('nvpair')
-                       for nv in nv_pairs:
-                        nv_name = nv.getAttribute('name')
-                        nv_value = nv.getAttribute('value')
-                        cluster_data['nodes'][uname]['cib_node_attrs'][i_attr_id][nv_name] = nv_value
-            
-            node_resources = {}
-            lrm_resources = node.getElementsByTagName('lrm_resource')
-            for lrm in lrm_resources:
-                resource_id = lrm.getAttribute("id")
-                if resource_id not in node_resources:
-                    node_resources[resource_id] = {}
-                for attr in ['type', 'class']:
-                    node_resources[resource_id][attr] = lrm.getAttribute(attr)
-                    lrm_ops = lrm.getElementsByTagName('lrm_rsc_op')
-
-                    if node_resources[resource_id].get('operations') is None:
-                        node_resources[resource_id]['operations'] = {}
-                    for op in lrm_ops:
-                        op_name = op.getAttribute('operation')
-                        on_node = op.getAttribute('on_node')
-                        rc_code = op.getAttribute('rc-code')
-                        node_resources[resource_id]['operations'][op_name] = {
-                            'on_node': on_node,
-                            'rc_code': rc_code
-                        }
-
-            if cluster_data['insync_cib_xml'] is True:
-                cluster_data['resources'] = node_resources
-                break
-            else:
-                cluster_data['nodes'][uname]['cib_resources'] = node_resources
+    for attr in cib_data:
+        if isinstance(cib_data[attr], str):
+            msg.debug("> cib attribute", "{} = {}".format(attr, cib_data[attr]))
+            cluster_data['cib'][attr] = cib_data[attr]
+
+    for node_state in node_states:
+        uname = node_state['uname']
+        if uname not in cluster_data['nodes']:
+            cluster_data['nodes'][uname] = {}
+        if 'cib_state' not in cluster_data['nodes'][uname]:
+            cluster_data['nodes'][uname]['cib_state'] = {}
+        cluster_data['nodes'][uname]['cib_state'].update(node_state['state'])
+        if node_state['attrs'] is not None:
+            cluster_data['nodes'][uname]['cib_node_attrs'] = node_state['attrs']
+
+        if cluster_data.get('insync_cib_xml') is True:
+            cluster_data['resources'] = node_state['resources']
+            break
+        else:
+            cluster_data['nodes'][uname]['cib_resources'] = node_state['resources']
 
     return cluster_data
 
 
 def _get_nodes_cluster_cib(msg, file_data, cluster_data):
     found_crm_xml = False
-    subfolders = [ f.path for f in os.scandir(file_data['dirpath_data_source']) if f.is_dir() ]
+    cib_cache = {}
+    subfolders = _node_dirs(file_data)
     for node_data_source in subfolders:
         node_name = os.path.basename(node_data_source)
         msg.verbose("Processing cluster CIB info", "from {} node directory".format(node_name))
         if node_name not in cluster_data['nodes']:
             cluster_data['nodes'][node_name] = {}
             msg.debug("_get_nodes_cluster_cib:", "Added {} from {}".format(node_name, "directory"))
-#       next line fails %%%
-#       cluster_data = _parse_cib_xml_cfg(msg, node_data_source, node_name, cluster_data)
+        if pcrcore.source_exists(node_data_source + "/cib.xml"):
+            cluster_data = _parse_cib_xml_cfg(msg, node_data_source, node_name, cluster_data, cib_cache)
+    msg.debug("_get_nodes_cluster_cib:", "Parsed {} distinct CIBs for {} nodes".format(len(cib_cache), len(subfolders)))
+    # The graphs are for the patterns only, keep them out of report_data
+    for digest, (cib_data, node_states) in cib_cache.items():
+        graph = cib_data.pop('graph', None)
+        if graph is not None:
+            pcrcore.register_cib_graph(file_data['dirpath_data_source'], digest, graph)
 
     return cluster_data
             
 
-def _get_nodes_cluster_crm(msg, file_data, cluster_data):
+def _node_cluster_crm(msg, node_data_source, node_name, fragment):
+    msg.verbose("Processing cluster CRM info", "from {} node directory".format(node_name))
+    msg.debug("_get_nodes_cluster_crm:", "incremented cnt_nodes_included and set is_included on {}".format(node_name))
+    fragment['cnt_nodes_included'] += 1
+    fragment['nodes'][node_name]['is_included'] = True
+
+    ##### DC and RUNNING files
+    file_dc = node_data_source + "/DC"
+    file_running = node_data_source + "/RUNNING"
+    if pcrcore.source_exists(file_dc):
+        msg.debug(">", "Added DC node {} from {}".format(node_name, "directory"))
+        fragment['nodes'][node_name]['is_dc_local'] = True
+    else:
+        fragment['nodes'][node_name]['is_dc_local'] = False
+
+    if pcrcore.source_exists(file_running):
+        fragment['nodes'][node_name]['is_running'] = True
+    else:
+        fragment['nodes'][node_name]['is_running'] = False
+
+    fragment, found_crm_mon = _parse_crm_mon(msg, node_data_source, node_name, fragment, False)
+    fragment, found_members = _parse_members_txt(msg, node_data_source, fragment, False)
+    return [fragment, {'crm_mon': found_crm_mon, 'members': found_members}]
+
+def _get_nodes_cluster_crm(msg, file_data, cluster_data, node_fragments):
     found_crm_mon = False
     found_members = False
-    subfolders = [ f.path for f in os.scandir(file_data['dirpath_data_source']) if f.is_dir() ]
+    subfolders = _node_dirs(file_data)
     for node_data_source in subfolders:
         node_name = os.path.basename(node_data_source)
-        msg.verbose("Processing cluster CRM info", "from {} node directory".format(node_name))
         if node_name not in cluster_data['nodes']:
             cluster_data['nodes'][node_name] = {}
             msg.debug("_get_nodes_cluster_crm:", "Added {} from {}".format(node_name, "directory"))
 
-        msg.debug("_get_nodes_cluster_crm:", "incremented cnt_nodes_included and set is_included on {}".format(node_name))
-        cluster_data['cnt_nodes_included'] += 1
-        cluster_data['nodes'][node_name]['is_included'] = True
-
-        ##### DC and RUNNING files
-        file_dc = node_data_source + "/DC"
-        file_running = node_data_source + "/RUNNING"
-        if os.path.exists(file_dc):
-            msg.debug(">", "Added DC node {} from {}".format(node_name, "directory"))
-            cluster_data['nodes'][node_name]['is_dc_local'] = True
-        else:
-            cluster_data['nodes'][node_name]['is_dc_local'] = False
-
-        if os.path.exists(file_running):
-            cluster_data['nodes'][node_name]['is_running'] = True
-        else:
-            cluster_data['nodes'][node_name]['is_running'] = False
-
-        cluster_data, found_crm_mon = _parse_crm_mon_txt(msg, node_data_source, node_name, cluster_data, found_crm_mon)
-        cluster_data, found_members = _parse_members_txt(msg, node_data_source, cluster_data, found_members)
+        output, fragment, found = node_fragments[node_name]['crm']
+        print(output, end='', file=msg.get_output())
+        cluster_data = _merge_node_fragment(cluster_data, fragment, node_name)
+        found_crm_mon = found_crm_mon or found['crm_mon']
+        found_members = found_members or found['members']
 
     # find missing nodes excluded from members.txt or directories
     node_states = ['unclean', 'standby', 'pending', 'maintenance', 'offline', 'online']
@@ -1018,11 +1385,12 @@ def _get_nodes_cluster_crm(msg, file_data, cluster_data):
 
     # if node directories don't have crm_mon.txt, check source directory
     if not found_crm_mon:
-        filename = "crm_mon.txt"
-        filepath = file_data['dirpath_data_source'] + "/" + filename
-        if os.path.exists(filepath):
-            msg.verbose("Found {}".format(filename), filepath)
-            cluster_data, found_crm_mon = _parse_crm_mon_txt(msg, file_data['dirpath_data_source'], node_name, cluster_data, found_crm_mon)
+        for filename in ["crm_mon.xml", "crm_mon.txt"]:
+            filepath = file_data['dirpath_data_source'] + "/" + filename
+            if pcrcore.source_exists(filepath):
+                msg.verbose("Found {}".format(filename), filepath)
+                cluster_data, found_crm_mon = _parse_crm_mon(msg, file_data['dirpath_data_source'], node_name, cluster_data, found_crm_mon)
+                break
 
     if not found_crm_mon:
         msg.min("WARNING:", "Cluster data incomplete, no crm_mon.txt file found.")
@@ -1039,7 +1407,7 @@ def _parse_sbd_txt(msg, dirpath, cluster_data, found_sbd_txt):
     filepath = dirpath + "/" + filename
     msg.verbose(" Parse File", filepath)
     try:
-        with open(filepath) as f:
+        with pcrcore.open_source_file(filepath) as f:
             filedata = f.read().splitlines()
             f.close()
     except Exception as e:
@@ -1068,7 +1436,7 @@ def _parse_sbd(msg, dirpath, cluster_data, found_sbd):
     msg.verbose(" Parse File", filepath)
 
     try:
-        with open(filepath) as f:
+        with pcrcore.open_source_file(filepath) as f:
             filedata = f.read().splitlines()
             f.close()
     except Exception as e:
@@ -1091,17 +1459,24 @@ def _parse_sbd(msg, dirpath, cluster_data, found_sbd):
 
     return [cluster_data, found_sbd]
 
-def _get_stonith_sbd(msg, file_data, cluster_data):
-    subfolders = [ f.path for f in os.scandir(file_data['dirpath_data_source']) if f.is_dir() ]
+def _node_stonith_sbd(msg, node_data_source, node_name, fragment):
+    msg.verbose("Processing SBD info", "from {} node directory".format(node_name))
+    fragment, found_sbd_txt = _parse_sbd_txt(msg, node_data_source, fragment, False)
+    fragment, found_sbd = _parse_sbd(msg, node_data_source, fragment, False)
+    return [fragment, {'sbd_txt': found_sbd_txt, 'sbd': found_sbd}]
+
+def _get_stonith_sbd(msg, file_data, cluster_data, node_fragments):
+    subfolders = _node_dirs(file_data)
     found_sbd_txt = False
     found_sbd = False
     cluster_data['stonith']['sbd']['all_clear'] = -1
     for node_data_source in subfolders:
         node_name = os.path.basename(node_data_source)
-        msg.verbose("Processing SBD info", "from {} node directory".format(node_name))
-
-        cluster_data, found_sbd_txt = _parse_sbd_txt(msg, node_data_source, cluster_data, found_sbd_txt)
-        cluster_data, found_sbd = _parse_sbd(msg, node_data_source, cluster_data, found_sbd)
+        output, fragment, found = node_fragments[node_name]['sbd']
+        print(output, end='', file=msg.get_output())
+        cluster_data = _merge_node_fragment(cluster_data, fragment, node_name)
+        found_sbd_txt = found_sbd_txt or found['sbd_txt']
+        found_sbd = found_sbd or found['sbd']
 
     if not found_sbd:
         msg.verbose("Warning:", "No sbd configuration file found")
@@ -1162,6 +1537,176 @@ def _get_cluster_nodes_state(msg, file_data, cluster_data):
 
     return cluster_data
 
+def _new_node_fragment(node_name):
+    '''
+    Returns an empty cluster_data for the parsers of a single node directory.
+    nodes_online and nodes_offline start as None to tell an empty list parsed
+    from crm_mon.txt from one that was never parsed.
+    '''
+    return {
+        'nodes': {node_name: {}},
+        'stonith': {
+            'sbd': {
+                'found': False,
+                'config': {},
+            },
+            'enabled': False,
+        },
+        'cnt_nodes_configured': -1,
+        'cnt_nodes_included': 0,
+        'cnt_resources_configured': -1,
+        'has_quorum': False,
+        'cluster_maintenance': False,
+        'nodes_online': None,
+        'nodes_offline': None,
+        'nodes_unclean': [],
+        'nodes_pending': [],
+        'nodes_standby': [],
+        'nodes_maintenance': [],
+        'permissions_valid_all_nodes': 1,
+    }
+
+def _merge_node_fragment(cluster_data, fragment, node_name):
+    '''
+    Applies a node fragment to cluster_data the way parsing that node
+    directory in place would have, so merging in directory order gives the
+    same cluster_data as parsing the nodes one after another.
+    '''
+    for fragment_node, fragment_node_data in fragment['nodes'].items():
+        if fragment_node not in cluster_data['nodes']:
+            cluster_data['nodes'][fragment_node] = fragment_node_data
+        elif fragment_node == node_name:
+            cluster_data['nodes'][fragment_node].update(fragment_node_data)
+        else:
+            # Other nodes are only added as not included when they are new
+            for key, value in fragment_node_data.items():
+                if key != 'is_included':
+                    cluster_data['nodes'][fragment_node][key] = value
+    for key in ['has_quorum', 'cluster_maintenance']:
+        cluster_data[key] = cluster_data[key] or fragment[key]
+    for key in ['cnt_nodes_configured', 'cnt_resources_configured']:
+        if fragment[key] != -1:
+            cluster_data[key] = fragment[key]
+    for key in ['nodes_online', 'nodes_offline']:
+        if fragment[key] is not None:
+            cluster_data[key] = fragment[key]
+    for key in ['nodes_unclean', 'nodes_pending', 'nodes_standby', 'nodes_maintenance']:
+        for entry in fragment[key]:
+            if entry not in cluster_data[key]:
+                cluster_data[key].append(entry)
+    cluster_data['cnt_nodes_included'] += fragment['cnt_nodes_included']
+    if fragment['permissions_valid_all_nodes'] == 0:
+        cluster_data['permissions_valid_all_nodes'] = 0
+    cluster_data['stonith']['enabled'] = cluster_data['stonith']['enabled'] or fragment['stonith']['enabled']
+    for key, value in fragment['stonith'].items():
+        if key == 'sbd':
+            sbd = cluster_data['stonith']['sbd']
+            sbd['found'] = sbd['found'] or value['found']
+            sbd['config'].update(value['config'])
+            for server, server_data in value.get('nodes', {}).items():
+                if 'nodes' not in sbd:
+                    sbd['nodes'] = {}
+                if server not in sbd['nodes']:
+                    sbd['nodes'][server] = {'slots': []}
+                sbd['nodes'][server]['slots'].extend(server_data['slots'])
+        elif key != 'enabled' and key not in cluster_data['stonith']:
+            cluster_data['stonith'][key] = value
+
+    return cluster_data
+
+def _parse_node_dir(log_level, description_width, node_data_source, node_files = None):
+    '''
+    Parses one node directory for each collector into its own fragment.
+    Returns the buffered messages, fragment and found flags per collector.
+    A worker process is handed the node_files of a mounted archive, which
+    are mounted in the worker for the time of the parse.
+    '''
+    node_name = os.path.basename(node_data_source)
+    node_fragments = {}
+    if node_files is not None:
+        pcrcore.mount_files(node_data_source, node_files)
+    try:
+        for collector, parse_node in [['system', _node_system_details], ['crm', _node_cluster_crm], ['sbd', _node_stonith_sbd]]:
+            msg = pcrcore.DisplayMessages()
+            msg.set_level(log_level)
+            msg.set_width(description_width)
+            msg.set_output(io.StringIO())
+            fragment, found = parse_node(msg, node_data_source, node_name, _new_node_fragment(node_name))
+            node_fragments[collector] = [msg.get_output().getvalue(), fragment, found]
+    finally:
+        if node_files is not None:
+            pcrcore.unmount_archive(node_data_source)
+    return node_fragments
+
+def _read_node_files(node_data_source):
+    '''Returns the contents of the parsed files in a node directory of a mounted archive'''
+    node_files = {}
+    for filename in NODE_PARSED_FILES:
+        filepath = node_data_source + "/" + filename
+        if pcrcore.source_exists(filepath):
+            with pcrcore.open_source_file(filepath, 'rb') as f:
+                node_files[filename] = f.read()
+    return node_files
+
+def _unparsed_node_dir(node_name):
+    '''Returns the fragments of a node directory that was not parsed, with nothing found by any collector'''
+    fragment = _new_node_fragment(node_name)
+    fragment['nodes'][node_name]['is_included'] = False
+    return {
+        'system': ['', fragment, {'sysinfo': False, 'sysstats': False, 'permissions': False}],
+        'crm': ['', fragment, {'crm_mon': False, 'members': False}],
+        'sbd': ['', fragment, {'sbd_txt': False, 'sbd': False}],
+    }
+
+def _parse_node_dirs(msg, file_data):
+    '''
+    Parses the node directories, in parallel worker processes when the
+    resource plan has more than one parse worker and the node files are
+    large enough to be worth it. Returns the fragments by node name and the
+    names of the nodes whose parse did not finish within
+    PARALLEL_PARSE_TIMEOUT, which have empty fragments.
+    '''
+    subfolders = _node_dirs(file_data)
+    parse_workers = min(file_data.get('resources', {}).get('parse_workers', 1), len(subfolders))
+    node_bytes = 0
+    for node_files in _source_manifest(msg, file_data)['nodes'].values():
+        node_bytes += sum([ stat['size'] for filename, stat in node_files.items() if filename in NODE_PARSED_FILES ])
+    if node_bytes < PARALLEL_PARSE_MIN_BYTES:
+        parse_workers = 1
+    msg.debug("> parse", "nodes={}, parse_workers={}, bytes={}".format(len(subfolders), parse_workers, node_bytes))
+
+    node_fragments = {}
+    nodes_unparsed = []
+    if parse_workers > 1:
+        # Forking would copy locks held by this process's other threads, so the
+        # workers are started fresh and a mounted archive's files are sent along
+        mounted = pcrcore.is_mounted(file_data.get('dirpath_embedded', ''))
+        pool = multiprocessing.get_context('forkserver').Pool(parse_workers)
+        try:
+            parses = []
+            for node_data_source in subfolders:
+                node_files = _read_node_files(node_data_source) if mounted else None
+                parses.append([node_data_source, pool.apply_async(_parse_node_dir, (msg.get_level(), msg.get_width(), node_data_source, node_files))])
+            time_limit = time.monotonic() + PARALLEL_PARSE_TIMEOUT
+            for node_data_source, parse in parses:
+                node_name = os.path.basename(node_data_source)
+                try:
+                    node_fragments[node_name] = parse.get(max(0, time_limit - time.monotonic()))
+                except multiprocessing.TimeoutError:
+                    nodes_unparsed.append(node_name)
+                    node_fragments[node_name] = _unparsed_node_dir(node_name)
+        finally:
+            # Ends a worker still hung on a node directory as well
+            pool.terminate()
+            pool.join()
+        if nodes_unparsed:
+            msg.min(" WARNING:", "Parsing node directories timed out after {}s: {}".format(PARALLEL_PARSE_TIMEOUT, ' '.join(nodes_unparsed)))
+    else:
+        for node_data_source in subfolders:
+            node_fragments[os.path.basename(node_data_source)] = _parse_node_dir(msg.get_level(), msg.get_width(), node_data_source)
+
+    return node_fragments, nodes_unparsed
+
 def get_cluster_data(msg, file_data):
     cluster_data = {
         'data_complete': True,
@@ -1191,24 +1736,113 @@ def get_cluster_data(msg, file_data):
         'insync_corosync_conf': False,
         'insync_sysinfo_txt': False,
         'insync_cib_xml': False,
+        'cib_digests': {},
+        'cibs': {},
+        'nodes_unparsed': [],
    }
 
+    _source_manifest(msg, file_data)
     cluster_data = _get_cluster_basics(msg, file_data, cluster_data)
-    cluster_data = _get_nodes_system_details(msg, file_data, cluster_data)
-    cluster_data = _get_nodes_cluster_crm(msg, file_data, cluster_data)
+    node_fragments, cluster_data['nodes_unparsed'] = _parse_node_dirs(msg, file_data)
+    cluster_data = _get_nodes_system_details(msg, file_data, cluster_data, node_fragments)
+    cluster_data = _get_nodes_cluster_crm(msg, file_data, cluster_data, node_fragments)
     cluster_data = _get_nodes_cluster_cib(msg, file_data, cluster_data)
 #    else:
 #        cluster_data = _get_nodes_cluster_crm(msg, file_data, cluster_data)
 #        cluster_data = _get_nodes_cluster_cib(msg, file_data, cluster_data)
 
     if cluster_data['stonith']['sbd']['found']:
-        cluster_data = _get_stonith_sbd(msg, file_data, cluster_data)
+        cluster_data = _get_stonith_sbd(msg, file_data, cluster_data, node_fragments)
     cluster_data = _get_cluster_nodes_state(msg, file_data, cluster_data)
     if cluster_data['cnt_nodes_configured'] != cluster_data['cnt_nodes_included']:
         cluster_data['permissions_valid_all_nodes'] = -1
+    if cluster_data['nodes_unparsed']:
+        cluster_data['data_complete'] = False
 
     return cluster_data
 
+def _parse_log_line(line, date_info):
+    EX_OK = 0
+    t_fmt = date_info[0]
+    t_trim = date_info[1]
+    try:
+        # Attempt to parse the timestamp from the beginning of the line
+        timestamp_str = line[:t_trim]
+        timestamp = dt.strptime(timestamp_str, t_fmt)
+        return EX_OK, 0, (timestamp, line)
+    except ValueError:
+        # If timestamp parsing fails, treat it as a non-timestamped line
+        # and place it at the end of the sorted output (or handle as needed)
+        return EX_OK, 1, (dt.max, line) # Puts non-timestamped lines last
+
+def _write_log_run(dirpath_runs, f_index, run_paths, lines):
+    # Each run line starts with a fixed width sort key so the runs can be merged as text
+    lines.sort(key=lambda x: x[0])
+    run_path = "{}/{}.{}.run".format(dirpath_runs, f_index, len(run_paths))
+    with open(run_path, 'w') as run_file:
+        for timestamp, line in lines:
+            run_file.write(timestamp.strftime(LOG_RUN_KEY_FORMAT).zfill(LOG_RUN_KEY_WIDTH) + "\t" + line + "\n")
+    run_paths.append(run_path)
+
+def _sort_log_file(f_path, f_index, date_info, dirpath_runs, buffer_lines):
+    '''
+    Parses the timestamps of f_path and writes them as sorted runs of at most
+    buffer_lines lines into dirpath_runs. Returns the run paths, the number
+    of lines and the number of lines without a valid timestamp.
+    '''
+    run_paths = []
+    lines = []
+    line_count = 0
+    exceptions = 0
+    with open(f_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            _rc, exception, _line_parts = _parse_log_line(line, date_info)
+            exceptions += exception
+            lines.append(_line_parts)
+            line_count += 1
+            if len(lines) >= buffer_lines:
+                _write_log_run(dirpath_runs, f_index, run_paths, lines)
+                lines = []
+    if lines:
+        _write_log_run(dirpath_runs, f_index, run_paths, lines)
+
+    return [run_paths, line_count, exceptions]
+
+def _merge_log_runs(run_paths, outfile, keep_keys):
+    '''Merges the sorted run_paths into outfile by their timestamp keys, ties keep the run order'''
+    with contextlib.ExitStack() as stack:
+        run_files = [ stack.enter_context(open(run_path, 'r')) for run_path in run_paths ]
+        for line in heapq.merge(*run_files, key=lambda x: x[:LOG_RUN_KEY_WIDTH]):
+            outfile.write(line if keep_keys else line[LOG_RUN_KEY_WIDTH+1:])
+
+def _reduce_log_runs(dirpath_runs, run_paths):
+    '''
+    Merges consecutive groups of LOG_MERGE_FAN_IN runs into longer runs until
+    no more than LOG_MERGE_FAN_IN are left, so the final merge does not
+    hold a file open for every run. Returns the remaining run paths.
+    '''
+    merge_pass = 0
+    while len(run_paths) > LOG_MERGE_FAN_IN:
+        merged_paths = []
+        for start in range(0, len(run_paths), LOG_MERGE_FAN_IN):
+            merged_path = "{}/merge.{}.{}.run".format(dirpath_runs, merge_pass, len(merged_paths))
+            with open(merged_path, 'w') as outfile:
+                _merge_log_runs(run_paths[start:start+LOG_MERGE_FAN_IN], outfile, True)
+            for run_path in run_paths[start:start+LOG_MERGE_FAN_IN]:
+                os.remove(run_path)
+            merged_paths.append(merged_path)
+        run_paths = merged_paths
+        merge_pass += 1
+    return run_paths
+
+def _merge_runs_dir(source_data):
+    '''Returns the directory to write the sorted runs of a report's log files in'''
+    for key in ['dirpath_extract_entry', 'dirpath_extract_here']:
+        if source_data.get(key, ''):
+            return source_data[key]
+    return source_data['dirpath_reports']
+
 def synchronize_log_files(msg, report_data):
     msg.min("Log Files", "Combining and Sorting")
     EX_OK = 0
@@ -1221,17 +1855,11 @@ def synchronize_log_files(msg, report_data):
         ['%b %d %H:%M:%S.%f', 19],
         ['%b %d %H:%M:%S', 15],
     ]
-    log_files = {
-    #   The date format to use for each log file and the preferred order to test which is used
-    #   'log file': [list of indeces to possible date_formats],
-        'pacemaker.log': [2, 3, 1],
-        'corosync.log': [3, 2, 1],
-        'journal_corosync.log': [1, 2, 3],
-        'journal_pacemaker.log': [1, 2, 3],
-        'journal_sbd.log': [1, 2, 3],
-        'ha-log.txt': [1, 2, 3],
-    }
+    log_files = LOG_FILES
     f_names = []
+    resources = report_data['source_data'].get('resources', {})
+    merge_workers = resources.get('merge_workers', 1)
+    governor = pcrcore.ResourceGovernor(resources.get('cpu_budget', 0), resources.get('memory_budget', 0))
 
     def _get_date_format(f_path, date_formats, eval_order):
         header_lines = []
@@ -1241,7 +1869,7 @@ def synchronize_log_files(msg, report_data):
         len_fnames = 0
 
         # Read the first MAX_HEADER_LINES header_lines to determine the date format from the f_path given
-        with open(f_path, 'r') as f:
+        with pcrcore.open_source_file(f_path) as f:
             msg.debug("_get_date_format", f_path)
             line_count = 0
             for line in f:
@@ -1276,27 +1904,19 @@ def synchronize_log_files(msg, report_data):
 
         return empty, idx_date
 
-    def _parse_log_line(line, date_info):
-        EX_OK = 0
-        t_fmt = date_info[0]
-        t_trim = date_info[1]
-        try:
-            # Attempt to parse the timestamp from the beginning of the line
-            timestamp_str = line[:t_trim]
-            timestamp = dt.strptime(timestamp_str, t_fmt)
-            return EX_OK, 0, (timestamp, line)
-        except ValueError:
-            # If timestamp parsing fails, treat it as a non-timestamped line
-            # and place it at the end of the sorted output (or handle as needed)
-            return EX_OK, 1, (dt.max, line) # Puts non-timestamped lines last
-
+    manifest_nodes = _source_manifest(msg, report_data['source_data'])['nodes']
+    subfolders = _node_dirs(report_data['source_data'])
     for log_file in log_files.keys():
         f_names = []
-        all_lines = []
-        subfolders = [ f.path for f in os.scandir(report_data['source_data']['dirpath_data_source']) if f.is_dir() ]
+        f_sizes = {}
         for dirpath in subfolders:
             f_path = dirpath + "/" + log_file
-            if os.path.exists(f_path):
+            node_files = manifest_nodes.get(os.path.basename(dirpath))
+            if node_files is not None:
+                if log_file in node_files:
+                    f_names.append(f_path)
+                    f_sizes[f_path] = node_files[log_file]['size']
+            elif pcrcore.source_exists(f_path):
                 f_names.append(f_path)
         len_f_names = len(f_names)
 
@@ -1305,10 +1925,15 @@ def synchronize_log_files(msg, report_data):
             f_combined_path = report_data['source_data']['dirpath_reports'] + "/combined." + log_file
             msg.normal(" Combining {} File(s)".format(len_f_names), f_combined_path)
             t_parse_exceptions = 0
+            t_lines = 0
             empty_files = 0
             unsorted_files = 0
+            sort_files = []
             for f_path in f_names:
-                empty, idx_date = _get_date_format(f_path, date_formats, log_files[log_file])
+                if f_sizes.get(f_path, -1) == 0:
+                    empty, idx_date = 1, 0
+                else:
+                    empty, idx_date = _get_date_format(f_path, date_formats, log_files[log_file])
                 combined_notes.append("{}: {}".format(date_formats[idx_date], f_path))
                 if empty > 0:
                     msg.verbose(" Empty file", f_path)
@@ -1320,46 +1945,52 @@ def synchronize_log_files(msg, report_data):
                     combined_notes.append(" Skipped file, missing known date_formats")
                     unsorted_files += 1
                     continue
-                
-                # Read and parse lines from the each file in f_names
-                _rc = EX_OK
-                len_before = len(all_lines)
-                with open(f_path, 'r') as f:
-                    msg.debug("> parse", log_file)
-                    for line in f:
-                        line = line.strip()
-                        _rc, exception, _line_parts = _parse_log_line(line, date_formats[idx_date])
-                        t_parse_exceptions += exception
-                        all_lines.append(_line_parts)
-                len_after = len(all_lines)
-
-                msg.debug(">", "len_before={}, len_after={}, _rc={}".format(len_before, len_after, _rc))
-                if len_after > 0 and t_parse_exceptions == len_after:
-                    break
-                
-
-            msg.debug(">", "all_lines={}, t_parse_exceptions={}, empty_files={}, unsorted_files={}, total files={}".format(len(all_lines), t_parse_exceptions, empty_files, unsorted_files, len_f_names))
-            with open(f_combined_path, 'w') as outfile:
-                for line in combined_notes:
-                    outfile.write(line + '\n')
-                outfile.write('\n\n')
-
-            if empty_files == len_f_names:
-                msg.min(" Warning", "All {} files were empty".format(log_file))
-            elif empty_files > 0:
-                msg.min(" Note", "{} of {} {} files were empty".format(empty_files, len_f_names, log_file))
-            if unsorted_files == len_f_names:
-                msg.min(" Skipping", "All {} files could not be sorted, unexpected time format".format(log_file))
-            elif unsorted_files > 0:
-                msg.min(" Note", "{} of {} {} files could not be sorted and were skipped, unexpected time format".format(unsorted_files, len_f_names, log_file))
-
-            # Sort all log entries by their parsed timestamps
-            if all_lines:
-                all_lines.sort(key=lambda x: x[0])
-                with open(f_combined_path, 'a') as outfile:
-                    for timestamp, line in all_lines:
+                sort_files.append([f_path, idx_date])
+
+            # Parse and sort each file into runs no larger than the merge buffer,
+            # in parallel when the resource budget allows it
+            dirpath_runs = tempfile.mkdtemp(prefix='pcratool-merge-', dir=_merge_runs_dir(report_data['source_data']))
+            try:
+                buffer_lines = governor.merge_buffer_lines(resources.get('merge_buffer_lines', LOG_MERGE_BUFFER_LINES))
+                msg.debug("> merge", "files={}, merge_workers={}, buffer_lines={}".format(len(sort_files), merge_workers, buffer_lines))
+                sort_args = [ [pcrcore.source_file_path(f_path), f_index, date_formats[idx_date], dirpath_runs, buffer_lines] for f_index, (f_path, idx_date) in enumerate(sort_files) ]
+                if merge_workers > 1 and len(sort_args) > 1:
+                    # Not forked, analyze_archive may run in a thread of a pipeline or server
+                    with ProcessPoolExecutor(max_workers=min(merge_workers, len(sort_args)), mp_context=multiprocessing.get_context('forkserver')) as executor:
+                        sorted_files = list(executor.map(_sort_log_file, *zip(*sort_args)))
+                else:
+                    sorted_files = [ _sort_log_file(*args) for args in sort_args ]
+
+                all_runs = []
+                for run_paths, line_count, exceptions in sorted_files:
+                    msg.debug("> parse", "{} lines={}, runs={}".format(log_file, line_count, len(run_paths)))
+                    all_runs.extend(run_paths)
+                    t_lines += line_count
+                    t_parse_exceptions += exceptions
+                    if t_lines > 0 and t_parse_exceptions == t_lines:
+                        break
+
+                msg.debug(">", "all_lines={}, t_parse_exceptions={}, empty_files={}, unsorted_files={}, total files={}".format(t_lines, t_parse_exceptions, empty_files, unsorted_files, len_f_names))
+                with open(f_combined_path, 'w') as outfile:
+                    for line in combined_notes:
                         outfile.write(line + '\n')
+                    outfile.write('\n\n')
+
+                if empty_files == len_f_names:
+                    msg.min(" Warning", "All {} files were empty".format(log_file))
+                elif empty_files > 0:
+                    msg.min(" Note", "{} of {} {} files were empty".format(empty_files, len_f_names, log_file))
+                if unsorted_files == len_f_names:
+                    msg.min(" Skipping", "All {} files could not be sorted, unexpected time format".format(log_file))
+                elif unsorted_files > 0:
+                    msg.min(" Note", "{} of {} {} files could not be sorted and were skipped, unexpected time format".format(unsorted_files, len_f_names, log_file))
+
+                if all_runs:
+                    all_runs = _reduce_log_runs(dirpath_runs, all_runs)
+                    with open(f_combined_path, 'a') as outfile:
+                        _merge_log_runs(all_runs, outfile, False)
+            finally:
+                rmtree(dirpath_runs, ignore_errors=True)
         else:
             msg.debug("Warning", "No {} files found".format(log_file))
 
-
@@ -28,9 +28,22 @@ __date_modified__ = '2025 Oct 09'
 __version__       = '0.0.1'
 
 # IMPORTS
+import io
 import os
 import sys
 import json
+import time
+import bz2
+import gzip
+import lzma
+import atexit
+import shutil
+import tarfile
+import queue
+import socket
+import tempfile
+import threading
+import multiprocessing
 from shutil import rmtree
 import subprocess
 
@@ -118,6 +131,7 @@ class DisplayMessages():
         self.desc_width = 30 # instance default
         self.msg_display = "{:" + str(self.desc_width) + "}"
         self.msg_display_pair = self.msg_display + " = {}"
+        self.out = sys.stdout
 
     def __str__ (self):
         return "class %s(level=%r)" % (self.__class__.__name__,self.level)
@@ -127,6 +141,15 @@ class DisplayMessages():
         self.msg_display = "{:" + str(self.desc_width) + "}"
         self.msg_display_pair = self.msg_display + " = {}"
 
+    def get_width(self):
+        return self.desc_width
+
+    def set_output(self, stream):
+        self.out = stream
+
+    def get_output(self):
+        return self.out
+
     def get_level(self):
         return self.level
 
@@ -161,11 +184,11 @@ class DisplayMessages():
 
     def __write_paired_msg(self, level, msgtag, msgstr):
         if( level <= self.level ):
-            print(self.msg_display_pair.format(msgtag, msgstr))
+            print(self.msg_display_pair.format(msgtag, msgstr), file=self.out)
 
     def __write_msg(self, level, msgtag):
         if( level <= self.level ):
-            print(self.msg_display.format(msgtag))
+            print(self.msg_display.format(msgtag), file=self.out)
 
     def quiet(self, msgtag = None, msgstr = None):
         "Write messages even if quiet is set"
@@ -176,7 +199,7 @@ class DisplayMessages():
                 self.__write_msg(self.LOG_QUIET, msgtag)
         else:
             if( self.level >= self.LOG_QUIET ):
-                print()
+                print(file=self.out)
 
     def min(self, msgtag = None, msgstr = None):
         "Write the minium amount of messages"
@@ -187,7 +210,7 @@ class DisplayMessages():
                 self.__write_msg(self.LOG_MIN, msgtag)
         else:
             if( self.level >= self.LOG_MIN ):
-                print()
+                print(file=self.out)
 
     def normal(self, msgtag = None, msgstr = None):
         "Write normal, but significant, messages"
@@ -198,7 +221,7 @@ class DisplayMessages():
                 self.__write_msg(self.LOG_NORMAL, msgtag)
         else:
             if( self.level >= self.LOG_NORMAL ):
-                print()
+                print(file=self.out)
 
     def verbose(self, msgtag = None, msgstr = None):
         "Write more verbose informational messages"
@@ -209,7 +232,7 @@ class DisplayMessages():
                 self.__write_msg(self.LOG_VERBOSE, msgtag)
         else:
             if( self.level >= self.LOG_VERBOSE ):
-                print()
+                print(file=self.out)
 
     def debug(self, msgtag = None, msgstr = None):
         "Write all messages, including debug level"
@@ -221,15 +244,436 @@ class DisplayMessages():
                 self.__write_msg(self.LOG_DEBUG, updated_msgtag)
         else:
             if( self.level >= self.LOG_DEBUG ):
-                print()
+                print(file=self.out)
 
     def separator(self, width, required_level, use_char = '#'):
         if self.level >= required_level:
-            print("{}".format(use_char*width))
+            print("{}".format(use_char*width), file=self.out)
+
+class ResourceGovernor():
+    """Shares one CPU and memory budget between the archive, extraction, parsing and merging workers"""
+    CGROUP_BASE = '/sys/fs/cgroup'
+    UNLIMITED = 2**60
+    MEMORY_PER_ARCHIVE = 1024*1024*1024 # bytes reserved for each archive analyzed in parallel
+    MEMORY_HIGH_WATER = 0.8 # fraction of the memory budget where merge buffers start shrinking
+    MIN_MERGE_BUFFER_LINES = 10000
+
+    def __init__(self, cpu_budget = 0, memory_budget = 0):
+        """Zero budgets are detected from the cgroup limits, memory_budget is in bytes"""
+        if cpu_budget > 0:
+            self.cpu_budget = int(cpu_budget)
+        else:
+            self.cpu_budget = self.__detect_cpus()
+        if memory_budget > 0:
+            self.memory_budget = int(memory_budget)
+        else:
+            self.memory_budget = self.__detect_memory()
+
+    def __str__(self):
+        return 'class %s(cpu_budget=%r, memory_budget=%r)' % (self.__class__.__name__, self.cpu_budget, self.memory_budget)
+
+    def __read_value(self, filepath):
+        try:
+            with open(filepath) as f:
+                return f.read().strip()
+        except Exception:
+            return ''
+
+    def __cgroup_dirs(self):
+        # cgroup v2 has one unified hierarchy, look in our own cgroup before the mounted root
+        dirs = []
+        for line in self.__read_value('/proc/self/cgroup').splitlines():
+            if line.startswith('0::'):
+                own_dir = self.CGROUP_BASE + line[3:].rstrip('/')
+                if own_dir != self.CGROUP_BASE:
+                    dirs.append(own_dir)
+        dirs.append(self.CGROUP_BASE)
+        return dirs
+
+    def __detect_cpus(self):
+        try:
+            cpus = len(os.sched_getaffinity(0))
+        except AttributeError:
+            cpus = os.cpu_count() or 1
+        quota = -1
+        period = 0
+        for cgroup_dir in self.__cgroup_dirs():
+            value = self.__read_value(cgroup_dir + '/cpu.max').split()
+            if len(value) == 2:
+                if value[0].isdigit() and value[1].isdigit():
+                    quota = int(value[0])
+                    period = int(value[1])
+                break
+        if quota < 0:
+            value = self.__read_value(self.CGROUP_BASE + '/cpu/cpu.cfs_quota_us')
+            if value.isdigit():
+                quota = int(value)
+                period = int(self.__read_value(self.CGROUP_BASE + '/cpu/cpu.cfs_period_us') or 0)
+        if quota > 0 and period > 0:
+            cpus = min(cpus, max(1, quota // period))
+        return cpus
+
+    def __detect_memory(self):
+        limit = 0
+        for cgroup_dir in self.__cgroup_dirs():
+            value = self.__read_value(cgroup_dir + '/memory.max')
+            if value.isdigit():
+                limit = int(value)
+                break
+        if limit == 0:
+            value = self.__read_value(self.CGROUP_BASE + '/memory/memory.limit_in_bytes')
+            if value.isdigit() and int(value) < self.UNLIMITED:
+                limit = int(value)
+        if limit == 0:
+            for line in self.__read_value('/proc/meminfo').splitlines():
+                if line.startswith('MemTotal:'):
+                    limit = int(line.split()[1]) * 1024
+        return limit
+
+    def get_cpu_budget(self):
+        return self.cpu_budget
+
+    def get_memory_budget(self):
+        return self.memory_budget
+
+    def get_memory_usage(self):
+        for cgroup_dir in self.__cgroup_dirs():
+            value = self.__read_value(cgroup_dir + '/memory.current')
+            if value.isdigit():
+                return int(value)
+        value = self.__read_value(self.CGROUP_BASE + '/memory/memory.usage_in_bytes')
+        if value.isdigit():
+            return int(value)
+        meminfo = {}
+        for line in self.__read_value('/proc/meminfo').splitlines():
+            entry = line.split()
+            if len(entry) > 1 and entry[1].isdigit():
+                meminfo[entry[0]] = int(entry[1]) * 1024
+        if 'MemTotal:' in meminfo and 'MemAvailable:' in meminfo:
+            return meminfo['MemTotal:'] - meminfo['MemAvailable:']
+        return 0
+
+    def plan(self, jobs = 0, extract_workers = 0, parse_workers = 0, merge_workers = 0, merge_buffer_lines = 1000000):
+        """
+        Returns the worker counts for the archives analyzed in parallel and
+        for the pools inside each archive, splitting the CPU budget between
+        them. Zero means size it from the budget, anything else is kept. With a
+        single job, the default, node directories are parsed and log files are
+        sorted in parallel only when parse_workers and merge_workers ask for it.
+        """
+        if jobs <= 0:
+            jobs = self.cpu_budget
+            if self.memory_budget > 0:
+                jobs = min(jobs, max(1, self.memory_budget // self.MEMORY_PER_ARCHIVE))
+        per_archive = max(1, self.cpu_budget // jobs)
+        resources = {
+            'cpu_budget': self.cpu_budget,
+            'memory_budget': self.memory_budget,
+            'jobs': jobs,
+            'extract_workers': extract_workers if extract_workers > 0 else per_archive,
+            'parse_workers': parse_workers if parse_workers > 0 else (per_archive if jobs > 1 else 1),
+            'merge_workers': merge_workers if merge_workers > 0 else (per_archive if jobs > 1 else 1),
+            'merge_buffer_lines': merge_buffer_lines,
+        }
+        return resources
+
+    def merge_buffer_lines(self, requested):
+        """Shrinks the requested merge buffer the closer memory usage gets to the budget"""
+        if self.memory_budget <= 0:
+            return requested
+        usage = self.get_memory_usage() / self.memory_budget
+        buffer_lines = requested
+        if usage >= self.MEMORY_HIGH_WATER:
+            headroom = max(0.0, 1.0 - usage) / (1.0 - self.MEMORY_HIGH_WATER)
+            buffer_lines = int(requested * headroom)
+        return max(self.MIN_MERGE_BUFFER_LINES, buffer_lines)
+
+
+# Spool directories are named after their host and process so resume() can tell abandoned ones
+SPOOL_PREFIX = '.pcratool-spool.'
+
+def _spool_prefix():
+    return "{}{}.{}.".format(SPOOL_PREFIX, socket.gethostname(), os.getpid())
+
+def _spool_abandoned(name):
+    '''Returns True for a spool directory name of a process on this host that is gone'''
+    owner = name[len(SPOOL_PREFIX):].split('.')
+    if len(owner) < 3 or owner[-3] != socket.gethostname() or not owner[-2].isdigit():
+        return False
+    try:
+        os.kill(int(owner[-2]), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        return False
+    return False
+
+class ArchiveSource():
+    """
+    Read only view of the report directory inside an archive. Small members are
+    kept in memory, members larger than SPOOL_SIZE are written to a private
+    directory in the extraction directory the archive would have been extracted
+    to. Paths are the ones the members would have had if extracted.
+    """
+    SPOOL_SIZE = 1048576
+
+    def __init__(self, root):
+        self.root = root
+        self.members = {}
+        self.stats = {}
+        self.dirs = {'': True}
+        self.dirpath_spool = ''
+
+    def __relative(self, path):
+        path = os.path.normpath(path)
+        if path == self.root:
+            return ''
+        return path[len(self.root)+1:]
+
+    def __spool_path(self):
+        if not self.dirpath_spool:
+            # The root is not on disk, spool to the first directory above it that is
+            dirpath = os.path.dirname(self.root)
+            while not os.path.isdir(dirpath):
+                dirpath = os.path.dirname(dirpath)
+            try:
+                self.dirpath_spool = tempfile.mkdtemp(prefix=_spool_prefix(), dir=dirpath)
+            except OSError:
+                self.dirpath_spool = tempfile.mkdtemp(prefix=_spool_prefix())
+        fd, spool_path = tempfile.mkstemp(dir=self.dirpath_spool)
+        os.close(fd)
+        return spool_path
+
+    def add_dir(self, rel_path):
+        parts = rel_path.split('/')
+        for i in range(1, len(parts) + 1):
+            self.dirs.setdefault('/'.join(parts[:i]), True)
+
+    def add_file(self, rel_path, fileobj, size, mtime = 0):
+        self.add_dir(os.path.dirname(rel_path))
+        self.stats[rel_path] = {'size': size, 'mtime': mtime}
+        if size > self.SPOOL_SIZE:
+            spool_path = self.__spool_path()
+            with open(spool_path, 'wb') as f:
+                while True:
+                    chunk = fileobj.read(self.SPOOL_SIZE)
+                    if not chunk:
+                        break
+                    f.write(chunk)
+            self.members[rel_path] = spool_path
+        else:
+            self.members[rel_path] = fileobj.read()
 
+    def contains(self, path):
+        path = os.path.normpath(path)
+        return path == self.root or path.startswith(self.root + '/')
+
+    def exists(self, path):
+        rel_path = self.__relative(path)
+        return rel_path in self.members or rel_path in self.dirs
+
+    def isdir(self, path):
+        return self.__relative(path) in self.dirs
+
+    def subdirs(self, path):
+        rel_path = self.__relative(path)
+        prefix = rel_path + '/' if rel_path else ''
+        return [ self.root + '/' + d for d in self.dirs if d.startswith(prefix) and d != rel_path and '/' not in d[len(prefix):] ]
+
+    def open(self, path, mode = 'r'):
+        rel_path = self.__relative(path)
+        if rel_path not in self.members:
+            raise FileNotFoundError(2, 'No such file in archive', path)
+        content = self.members[rel_path]
+        if isinstance(content, str):
+            return open(content, mode)
+        if 'b' in mode:
+            return io.BytesIO(content)
+        return io.StringIO(content.decode('utf-8', errors='replace'), newline=None)
+
+    def file_path(self, path):
+        rel_path = self.__relative(path)
+        if rel_path not in self.members:
+            raise FileNotFoundError(2, 'No such file in archive', path)
+        content = self.members[rel_path]
+        if not isinstance(content, str):
+            spool_path = self.__spool_path()
+            with open(spool_path, 'wb') as f:
+                f.write(content)
+            self.members[rel_path] = spool_path
+        return self.members[rel_path]
+
+    def manifest(self):
+        manifest = {'dirpath': self.root, 'files': {}, 'nodes': {}}
+        for rel_path in self.dirs:
+            if rel_path and '/' not in rel_path:
+                manifest['nodes'][rel_path] = {}
+        for rel_path, stat in self.stats.items():
+            parts = rel_path.split('/')
+            if len(parts) == 1:
+                manifest['files'][rel_path] = stat
+            elif len(parts) == 2:
+                manifest['nodes'][parts[0]][parts[1]] = stat
+        return manifest
+
+    def close(self):
+        self.members = {}
+        self.stats = {}
+        self.dirs = {'': True}
+        if self.dirpath_spool:
+            rmtree(self.dirpath_spool, ignore_errors=True)
+            self.dirpath_spool = ''
+
+_mounted_sources = {}
+_mounted_lock = threading.Lock()
+
+def _mounted_source(path):
+    with _mounted_lock:
+        for source in _mounted_sources.values():
+            if source.contains(path):
+                return source
+    return None
+
+def is_mounted(path):
+    return os.path.normpath(path) in _mounted_sources
+
+_manifests = {}
+
+def _file_stat(entry):
+    stat = entry.stat()
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+def build_manifest(msg, dirpath):
+    """
+    Lists the report directory once: the files in it, its node directories and
+    the files in each node directory with their sizes and mtimes. While the
+    manifest is registered, open_source_file and source_exists answer for
+    those paths without touching the file system.
+    """
+    dirpath = os.path.normpath(dirpath)
+    source = _mounted_source(dirpath)
+    if source is not None:
+        manifest = source.manifest()
+    else:
+        manifest = {'dirpath': dirpath, 'files': {}, 'nodes': {}}
+        with os.scandir(dirpath) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    manifest['nodes'][entry.name] = {}
+                    with os.scandir(entry.path) as node_entries:
+                        for node_entry in node_entries:
+                            if node_entry.is_file():
+                                manifest['nodes'][entry.name][node_entry.name] = _file_stat(node_entry)
+                elif entry.is_file():
+                    manifest['files'][entry.name] = _file_stat(entry)
+    msg.debug("Manifest", "{} files, {} nodes".format(len(manifest['files']) + sum([ len(files) for files in manifest['nodes'].values() ]), len(manifest['nodes'])))
+    with _mounted_lock:
+        _manifests[dirpath] = manifest
+    return manifest
+
+def get_manifest(dirpath):
+    """Returns the manifest registered for dirpath, None when there is none"""
+    with _mounted_lock:
+        return _manifests.get(os.path.normpath(dirpath))
+
+def release_manifest(dirpath):
+    with _mounted_lock:
+        _manifests.pop(os.path.normpath(dirpath), None)
+
+# Resource and constraint graphs of the parsed CIBs by report directory and CIB
+# digest, kept for the patterns but not written to report_data.json
+_cib_graphs = {}
+
+def register_cib_graph(dirpath, digest, graph):
+    with _mounted_lock:
+        _cib_graphs.setdefault(os.path.normpath(dirpath), {})[digest] = graph
+
+def get_cib_graph(dirpath, digest):
+    """Returns the graph of the CIB with digest parsed from dirpath, None when there is none"""
+    with _mounted_lock:
+        return _cib_graphs.get(os.path.normpath(dirpath), {}).get(digest)
+
+def release_cib_graphs(dirpath):
+    with _mounted_lock:
+        _cib_graphs.pop(os.path.normpath(dirpath), None)
+
+def _manifest_exists(path):
+    """Returns True or False for a path covered by a registered manifest, None otherwise"""
+    path = os.path.normpath(path)
+    with _mounted_lock:
+        for dirpath, manifest in _manifests.items():
+            if path == dirpath:
+                return True
+            if path.startswith(dirpath + '/'):
+                parts = path[len(dirpath)+1:].split('/')
+                if len(parts) == 1:
+                    return parts[0] in manifest['files'] or parts[0] in manifest['nodes']
+                if len(parts) == 2:
+                    return parts[0] in manifest['nodes'] and parts[1] in manifest['nodes'][parts[0]]
+                return None
+    return None
+
+def open_source_file(path, mode = 'r'):
+    """Opens a report file from a mounted archive or from the file system"""
+    if _manifest_exists(path) is False:
+        raise FileNotFoundError(2, 'No such file or directory', path)
+    source = _mounted_source(path)
+    if source is None:
+        return open(path, mode)
+    return source.open(path, mode)
+
+def source_exists(path):
+    exists = _manifest_exists(path)
+    if exists is not None:
+        return exists
+    source = _mounted_source(path)
+    if source is None:
+        return os.path.exists(path)
+    return source.exists(path)
+
+def source_file_path(path):
+    """Returns a file system path for path, spooling it out of a mounted archive when needed"""
+    source = _mounted_source(path)
+    if source is None:
+        return path
+    return source.file_path(path)
+
+def list_source_dirs(path):
+    source = _mounted_source(path)
+    if source is None:
+        return [ f.path for f in os.scandir(path) if f.is_dir() ]
+    return source.subdirs(path)
+
+def mount_files(dirpath, files):
+    """Mounts files, a dict of file names and their contents, as the directory dirpath"""
+    source = ArchiveSource(os.path.normpath(dirpath))
+    for filename, content in files.items():
+        source.add_file(filename, io.BytesIO(content), len(content))
+    with _mounted_lock:
+        _mounted_sources[source.root] = source
+    return source.root
+
+def unmount_archive(path):
+    with _mounted_lock:
+        source = _mounted_sources.pop(os.path.normpath(path), None)
+    if source is not None:
+        source.close()
+
+@atexit.register
+def _unmount_all():
+    for path in list(_mounted_sources.keys()):
+        unmount_archive(path)
 
 def valid_archive_dir(msg, given_path):
     TEST_FILES = ['description.txt', 'analysis.txt']
+    if is_mounted(given_path):
+        for test_file in TEST_FILES:
+            file_path = given_path + '/' + test_file
+            if not source_exists(file_path):
+                msg.min(" ERROR:", "Invalid cluster report archive: {0}".format(given_path))
+                msg.min(" * Missing", "{0}".format(file_path))
+                return False
+        return True
     if not os.access(given_path, os.R_OK | os.X_OK):
         msg.min(" ERROR:", "Directory permission denied: {0}".format(given_path))
         msg.min(" * Suggestion", "Try sudo {} {}".format(tool_name, given_path))
@@ -247,27 +691,312 @@ def valid_archive_dir(msg, given_path):
                 return False
     return True
 
-def extract_archive(msg, tarball):
+class DecompressedStream():
+    """
+    Decompresses an archive into a pipe read by tarfile, so decoding and
+    unpacking run at the same time. Uses a multithreaded external
+    decompressor when one is installed, otherwise decodes in a thread.
+    """
+    CHUNK_SIZE = 1048576
+    COMPRESSIONS = {
+        'application/x-xz': 'xz',
+        'application/x-bzip2': 'bzip2',
+        'application/x-gzip': 'gzip',
+        'application/zstd': 'zstd',
+    }
+    # Preferred external decompressors, {} is replaced by the thread count
+    COMMANDS = {
+        'xz': [['xz', '-dc', '-T{}']],
+        'bzip2': [['pbzip2', '-dc', '-p{}'], ['lbzip2', '-dc', '-n{}']],
+        'gzip': [['pigz', '-dc', '-p{}']],
+        'zstd': [['zstd', '-dc', '-T{}']],
+    }
+    OPENERS = {
+        'xz': lzma.open,
+        'bzip2': bz2.open,
+        'gzip': gzip.open,
+    }
+
+    def __init__(self, path, threads = 0):
+        self.path = path
+        self.threads = threads if threads > 0 else len(os.sched_getaffinity(0))
+        self.compression = self.detect(path)
+        self.command = []
+        self.process = None
+        self.thread = None
+        self.thread_error = None
+        self.stream = None
+        self.stopped = False
+
+    @classmethod
+    def detect(cls, path):
+        return cls.COMPRESSIONS.get(sniff_mime_type(path), '')
+
+    def __find_command(self):
+        for command in self.COMMANDS.get(self.compression, []):
+            if shutil.which(command[0]):
+                return [ arg.format(self.threads) for arg in command ] + [self.path]
+        return []
+
+    def __decode(self, fd_write):
+        try:
+            with self.OPENERS[self.compression](self.path, 'rb') as compressed, os.fdopen(fd_write, 'wb') as pipe:
+                while True:
+                    chunk = compressed.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    pipe.write(chunk)
+        except BrokenPipeError:
+            # The reader stopped early
+            pass
+        except Exception as exc:
+            self.thread_error = exc
+
+    def open(self):
+        if not self.compression:
+            self.stream = open(self.path, 'rb')
+            return self.stream
+        self.command = self.__find_command()
+        if self.command:
+            self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=self.CHUNK_SIZE)
+            self.stream = self.process.stdout
+        elif self.compression in self.OPENERS:
+            fd_read, fd_write = os.pipe()
+            self.thread = threading.Thread(target=self.__decode, args=(fd_write,), daemon=True)
+            self.thread.start()
+            self.stream = os.fdopen(fd_read, 'rb', buffering=self.CHUNK_SIZE)
+        else:
+            raise tarfile.CompressionError("No {} decompressor found".format(self.compression))
+        return self.stream
+
+    def close(self, complete = True):
+        """Closes the stream, raising OSError when a complete read hit a decompression error"""
+        error = ''
+        if complete:
+            # tarfile stops at the end of archive marker, drain the padding behind it
+            while self.stream.read(self.CHUNK_SIZE):
+                pass
+        if self.process is not None:
+            if not complete:
+                self.process.kill()
+            self.stream.close()
+            stderr = self.process.stderr.read().decode(errors='replace').strip()
+            self.process.stderr.close()
+            if self.process.wait() != 0 and complete:
+                error = "{} failed: {}".format(self.command[0], stderr)
+        else:
+            self.stream.close()
+            if self.thread is not None:
+                self.thread.join()
+                if self.thread_error is not None and complete:
+                    error = str(self.thread_error)
+        if error:
+            raise OSError(error)
+
+    def __enter__(self):
+        return self.open()
+
+    def stop(self):
+        """Marks the stream as abandoned, the rest of the archive is neither read nor checked"""
+        self.stopped = True
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(exc_type is None and not self.stopped)
+        return False
+
+def _extract_wanted(member_path, extract_filter):
+    """
+    Returns True if the member belongs in the extracted report. Only files in the
+    report directory or one node directory below it are matched against the filter.
+    """
+    if extract_filter is None:
+        return True
+    parts = member_path.split('/')
+    if len(parts) < 2 or len(parts) > 3:
+        return False
+    return parts[-1] in extract_filter
+
+_scratch_dirs = set()
+
+def _scratch_dir(msg, scratch):
+    """
+    Creates a private directory in the memory backed scratch path. Returns the
+    directory and the number of bytes that may be written to it.
+    """
+    if not scratch.get('path') or scratch.get('size', 0) <= 0:
+        return ['', 0]
+    try:
+        fs_stat = os.statvfs(scratch['path'])
+        dirpath_scratch = tempfile.mkdtemp(prefix='pcratool-scratch-', dir=scratch['path'])
+    except OSError as exc:
+        msg.verbose(" Scratch Disabled", str(exc))
+        return ['', 0]
+    _scratch_dirs.add(dirpath_scratch)
+    return [dirpath_scratch, min(scratch['size'], int(fs_stat.f_bavail * fs_stat.f_frsize * 0.9))]
+
+def remove_scratch(dirpath_scratch):
+    _scratch_dirs.discard(dirpath_scratch)
+    rmtree(dirpath_scratch, ignore_errors=True)
+
+@atexit.register
+def _remove_all_scratch():
+    for dirpath_scratch in list(_scratch_dirs):
+        remove_scratch(dirpath_scratch)
+
+def _keep_scratch_files(dirpath, dirpath_scratch):
+    """Replaces the links under dirpath into dirpath_scratch with the files themselves"""
+    for root, dirs, files in os.walk(dirpath):
+        for filename in files:
+            file_path = os.path.join(root, filename)
+            if os.path.islink(file_path) and os.readlink(file_path).startswith(dirpath_scratch + '/'):
+                shutil.move(os.readlink(file_path), file_path + '.scratch')
+                os.replace(file_path + '.scratch', file_path)
+
+def release_scratch(file_data, keep):
+    """Removes the scratch directory of file_data, moving its files to the extraction directory when kept"""
+    dirpath_scratch = file_data.get('dirpath_scratch', '')
+    if not dirpath_scratch:
+        return
+    if keep and file_data.get('dirpath_embedded', ''):
+        _keep_scratch_files(file_data['dirpath_embedded'], dirpath_scratch)
+    remove_scratch(dirpath_scratch)
+    file_data['dirpath_scratch'] = ''
+
+def extract_archive(msg, tarball, extract_filter = None):
+    """
+    Extracts the archive into its extraction directory. With a scratch size
+    configured, regular files are written to the memory backed scratch path
+    until the size is used up and linked from the extraction directory, the
+    rest spill to the extraction directory itself.
+    """
     path_in_tarball = ''
     archfile = tarball['path'] 
     archdir = tarball['dirpath_extract_here']
     msg.verbose(" Extracting File", archfile)
     msg.debug("archdir", archdir)
-    cmd = "tar -xvf "  + archfile + " -C " + archdir
-    msg.debug('Process Command', cmd)
-    process = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-    stdout, stderr = process.communicate()
-    outfile = stdout.splitlines()[0]
-    msg.debug("outfile", outfile)
-    rc = process.returncode
-    if( rc > 0 ):
+    members_total = 0
+    members_extracted = 0
+    members_scratch = 0
+    node_dirs = set()
+    extract_workers = tarball.get('resources', {}).get('extract_workers', 0)
+    dirpath_scratch, scratch_free = _scratch_dir(msg, tarball.get('scratch', {}))
+    tarball['dirpath_scratch'] = dirpath_scratch
+    try:
+        with DecompressedStream(archfile, extract_workers) as stream, tarfile.open(fileobj=stream, mode='r|') as tar:
+            for member in tar:
+                member_path = os.path.normpath(member.name).lstrip('/')
+                if not path_in_tarball:
+                    path_in_tarball = archdir + '/' + member_path.split('/')[0]
+                members_total += 1
+                parts = member_path.split('/')
+                if len(parts) > 2:
+                    # Keep node directories even when none of their files are wanted
+                    node_dirs.add('/'.join(parts[:2]))
+                if member.isdir() or not (member.isfile() or member.issym()):
+                    continue
+                if not _extract_wanted(member_path, extract_filter):
+                    msg.debug("> skipped", member_path)
+                    continue
+                extract_here = archdir
+                if dirpath_scratch and member.isfile() and member.size <= scratch_free:
+                    extract_here = dirpath_scratch
+                if hasattr(tarfile, 'data_filter'):
+                    try:
+                        tar.extract(member, extract_here, set_attrs=False, filter='data')
+                    except tarfile.FilterError as exc:
+                        # One unsafe member, such as a link pointing outside the report, is left out
+                        msg.min(" Skipped Member", "{} - {}".format(member_path, str(exc)))
+                        continue
+                else:
+                    tar.extract(member, extract_here, set_attrs=False)
+                if member.isfile():
+                    # Only the modification time is kept of the attributes set_attrs would set
+                    os.utime(extract_here + '/' + member_path, (member.mtime, member.mtime))
+                if extract_here == dirpath_scratch:
+                    scratch_free -= member.size
+                    link_path = archdir + '/' + member_path
+                    os.makedirs(os.path.dirname(link_path), exist_ok=True)
+                    if os.path.lexists(link_path):
+                        os.remove(link_path)
+                    os.symlink(dirpath_scratch + '/' + member_path, link_path)
+                    members_scratch += 1
+                members_extracted += 1
+        for node_dir in node_dirs:
+            os.makedirs(archdir + '/' + node_dir, exist_ok=True)
+    except (tarfile.TarError, OSError) as exc:
+        if dirpath_scratch:
+            remove_scratch(dirpath_scratch)
         print(" Error: Cannot extract tar file", file=sys.stderr)
-        print(stderr, file=sys.stderr)
+        print(exc, file=sys.stderr)
         print(file=sys.stderr)
         sys.exit(7)
-    else:
-        path_in_tarball = archdir + '/' + os.path.dirname(outfile).split("/")[0]
-        msg.min(' Embedded Directory', path_in_tarball)
+
+    if not path_in_tarball:
+        print(" Error: Cannot extract tar file", file=sys.stderr)
+        print("Empty archive: {}".format(archfile), file=sys.stderr)
+        print(file=sys.stderr)
+        sys.exit(7)
+    msg.verbose(" Extracted Members", "{} of {}".format(members_extracted, members_total))
+    if dirpath_scratch:
+        msg.verbose(" Scratch Members", "{} in {}".format(members_scratch, dirpath_scratch))
+    msg.min(' Embedded Directory', path_in_tarball)
+
+    return path_in_tarball
+
+def mount_archive(msg, tarball, extract_filter = None, stop_check = None):
+    """
+    Indexes the archive members passing extract_filter without writing them to
+    the extraction directory. Returns the embedded directory path the report
+    files are opened from, see open_source_file. Reading stops early once
+    stop_check(source, member_path) returns True.
+    """
+    path_in_tarball = ''
+    archfile = tarball['path']
+    archdir = tarball['dirpath_extract_here']
+    msg.verbose(" Mounting File", archfile)
+    source = None
+    members_total = 0
+    members_mounted = 0
+    extract_workers = tarball.get('resources', {}).get('extract_workers', 0)
+    decompressed = DecompressedStream(archfile, extract_workers)
+    try:
+        with decompressed as stream, tarfile.open(fileobj=stream, mode='r|') as tar:
+            for member in tar:
+                member_path = os.path.normpath(member.name).lstrip('/')
+                if source is None:
+                    path_in_tarball = os.path.normpath(archdir + '/' + member_path.split('/')[0])
+                    source = ArchiveSource(path_in_tarball)
+                members_total += 1
+                parts = member_path.split('/')
+                if len(parts) > 2:
+                    source.add_dir('/'.join(parts[1:2]))
+                if member.isdir():
+                    if len(parts) == 2:
+                        source.add_dir(parts[1])
+                elif member.isfile() and _extract_wanted(member_path, extract_filter):
+                    source.add_file('/'.join(parts[1:]), tar.extractfile(member), member.size, int(member.mtime))
+                    members_mounted += 1
+                if stop_check is not None and stop_check(source, '/'.join(parts[1:])):
+                    msg.verbose(" Stopped Reading", "after {} members".format(members_total))
+                    decompressed.stop()
+                    break
+    except (tarfile.TarError, OSError) as exc:
+        if source is not None:
+            source.close()
+        print(" Error: Cannot read tar file", file=sys.stderr)
+        print(exc, file=sys.stderr)
+        print(file=sys.stderr)
+        sys.exit(7)
+
+    if source is None:
+        print(" Error: Cannot read tar file", file=sys.stderr)
+        print("Empty archive: {}".format(archfile), file=sys.stderr)
+        print(file=sys.stderr)
+        sys.exit(7)
+    with _mounted_lock:
+        _mounted_sources[path_in_tarball] = source
+    msg.verbose(" Mounted Members", "{} of {}".format(members_mounted, members_total))
+    msg.min(' Embedded Directory', path_in_tarball)
 
     return path_in_tarball
 
@@ -276,13 +1005,164 @@ def i_am_root():
         return False
     return True
 
+class TrashCollector():
+    """
+    Removes directory trees in the background. A tree is first renamed into a
+    TRASH_DIR next to it, so it is gone from its original path at once, and then
+    deleted by a thread the tool waits for only at exit, for at most exit_wait
+    seconds. Worker processes only rename, the main process deletes what they
+    return from take_pending(). Trash left by an interrupted run is deleted by
+    resume() on the next start.
+    """
+    TRASH_DIR = '.pcratool-trash'
+    EXIT_WAIT = 60
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.pending = []
+        self.exit_wait = self.EXIT_WAIT
+
+    def __in_main_process(self):
+        return multiprocessing.parent_process() is None
+
+    def __start(self):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__purge, daemon=True)
+                self.thread.start()
+
+    def __purge(self):
+        while True:
+            path = self.queue.get()
+            rmtree(path, ignore_errors=True)
+            trash_dir = os.path.dirname(path)
+            if os.path.basename(trash_dir) == self.TRASH_DIR:
+                try:
+                    os.rmdir(trash_dir)
+                except OSError:
+                    True
+            self.queue.task_done()
+
+    def collect(self, paths):
+        """Queues already trashed paths for deletion"""
+        if not paths:
+            return
+        self.__start()
+        for path in paths:
+            self.queue.put(path)
+
+    def discard(self, path):
+        path = os.path.normpath(path)
+        trash_dir = os.path.dirname(path) + '/' + self.TRASH_DIR
+        trash_path = "{}/{}.{}.{}".format(trash_dir, os.path.basename(path), os.getpid(), time.time_ns())
+        for attempt in range(2):
+            try:
+                os.makedirs(trash_dir, exist_ok=True)
+                os.rename(path, trash_path)
+                break
+            except FileNotFoundError:
+                # The purge thread removed the empty trash directory in between
+                continue
+            except OSError:
+                break
+        if os.path.exists(path):
+            # Not movable, remove it in place
+            rmtree(path, ignore_errors=True)
+            return
+        if self.__in_main_process():
+            self.collect([trash_path])
+        else:
+            self.pending.append(trash_path)
+
+    def take_pending(self):
+        pending = self.pending
+        self.pending = []
+        return pending
+
+    def resume(self, dirpath):
+        """Queues any trash and spool directories left in dirpath by an earlier run"""
+        try:
+            with os.scandir(dirpath) as entries:
+                spool_dirs = [ entry.path for entry in entries if entry.name.startswith(SPOOL_PREFIX) and _spool_abandoned(entry.name) ]
+        except OSError:
+            spool_dirs = []
+        for spool_dir in spool_dirs:
+            self.discard(spool_dir)
+        trash_dir = os.path.normpath(dirpath) + '/' + self.TRASH_DIR
+        try:
+            paths = [ entry.path for entry in os.scandir(trash_dir) ]
+        except OSError:
+            return
+        self.collect(paths)
+
+    def wait(self, timeout=None):
+        """Waits for the queued trash to be deleted, returns False if timeout seconds passed first"""
+        if self.thread is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                if deadline is None:
+                    self.queue.all_tasks_done.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def abandon(self):
+        """Stops waiting at exit, the trash left is deleted by resume() on the next start"""
+        self.exit_wait = 0
+
+trash = TrashCollector()
+
+@atexit.register
+def _wait_trash():
+    # The purge thread is a daemon, whatever it has not deleted stays in TRASH_DIR
+    trash.wait(trash.exit_wait)
+
+def release_source(data):
+    """
+    Releases the manifest, the CIB graphs, the mount and the scratch directory
+    held for the source of data. Safe to call again once they are released.
+    """
+    release_manifest(data['source_data'].get('dirpath_data_source', ''))
+    release_cib_graphs(data['source_data'].get('dirpath_data_source', ''))
+    if data['source_data'].get('mounted', False):
+        unmount_archive(data['source_data'].get('dirpath_embedded', ''))
+    release_scratch(data['source_data'], not data['source_data']['remove_directory'])
+
+def _remove_directory(msg, source_data, dirpath):
+    if source_data.get('cleanup', 'background') == 'background':
+        msg.verbose(" Removing Directory", dirpath)
+        trash.discard(dirpath)
+    else:
+        try:
+            rmtree(dirpath)
+        except:
+            True
+
+def remove_extracted(msg, source_data):
+    """Removes what an archive file was extracted to unless it is kept"""
+    if source_data.get('type', '') != 'file' or not source_data['remove_directory']:
+        return
+    dirpath_extract_entry = source_data.get('dirpath_extract_entry', '')
+    if dirpath_extract_entry:
+        if os.path.isdir(dirpath_extract_entry):
+            _remove_directory(msg, source_data, dirpath_extract_entry)
+    elif not source_data.get('mounted', False) and os.path.isdir(source_data.get('dirpath_embedded', '')):
+        _remove_directory(msg, source_data, source_data['dirpath_embedded'])
+
 def clean_up(msg, data):
+    release_source(data)
     if data['source_data']['valid']:
-        if data['source_data']['remove_directory']:
-            try:
-                rmtree(data['source_data']['dirpath_data_source'])
-            except:
-                True
+        if data['source_data']['type'] == 'file':
+            remove_extracted(msg, data['source_data'])
+        elif data['source_data']['remove_directory']:
+            _remove_directory(msg, data['source_data'], data['source_data']['dirpath_data_source'])
 
         if data['source_data']['remove_tarball']:
             try:
@@ -290,6 +1170,29 @@ def clean_up(msg, data):
             except:
                 True
 
+ARCHIVE_MAGIC = [
+#   [offset, magic bytes, mime type]
+    [0, b'\xfd7zXZ\x00', 'application/x-xz'],
+    [0, b'BZh', 'application/x-bzip2'],
+    [0, b'\x1f\x8b', 'application/x-gzip'],
+    [0, b'\x28\xb5\x2f\xfd', 'application/zstd'],
+    [257, b'ustar', 'application/x-tar'],
+]
+
+def sniff_mime_type(path):
+    """Returns the archive mime type of path from its leading bytes, like file --brief --mime-type"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(512)
+    except OSError:
+        return ''
+    if not header:
+        return 'inode/x-empty'
+    for offset, magic, mime_type in ARCHIVE_MAGIC:
+        if header[offset:offset+len(magic)] == magic:
+            return mime_type
+    return 'application/octet-stream'
+
 def evaluate_given_path(msg, given_path):
     given_results = {
         'exists': False, 
@@ -317,11 +1220,7 @@ def evaluate_given_path(msg, given_path):
         if given_results['tail_read']:
             if os.path.isfile(given_results['path']):
                 given_results['type'] = 'file'
-                cmd = "file --brief --mime-type " + given_path
-                msg.debug('Process Command', cmd)
-                process = subprocess.Popen(cmd.split(), stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
-                stdout, stderr = process.communicate()
-                given_results['tail_mime_type'] = stdout.strip()
+                given_results['tail_mime_type'] = sniff_mime_type(given_results['path'])
             elif os.path.isdir(given_results['path']):
                 given_results['type'] = 'dir'
                 given_results['tail_mime_type'] = 'inode/directory'